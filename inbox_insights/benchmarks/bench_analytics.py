@@ -0,0 +1,94 @@
+"""
+Analytics benchmark.
+
+Builds a synthetic mailbox of the requested size with realistic skew (a few
+heavy senders, threads, replies, unread mail), stores it as a Parquet
+dataset, then times loading it and every report in src.analytics.
+
+Usage (from inbox_insights/):
+    python -m benchmarks.bench_analytics --messages 1000000
+"""
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from src import analytics
+
+LABEL_SETS = [
+    ['INBOX'], ['INBOX', 'UNREAD'], ['INBOX', 'IMPORTANT'], ['INBOX', 'UNREAD', 'CATEGORY_PROMOTIONS'],
+    ['SENT'], ['CATEGORY_UPDATES'], ['INBOX', 'STARRED'], ['Receipts'], ['Work', 'UNREAD'],
+]
+
+
+def make_dataset(count: int, seed: int = 0) -> pd.DataFrame:
+    """Synthetic analytics columns for count messages."""
+    rng = np.random.default_rng(seed)
+    ids = np.array([f"{n:016x}" for n in range(count)], dtype=object)
+    message_ids = np.array([f"<{message_id}@mail.example.com>" for message_id in ids], dtype=object)
+
+    # Zipf-distributed senders over a few hundred domains
+    senders = np.array([f"sender{n}@domain{n % 300}.example.com" for n in range(20000)], dtype=object)
+    sender_index = np.minimum(rng.zipf(1.3, count) - 1, len(senders) - 1)
+
+    # Roughly 40% of messages reply to an earlier message in the last 1000
+    is_reply = rng.random(count) < 0.4
+    parent = np.maximum(np.arange(count) - rng.integers(1, 1000, count), 0)
+    in_reply_to = np.where(is_reply, message_ids[parent], '')
+    thread = np.where(is_reply, parent, np.arange(count))
+
+    start = pd.Timestamp('2021-01-01', tz='UTC').value // 10**6
+    dates = np.sort(rng.integers(start, start + 3 * 365 * 86400 * 1000, count))
+    labels = np.empty(len(LABEL_SETS), dtype=object)
+    labels[:] = LABEL_SETS
+
+    return pd.DataFrame({
+        'id': ids,
+        'threadId': pd.Series(thread).map('{:016x}'.format),
+        'internalDate': pd.to_datetime(dates, unit='ms', utc=True),
+        'from_address': senders[sender_index],
+        'labels': labels[rng.integers(0, len(LABEL_SETS), count)],
+        'rfc822_message_id': message_ids,
+        'in_reply_to': in_reply_to,
+    })
+
+
+def timed(name: str, func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    print(f"{name:<20} {time.perf_counter() - t0:8.3f}s")
+    return result
+
+
+def run(count: int) -> None:
+    df = make_dataset(count)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / 'bench.parquet'
+        df.to_parquet(path, index=False)
+        del df
+
+        print(f"{count:,} messages")
+        start = time.perf_counter()
+        df = timed('load_dataset', analytics.load_dataset, path)
+        timed('top_senders', analytics.top_senders, df)
+        timed('top_domains', analytics.top_domains, df)
+        timed('volume_by_hour', analytics.volume_by_hour, df)
+        timed('label_distribution', analytics.label_distribution, df)
+        timed('thread_depth', analytics.thread_depth, df)
+        latency = timed('reply_latency', analytics.reply_latency, df)
+        timed('unread_backlog_age', analytics.unread_backlog_age, df)
+        print(f"{'total':<20} {time.perf_counter() - start:8.3f}s  ({len(latency):,} replies matched)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analytics benchmark')
+    parser.add_argument('--messages', type=int, default=1_000_000, help='Number of synthetic messages')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    run(args.messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Checkpoint write benchmark.
+
+Appends DUMP_FREQUENCY-sized batches until the checkpoint holds the target
+number of IDs and reports the per-batch cost at increasing fill levels. With
+the append-only log the cost stays flat; the old format rewrote every ID on
+each save.
+
+Usage (from inbox_insights/):
+    python -m benchmarks.bench_checkpoint --ids 1000000
+"""
+import argparse
+import logging
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from config.settings import DUMP_FREQUENCY
+from src.checkpoint_manager import CheckpointManager
+
+
+def run(total_ids: int, batch_size: int, report_every: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = CheckpointManager(Path(tmp_dir))
+        timings = []
+        start = time.perf_counter()
+        for batch_start in range(0, total_ids, batch_size):
+            batch = [f"{n:016x}" for n in range(batch_start, min(batch_start + batch_size, total_ids))]
+            t0 = time.perf_counter()
+            manager.append_checkpoint('bench', batch)
+            timings.append(time.perf_counter() - t0)
+            written = batch_start + len(batch)
+            if written % report_every == 0 or written == total_ids:
+                window = timings[-(report_every // batch_size):]
+                print(f"{written:>10,} ids  "
+                      f"mean {statistics.mean(window) * 1e3:7.3f} ms/batch  "
+                      f"median {statistics.median(window) * 1e3:7.3f} ms/batch  "
+                      f"max {max(window) * 1e3:8.3f} ms")
+        elapsed = time.perf_counter() - start
+
+        t0 = time.perf_counter()
+        loaded = manager.load_checkpoint('bench')
+        load_time = time.perf_counter() - t0
+
+    print(f"total {elapsed:.2f}s for {len(timings):,} batches, "
+          f"resume load of {len(loaded):,} ids in {load_time * 1e3:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Checkpoint append benchmark')
+    parser.add_argument('--ids', type=int, default=1_000_000, help='Total number of IDs to checkpoint')
+    parser.add_argument('--batch-size', type=int, default=DUMP_FREQUENCY, help='IDs per append')
+    parser.add_argument('--report-every', type=int, default=100_000, help='IDs between report lines')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    run(args.ids, args.batch_size, args.report_every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Filter rule matcher benchmark.
+
+Generates a few hundred rules of every kind (sender, domain, List-Id,
+labels, subject and body keywords and regexes) and synthetic processed
+messages, then compares RuleMatcher with testing every rule against every
+message one at a time, and checks that both agree.
+
+Usage (from inbox_insights/):
+    python -m benchmarks.bench_filters --messages 20000 --rules 500
+"""
+import argparse
+import logging
+import random
+import time
+from typing import List, Dict, Any
+from benchmarks.synthetic import WORDS
+from src.filters import FilterRule, RuleMatcher
+
+VOCABULARY = WORDS + [f"w{n}" for n in range(3000)]
+LABELS = ['INBOX', 'UNREAD', 'IMPORTANT', 'CATEGORY_PROMOTIONS', 'Work', 'Receipts']
+
+
+def make_rules(count: int, seed: int = 0) -> List[FilterRule]:
+    rng = random.Random(seed)
+    rules = []
+    for n in range(count):
+        kind = n % 8
+        name = f"rule{n}"
+        if kind == 0:
+            rules.append(FilterRule(name, sender=f"sender{rng.randrange(2000)}@domain{rng.randrange(300)}.example.com"))
+        elif kind == 1:
+            rules.append(FilterRule(name, sender=f"@domain{rng.randrange(300)}.example.com",
+                                    subject=f"(?i){rng.choice(VOCABULARY)}"))
+        elif kind == 2:
+            rules.append(FilterRule(name, list_id=f"list{rng.randrange(100)}.example.com"))
+        elif kind == 3:
+            rules.append(FilterRule(name, subject=rng.choice(VOCABULARY)))
+        elif kind == 4:
+            rules.append(FilterRule(name, body=f"{rng.choice(VOCABULARY)} {rng.choice(VOCABULARY)}"))
+        elif kind == 5:
+            rules.append(FilterRule(name, body=f"(?i){rng.choice(VOCABULARY)}\\s+\\w+\\s+{rng.choice(VOCABULARY)}"))
+        elif kind == 6:
+            rules.append(FilterRule(name, subject=rf"order #\d{{{rng.randint(3, 6)}}}\b",
+                                    labels=[rng.choice(LABELS)]))
+        else:
+            rules.append(FilterRule(name, labels=rng.sample(LABELS, 2), body=rng.choice(VOCABULARY)))
+    return rules
+
+
+def make_messages(count: int, seed: int = 1) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    messages = []
+    for n in range(count):
+        subject = ' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(3, 10)))
+        if rng.random() < 0.1:
+            subject += f" order #{rng.randrange(10**6)}"
+        messages.append({
+            'id': f"{n:016x}",
+            'from_address': f"sender{rng.randrange(2000)}@domain{rng.randrange(300)}.example.com",
+            'to_addresses': [],
+            'cc_addresses': [],
+            'subject': subject,
+            'list_id': f"list{rng.randrange(400)}.example.com" if rng.random() < 0.3 else '',
+            'body': ' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(50, 400))),
+            'labels': rng.sample(LABELS, rng.randint(1, 3)),
+        })
+    return messages
+
+
+def run(message_count: int, rule_count: int) -> None:
+    rules = make_rules(rule_count)
+    messages = make_messages(message_count)
+
+    start = time.perf_counter()
+    matcher = RuleMatcher(rules)
+    print(f"compiled {rule_count} rules in {time.perf_counter() - start:.3f}s")
+
+    start = time.perf_counter()
+    compiled = [matcher.match(message) for message in messages]
+    elapsed = time.perf_counter() - start
+    print(f"{'compiled':<10} {message_count / elapsed:10,.0f} msgs/sec")
+
+    sample = messages[:max(message_count // 10, 1)]
+    start = time.perf_counter()
+    naive = [[rule.name for rule in rules if rule.matches(message)] for message in sample]
+    elapsed = time.perf_counter() - start
+    print(f"{'naive':<10} {len(sample) / elapsed:10,.0f} msgs/sec (on {len(sample):,} messages)")
+
+    mismatches = sum(a != b for a, b in zip(compiled, naive))
+    matched = sum(len(names) for names in compiled)
+    print(f"{matched:,} rule matches, {mismatches} mismatches against the naive results")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Filter rule matcher benchmark')
+    parser.add_argument('--messages', type=int, default=20_000, help='Number of synthetic messages')
+    parser.add_argument('--rules', type=int, default=500, help='Number of rules')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    run(args.messages, args.rules)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+End-to-end ingestion benchmark against the local fake Gmail server.
+
+For each mailbox size, starts a FakeGmailServer in one process and runs a
+full save_messages session (listing, batched fetches, parsing, sink writes
+and checkpoints) against it in another, through the real googleapiclient
+(or aiohttp) transport. Reports throughput, p50/p99 latency of each stage's
+calls and the client's peak RSS, and stores the results as JSON so runs can
+be compared with --compare.
+
+Stages are the ones the pipeline records in its InMemoryMetrics (see
+src/metrics.STAGES); their percentiles are interpolated within histogram
+buckets. The client's API call, retry and byte counters are stored too.
+
+Usage (from inbox_insights/):
+    python -m benchmarks.bench_ingest --sizes 10000 100000 1000000 --mode pipelined
+    python -m benchmarks.bench_ingest --sizes 10000 --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Optional
+from config.settings import BATCH_SIZE, DUMP_FREQUENCY, FETCH_PROFILE, OUTPUT_FORMAT
+from .fake_gmail_server import SyntheticMailbox, FakeGmailServer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+MODES = ('sequential', 'pipelined', 'async')
+
+
+def _peak_rss_mib() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere
+    return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1)
+
+
+def _serve(options: Dict[str, Any], urls: multiprocessing.Queue) -> None:
+    """Server process: build the mailbox and answer requests until terminated."""
+    mailbox = SyntheticMailbox(options['size'], options['seed'], options['complexity'])
+    server = FakeGmailServer(mailbox, latency=options['latency'] / 1000,
+                             error_rate=options['error_rate'], seed=options['seed'])
+    urls.put(server.url)
+    server.serve_forever()
+
+
+def _ingest(endpoint: str, options: Dict[str, Any], output_dir: Path, metrics) -> Optional[str]:
+    from google.auth.credentials import AnonymousCredentials
+    from src.async_gmail_client import AsyncGmailClient
+    from src.data_processor import DataProcessor
+    from src.gmail_client import GmailClient
+
+    processor_options = {
+        'output_format': options['output_format'],
+        'fetch_profile': options['fetch_profile'],
+        'output_dir': output_dir,
+        'interactive': False,
+        'metrics': metrics,
+    }
+    if options['mode'] == 'async':
+        async def run_async():
+            async with AsyncGmailClient(AnonymousCredentials(), api_endpoint=endpoint, metrics=metrics) as client:
+                messages, labels = await asyncio.gather(client.get_messages(), client.get_labels())
+                processor = DataProcessor(client, **processor_options)
+                return await processor.save_messages_async(
+                    messages, {label['id']: label['name'] for label in labels}, session_id='bench'
+                )
+        return asyncio.run(run_async())
+
+    client = GmailClient(AnonymousCredentials(), api_endpoint=endpoint, metrics=metrics)
+    labels = client.get_labels()
+    processor = DataProcessor(client, **processor_options)
+    return processor.save_messages(
+        client.iter_messages(),
+        {label['id']: label['name'] for label in labels},
+        session_id='bench',
+        num_workers=options['workers'] if options['mode'] == 'pipelined' else None,
+        parse_workers=options['parse_workers'] or None
+    )
+
+
+def _measure(endpoint: str, options: Dict[str, Any], results: multiprocessing.Queue) -> None:
+    """Client process, started fresh per size so its peak RSS is its own."""
+    # Retries of injected 429s are counted by the server; don't log each one
+    logging.basicConfig(level=logging.ERROR)
+    from src.metrics import InMemoryMetrics
+    metrics = InMemoryMetrics()
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        saved = _ingest(endpoint, options, Path(tmp), metrics)
+        elapsed = time.perf_counter() - start
+        output_bytes = sum(path.stat().st_size for path in Path(saved).rglob('*') if path.is_file()) \
+            if Path(saved).is_dir() else Path(saved).stat().st_size
+    summary = metrics.summary()
+    results.put({
+        'elapsed_seconds': round(elapsed, 3),
+        'messages_per_second': round(options['size'] / elapsed, 1),
+        'peak_rss_mib': _peak_rss_mib(),
+        'output_mib': round(output_bytes / 2**20, 1),
+        'stages': summary['stages'],
+        'client_counters': summary['counters'],
+    })
+
+
+def run_size(size: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Benchmark one mailbox size in fresh server and client processes.
+
+    Returns:
+        Result dict for the size
+    """
+    context = multiprocessing.get_context('spawn')
+    options = {**options, 'size': size}
+    urls, results = context.Queue(), context.Queue()
+    server = context.Process(target=_serve, args=(options, urls), daemon=True)
+    server.start()
+    try:
+        endpoint = urls.get(timeout=300)
+        client = context.Process(target=_measure, args=(endpoint, options, results))
+        client.start()
+        while client.is_alive() and results.empty():
+            client.join(timeout=1)
+        if results.empty():
+            raise RuntimeError(f"Benchmark client for {size:,} messages exited with code {client.exitcode}")
+        result = results.get()
+        client.join()
+        with urllib.request.urlopen(f"{endpoint}/_stats") as response:
+            result['api_calls'] = json.load(response)
+    finally:
+        server.terminate()
+        server.join()
+    return {'messages': size, **result}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_run(run: Dict[str, Any]) -> None:
+    print(f"{run['messages']:>10,} msgs  {run['messages_per_second']:>8,.0f} msgs/sec  "
+          f"{run['elapsed_seconds']:>8.1f}s  peak RSS {run['peak_rss_mib']} MiB  "
+          f"429s {run['api_calls'].get('429', 0)}")
+    for stage, stats in run['stages'].items():
+        print(f"{'':>12}{stage:<14} {stats['calls']:>9,} calls  p50 {stats['p50_ms']:9.2f}ms  "
+              f"p99 {stats['p99_ms']:9.2f}ms  total {stats['total_seconds']:8.1f}s")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Print throughput and stage p50 changes against an earlier report, per shared size."""
+    baseline_runs = {run['messages']: run for run in baseline['runs']}
+    for run in report['runs']:
+        old = baseline_runs.get(run['messages'])
+        if old is None:
+            continue
+        print(f"{run['messages']:>10,} msgs  msgs/sec {old['messages_per_second']:,.0f} -> "
+              f"{run['messages_per_second']:,.0f} ({run['messages_per_second'] / old['messages_per_second']:.2f}x)  "
+              f"peak RSS {old['peak_rss_mib']} -> {run['peak_rss_mib']} MiB")
+        for stage, stats in run['stages'].items():
+            if stage in old['stages']:
+                print(f"{'':>12}{stage:<14} p50 {old['stages'][stage]['p50_ms']:9.2f} -> {stats['p50_ms']:9.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end ingestion benchmark against a fake Gmail server')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help='Mailbox sizes to benchmark')
+    parser.add_argument('--mode', choices=MODES, default='sequential', help='Ingestion path')
+    parser.add_argument('--workers', type=int, default=4, help='Fetch workers in pipelined mode')
+    parser.add_argument('--parse-workers', type=int, default=0, help='Parse processes (0 parses inline)')
+    parser.add_argument('--fetch-profile', default=FETCH_PROFILE, help='Fetch profile')
+    parser.add_argument('--output-format', default=OUTPUT_FORMAT, help='Output sink')
+    parser.add_argument('--complexity', type=int, default=3, help='Scales MIME body size')
+    parser.add_argument('--latency', type=float, default=0.0, help='Server milliseconds per HTTP request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of message fetches failing with 429')
+    parser.add_argument('--seed', type=int, default=0, help='Mailbox random seed')
+    parser.add_argument('--output', type=Path, help='Results file (default: benchmarks/results/ingest_<time>.json)')
+    parser.add_argument('--compare', type=Path, help='Earlier results file to compare against')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    # Progress bars of the client processes would interleave with the report
+    os.environ.setdefault('TQDM_DISABLE', '1')
+
+    options = {
+        'mode': args.mode, 'workers': args.workers, 'parse_workers': args.parse_workers,
+        'fetch_profile': args.fetch_profile, 'output_format': args.output_format,
+        'complexity': args.complexity, 'latency': args.latency, 'error_rate': args.error_rate,
+        'seed': args.seed,
+    }
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'options': {**options, 'batch_size': BATCH_SIZE, 'dump_frequency': DUMP_FREQUENCY},
+        'runs': [],
+    }
+    output = args.output or RESULTS_DIR / f"ingest_{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    for size in args.sizes:
+        report['runs'].append(run_size(size, options))
+        _print_run(report['runs'][-1])
+        # Keep what has been measured if a larger size is interrupted
+        output.write_text(json.dumps(report, indent=2))
+    print(f"results written to {output}")
+
+    if args.compare:
+        compare(report, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
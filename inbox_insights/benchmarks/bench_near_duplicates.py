@@ -0,0 +1,83 @@
+"""
+Near-duplicate clustering benchmark.
+
+Builds a synthetic mailbox in which most messages are editions of a few
+hundred newsletter templates with personalised names, dates and links, and
+the rest are unique, then streams it through NearDuplicateIndex in
+DUMP_FREQUENCY-sized batches and reports throughput and cluster quality.
+
+Usage (from inbox_insights/):
+    python -m benchmarks.bench_near_duplicates --messages 100000
+"""
+import argparse
+import random
+import time
+from collections import Counter, defaultdict
+from typing import List, Tuple
+from benchmarks.synthetic import WORDS
+from config.settings import DUMP_FREQUENCY
+from src.near_duplicates import NearDuplicateIndex
+
+NAMES = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank', 'grace', 'heidi', 'ivan', 'judy']
+
+
+def make_corpus(count: int, templates: int = 300, unique_share: float = 0.3,
+                seed: int = 0) -> Tuple[List[str], List[int]]:
+    """
+    Synthetic bodies and their true template (-1 for unique messages).
+    """
+    rng = random.Random(seed)
+    vocabulary = WORDS + [f"w{n}" for n in range(5000)]
+    bodies = [' '.join(rng.choice(vocabulary) for _ in range(rng.randint(80, 300))) for _ in range(templates)]
+    texts, truth = [], []
+    for n in range(count):
+        if rng.random() < unique_share:
+            texts.append(' '.join(rng.choice(vocabulary) for _ in range(rng.randint(20, 200))))
+            truth.append(-1)
+            continue
+        template = rng.randrange(templates)
+        texts.append(
+            f"Hi {rng.choice(NAMES)}, your update for {rng.randint(1, 28)}/{rng.randint(1, 12)} "
+            f"{bodies[template]} view online https://example.com/t/{n} unsubscribe"
+        )
+        truth.append(template)
+    return texts, truth
+
+
+def run(count: int) -> None:
+    texts, truth = make_corpus(count)
+    ids = [f"{n:016x}" for n in range(count)]
+    index = NearDuplicateIndex()
+
+    start = time.perf_counter()
+    cluster_ids = []
+    for offset in range(0, count, DUMP_FREQUENCY):
+        cluster_ids += index.assign(ids[offset:offset + DUMP_FREQUENCY], texts[offset:offset + DUMP_FREQUENCY])
+    elapsed = time.perf_counter() - start
+
+    # Splits: clusters per template; merges: clusters holding more than one template or unique message
+    clusters_per_template = defaultdict(set)
+    members = defaultdict(Counter)
+    for cluster_id, template in zip(cluster_ids, truth):
+        if template >= 0:
+            clusters_per_template[template].add(cluster_id)
+        members[cluster_id][template] += 1
+    impure = sum(
+        1 for counts in members.values()
+        if len(counts) > 1 or counts.get(-1, 0) > 1
+    )
+    print(f"{count:,} messages in {elapsed:.2f}s ({count / elapsed:,.0f} msgs/sec)")
+    print(f"{len(index):,} clusters, {len(set(cluster_ids)):,} distinct cluster IDs")
+    print(f"templates split into {sum(map(len, clusters_per_template.values())) / len(clusters_per_template):.2f} "
+          f"clusters on average, {impure} impure clusters")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Near-duplicate clustering benchmark')
+    parser.add_argument('--messages', type=int, default=100_000, help='Number of synthetic messages')
+    args = parser.parse_args()
+    run(args.messages)
+
+
+if __name__ == "__main__":
+    main()
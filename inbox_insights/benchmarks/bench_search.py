@@ -0,0 +1,106 @@
+"""
+Search index benchmark.
+
+Streams a synthetic mailbox with a Zipf-distributed vocabulary into a
+SearchIndex one session-sized chunk at a time, then reports indexing
+throughput, segment count, index size on disk and BM25 query latency.
+With --vectors, messages are also embedded by HashingEmbedder, a cheap
+stand-in for a sentence embedding model that measures the cost of vector
+search (brute force and IVF), not its quality.
+
+Usage (from inbox_insights/):
+    python -m benchmarks.bench_search --messages 1000000 --vectors
+"""
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Iterator, Tuple
+import numpy as np
+from config.settings import SEARCH_SEGMENT_DOCS
+from src.search_index import SearchIndex
+
+VOCABULARY_SIZE = 50_000
+
+
+class HashingEmbedder:
+    """Random projections of the hashed leading words of a text; fast, deterministic and not semantic."""
+
+    name = 'hashing-benchmark'
+
+    def __init__(self, dim: int = 384, buckets: int = 4096, words: int = 16, seed: int = 0):
+        self.dim = dim
+        self.words = words
+        self._buckets = buckets
+        self._projection = np.random.default_rng(seed).standard_normal((buckets, dim)).astype(np.float32)
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), 2048):
+            tokens = [text.split()[:self.words] or [''] for text in texts[start:start + 2048]]
+            lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+            buckets = np.array([hash(token) % self._buckets for words in tokens for token in words])
+            offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            vectors[start:start + len(tokens)] = np.add.reduceat(self._projection[buckets], offsets, axis=0)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_chunks(count: int, seed: int = 0) -> Iterator[Tuple[List[str], List[str]]]:
+    """Synthetic (message IDs, texts) in chunks of SEARCH_SEGMENT_DOCS."""
+    rng = np.random.default_rng(seed)
+    words = np.array([f"w{rank}" for rank in range(VOCABULARY_SIZE)], dtype=object)
+    for start in range(0, count, SEARCH_SEGMENT_DOCS):
+        size = min(SEARCH_SEGMENT_DOCS, count - start)
+        lengths = rng.integers(20, 300, size)
+        ranks = np.minimum(rng.zipf(1.1, int(lengths.sum())) - 1, VOCABULARY_SIZE - 1)
+        tokens = words[ranks]
+        bounds = np.concatenate([[0], np.cumsum(lengths)])
+        texts = [' '.join(tokens[bounds[n]:bounds[n + 1]]) for n in range(size)]
+        yield [f"{start + n:016x}" for n in range(size)], texts
+
+
+def _latency(search, queries: List[str]) -> str:
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    return f"p50 {np.percentile(timings, 50):6.1f}ms  p99 {np.percentile(timings, 99):6.1f}ms"
+
+
+def run(count: int, vectors: bool, query_count: int) -> None:
+    embedder = HashingEmbedder() if vectors else None
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SearchIndex(Path(tmp) / 'search', embedder)
+        start = time.perf_counter()
+        for ids, texts in make_chunks(count):
+            index.add_documents(ids, texts)
+        elapsed = time.perf_counter() - start
+        size = sum(path.stat().st_size for path in (Path(tmp) / 'search').rglob('*') if path.is_file())
+        print(f"indexed {count:,} messages in {elapsed:.1f}s ({count / elapsed:,.0f} msgs/sec), "
+              f"{len(index._segments)} segments, {size / 2**20:,.0f} MiB on disk")
+
+        # Reopen, as a search would, so timings include cold memory-mapped reads
+        index = SearchIndex(Path(tmp) / 'search', embedder)
+        rng = np.random.default_rng(1)
+        rare = [f"w{a} w{b}" for a, b in rng.integers(100, 20_000, (query_count, 2))]
+        common = [f"w{a} w{b} w{c}" for a, b, c in rng.integers(0, 100, (query_count, 3))]
+        print(f"{'bm25 rare':<16} {_latency(index.search, rare)}")
+        print(f"{'bm25 common':<16} {_latency(index.search, common)}")
+        if vectors:
+            print(f"{'vectors':<16} {_latency(index.semantic_search, rare)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search index benchmark')
+    parser.add_argument('--messages', type=int, default=200_000, help='Number of synthetic messages')
+    parser.add_argument('--vectors', action='store_true', help='Also build and query the embedding index')
+    parser.add_argument('--queries', type=int, default=200, help='Queries per kind')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    run(args.messages, args.vectors, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+"""
+Local HTTP stand-in for the Gmail API serving a deterministic synthetic mailbox.
+
+Implements what the clients use: messages.list, messages.get, threads.get,
+labels.list, history.list, getProfile and the multipart /batch endpoint, with
+partial-response field masks, a fixed latency per HTTP request and randomly
+injected 429 errors. Messages are generated from their index on demand, so a
+mailbox of millions of messages costs one byte of label state per message.
+
+Point a client at it with
+    GmailClient(AnonymousCredentials(), api_endpoint=server.url)
+or run it on its own (from inbox_insights/):
+    python -m benchmarks.fake_gmail_server --messages 1000000 --latency 20 --error-rate 0.01
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from email.parser import BytesParser
+from functools import lru_cache
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+from uuid import uuid4
+import numpy as np
+from googleapiclient.errors import HttpError
+from src.fake_gmail import date_range, error_content, format_message, make_http_error
+from .synthetic import make_message, BASE_MS, INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+
+# Label of bit n in SyntheticMailbox.label_bits; every message is in the inbox
+SYSTEM_LABELS = ['INBOX', 'UNREAD', 'IMPORTANT', 'STARRED', 'CATEGORY_PERSONAL',
+                 'CATEGORY_UPDATES', 'CATEGORY_PROMOTIONS', 'CATEGORY_SOCIAL']
+HISTORY_LABELS = ['UNREAD', 'IMPORTANT', 'STARRED']  # Labels toggled by history records
+MAX_BATCH_REQUESTS = 100  # Gmail rejects larger batches
+BATCH_PATHS = ('/batch', '/batch/gmail/v1')
+LIST_PARAMS = ('labelIds', 'metadataHeaders')  # Query parameters that may repeat
+INJECTED_METHODS = ('messages.get', 'threads.get')  # Calls that may fail with 429
+
+ROUTES = [
+    ('messages.list', re.compile(r'/gmail/v1/users/[^/]+/messages')),
+    ('messages.get', re.compile(r'/gmail/v1/users/[^/]+/messages/([0-9a-f]+)')),
+    ('threads.get', re.compile(r'/gmail/v1/users/[^/]+/threads/([0-9a-f]+)')),
+    ('labels.list', re.compile(r'/gmail/v1/users/[^/]+/labels')),
+    ('history.list', re.compile(r'/gmail/v1/users/[^/]+/history')),
+    ('getProfile', re.compile(r'/gmail/v1/users/[^/]+/profile')),
+]
+
+_FIELD_PATH = re.compile(r'[\w.-]+(?:/[\w.-]+)*')
+
+
+def _parse_field_list(spec: str, position: int) -> Tuple[Dict[str, Any], int]:
+    tree: Dict[str, Any] = {}
+    while position < len(spec) and spec[position] != ')':
+        match = _FIELD_PATH.match(spec, position)
+        if match is None:
+            raise ValueError(f"Invalid field mask: {spec}")
+        *parents, name = match.group().split('/')
+        position = match.end()
+        subtree = None
+        if position < len(spec) and spec[position] == '(':
+            subtree, position = _parse_field_list(spec, position + 1)
+            position += 1
+        node = tree
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[name] = subtree
+        if position < len(spec) and spec[position] == ',':
+            position += 1
+    return tree, position
+
+
+@lru_cache(maxsize=64)
+def parse_fields(spec: str) -> Dict[str, Any]:
+    """
+    Parse a partial-response field mask such as 'id,payload(headers,body/data)'.
+
+    Returns:
+        Nested dict of selected field names; None selects a whole field
+    """
+    return _parse_field_list(spec.replace(' ', ''), 0)[0]
+
+
+def apply_fields(resource: Any, tree: Optional[Dict[str, Any]]) -> Any:
+    """Keep only the fields of a resource (or of each item of a list) selected by a parsed mask."""
+    if tree is None:
+        return resource
+    if isinstance(resource, list):
+        return [apply_fields(item, tree) for item in resource]
+    if isinstance(resource, dict):
+        return {name: apply_fields(resource[name], subtree) for name, subtree in tree.items() if name in resource}
+    return resource
+
+
+class SyntheticMailbox:
+    """
+    Deterministic mailbox of synthetic messages, generated on demand.
+
+    Message n is benchmarks.synthetic.make_message(n), with labels drawn from
+    SYSTEM_LABELS. Listing returns newest messages first, like Gmail. The
+    history holds label changes on random messages, consistent with their
+    current labels.
+    """
+
+    def __init__(self, size: int, seed: int = 0, complexity: int = 3, history: int = 0):
+        """
+        Initialize mailbox.
+
+        Args:
+            size: Number of messages
+            seed: Random seed; the same seed always yields the same mailbox
+            complexity: Scales MIME body size, see synthetic.make_payload
+            history: Number of history records
+        """
+        self.size = size
+        self.seed = seed
+        self.complexity = complexity
+
+        rng = np.random.default_rng(seed)
+        flags = rng.random((3, size)) < np.array([[0.3], [0.2], [0.05]])
+        self.label_bits = (
+            1
+            | flags[0].astype(np.uint8) << 1
+            | flags[1].astype(np.uint8) << 2
+            | flags[2].astype(np.uint8) << 3
+            | (1 << (4 + rng.integers(0, 4, size))).astype(np.uint8)
+        ).astype(np.uint8)
+
+        self.history = []
+        for n, label in zip(rng.integers(0, size, history).tolist(), rng.integers(0, len(HISTORY_LABELS), history).tolist()):
+            label = HISTORY_LABELS[label]
+            entry = {'message': {'id': f"{n:016x}", 'threadId': f"{n // 3:016x}", 'labelIds': self.label_ids(n)},
+                     'labelIds': [label]}
+            change = 'labelsAdded' if label in entry['message']['labelIds'] else 'labelsRemoved'
+            self.history.append({'id': str(len(self.history) + 2), change: [entry]})
+        self.history_id = len(self.history) + 1
+
+    def label_ids(self, n: int) -> List[str]:
+        bits = int(self.label_bits[n])
+        return [label for bit, label in enumerate(SYSTEM_LABELS) if bits >> bit & 1]
+
+    def _index(self, resource_id: str) -> int:
+        n = int(resource_id, 16)
+        if n >= self.size:
+            raise make_http_error(404, 'notFound')
+        return n
+
+    def get_message(self, message_id: str, format: str = 'full',
+                    metadataHeaders: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+        n = self._index(message_id)
+        message = make_message(n, self.seed, self.complexity, self.label_ids(n))
+        return format_message(message, format, metadataHeaders)
+
+    def get_thread(self, thread_id: str, **kwargs) -> Dict[str, Any]:
+        first = self._index(thread_id) * 3
+        if first >= self.size:
+            raise make_http_error(404, 'notFound')
+        return {
+            'id': thread_id,
+            'messages': [self.get_message(f"{n:016x}", **kwargs) for n in range(first, min(first + 3, self.size))]
+        }
+
+    def list_labels(self, **kwargs) -> Dict[str, Any]:
+        return {'labels': [{'id': label, 'name': label, 'type': 'system'} for label in SYSTEM_LABELS]}
+
+    def list_messages(self, maxResults: str = '100', labelIds: Optional[List[str]] = None,
+                      pageToken: Optional[str] = None, q: Optional[str] = None,
+                      **kwargs) -> Dict[str, Any]:
+        max_results = int(maxResults)
+        if any(label not in SYSTEM_LABELS for label in labelIds or []):
+            return {'resultSizeEstimate': 0}
+        required = sum(1 << SYSTEM_LABELS.index(label) for label in labelIds or [])
+        after, before = date_range(q)
+        low = max(0, math.ceil((after - BASE_MS) / INTERVAL_MS))
+        high = min(self.size, math.ceil((before - BASE_MS) / INTERVAL_MS)) if before != float('inf') else self.size
+        upper = int(pageToken) if pageToken else high
+
+        # Scan down from the page token in windows until the page is full
+        found: List[int] = []
+        while upper > low and len(found) < max_results:
+            start = max(low, upper - 4 * max_results)
+            window = np.flatnonzero((self.label_bits[start:upper] & required) == required)[::-1] + start
+            needed = max_results - len(found)
+            if len(window) >= needed:
+                found.extend(window[:needed].tolist())
+                upper = found[-1]
+                break
+            found.extend(window.tolist())
+            upper = start
+
+        results = {
+            'messages': [{'id': f"{n:016x}", 'threadId': f"{n // 3:016x}"} for n in found],
+            'resultSizeEstimate': len(found)
+        }
+        if upper > low:
+            results['nextPageToken'] = str(upper)
+        return results
+
+    def list_history(self, startHistoryId: str, maxResults: str = '100',
+                     labelId: Optional[str] = None, pageToken: Optional[str] = None,
+                     **kwargs) -> Dict[str, Any]:
+        start_id, max_results = int(startHistoryId), int(maxResults)
+        if self.history and start_id < int(self.history[0]['id']) - 1:
+            raise make_http_error(404, 'notFound')
+        records = [
+            record for record in self.history[max(start_id - 1, 0):]
+            if labelId is None or any(
+                labelId in entry['message']['labelIds']
+                for entries in record.values() if isinstance(entries, list) for entry in entries
+            )
+        ]
+        start = int(pageToken or 0)
+        results = {
+            'history': records[start:start + max_results],
+            'historyId': str(self.history_id)
+        }
+        if start + max_results < len(records):
+            results['nextPageToken'] = str(start + max_results)
+        return results
+
+    def get_profile(self, **kwargs) -> Dict[str, Any]:
+        return {
+            'emailAddress': 'me@example.com',
+            'messagesTotal': self.size,
+            'historyId': str(self.history_id)
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, as googleapiclient and aiohttp expect
+
+    def do_GET(self):
+        self.server.fake.delay()
+        self._respond(*self.server.fake.handle('GET', self.path))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.fake.delay()
+        if urlsplit(self.path).path in BATCH_PATHS:
+            self._respond(*self.server.fake.handle_batch(self.headers.get('Content-Type', ''), body))
+        else:
+            self._respond(*self.server.fake.handle('POST', self.path))
+
+    def _respond(self, status: int, content: bytes, content_type: str = 'application/json; charset=UTF-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class FakeGmailServer:
+    """
+    Threaded HTTP server answering Gmail API requests from a SyntheticMailbox.
+
+    Counts calls per API method (batched calls individually, plus one 'batch'
+    per batch request) and injected errors ('429') in calls. Use as a context
+    manager or call start() and stop().
+    """
+
+    def __init__(self, mailbox: SyntheticMailbox, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        """
+        Initialize server.
+
+        Args:
+            mailbox: Mailbox to serve
+            host: Interface to listen on
+            port: Port to listen on; 0 picks a free one
+            latency: Seconds to wait before answering each HTTP request
+                (a batch is one request)
+            error_rate: Probability of a messages.get or threads.get call,
+                batched or not, failing with 429 rateLimitExceeded
+            seed: Random seed for error injection
+        """
+        self.mailbox = mailbox
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.fake = self
+        self._thread: Optional[threading.Thread] = None
+        self._handlers = {
+            'messages.list': mailbox.list_messages,
+            'messages.get': mailbox.get_message,
+            'threads.get': mailbox.get_thread,
+            'labels.list': mailbox.list_labels,
+            'history.list': mailbox.list_history,
+            'getProfile': mailbox.get_profile,
+        }
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> 'FakeGmailServer':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """Serve requests on a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self) -> None:
+        """Serve requests on the calling thread until stop() is called."""
+        self._httpd.serve_forever()
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def delay(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def handle(self, method: str, target: str) -> Tuple[int, bytes]:
+        """
+        Answer a single API request.
+
+        Args:
+            method: HTTP method
+            target: Request path with query string
+
+        Returns:
+            Tuple of (HTTP status, JSON body)
+        """
+        url = urlsplit(target)
+        if url.path == '/_stats' and method == 'GET':
+            with self._lock:
+                return 200, json.dumps(self.calls).encode('utf-8')
+        for name, pattern in ROUTES:
+            match = pattern.fullmatch(url.path)
+            if match and method == 'GET':
+                break
+        else:
+            return 404, error_content(404, 'notFound')
+
+        with self._lock:
+            self.calls[name] += 1
+            if name in INJECTED_METHODS and self.error_rate and self._rng.random() < self.error_rate:
+                self.calls['429'] += 1
+                return 429, error_content(429)
+
+        params = {
+            key: values if key in LIST_PARAMS else values[-1]
+            for key, values in parse_qs(url.query).items() if key != 'alt'
+        }
+        fields = params.pop('fields', None)
+        try:
+            result = self._handlers[name](*match.groups(), **params)
+        except HttpError as error:
+            return error.status_code, error.content
+        if fields:
+            result = apply_fields(result, parse_fields(fields))
+        return 200, json.dumps(result).encode('utf-8')
+
+    def handle_batch(self, content_type: str, body: bytes) -> Tuple[int, bytes, str]:
+        """
+        Answer a multipart/mixed batch request, one application/http part per call.
+
+        Returns:
+            Tuple of (HTTP status, multipart body, content type)
+        """
+        with self._lock:
+            self.calls['batch'] += 1
+        message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode('utf-8') + body)
+        parts = message.get_payload() if message.is_multipart() else []
+        if not parts or len(parts) > MAX_BATCH_REQUESTS:
+            return 400, error_content(400, 'invalidArgument'), 'application/json; charset=UTF-8'
+
+        boundary = f"batch_{uuid4().hex}"
+        chunks = []
+        for part in parts:
+            request_line = part.get_payload().lstrip().split('\n', 1)[0]
+            method, target = request_line.split(' ')[:2]
+            status, content = self.handle(method, target)
+            chunks.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:-1]}>\r\n\r\n"
+                f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(content)}\r\n\r\n"
+                f"{content.decode('utf-8')}\r\n"
+            )
+        chunks.append(f"--{boundary}--\r\n")
+        return 200, ''.join(chunks).encode('utf-8'), f"multipart/mixed; boundary={boundary}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local fake Gmail API server')
+    parser.add_argument('--messages', type=int, default=100_000, help='Mailbox size')
+    parser.add_argument('--complexity', type=int, default=3, help='Scales MIME body size')
+    parser.add_argument('--history', type=int, default=1000, help='Number of history records')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--latency', type=float, default=0.0, help='Milliseconds per HTTP request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of message fetches failing with 429')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    mailbox = SyntheticMailbox(args.messages, args.seed, args.complexity, args.history)
+    server = FakeGmailServer(mailbox, args.host, args.port, args.latency / 1000, args.error_rate, args.seed)
+    logger.info(f"Serving {args.messages:,} messages at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
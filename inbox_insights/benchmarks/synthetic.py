@@ -0,0 +1,147 @@
+"""Deterministic synthetic Gmail message resources for benchmarks."""
+import base64
+import random
+from typing import List, Dict, Any, Optional
+
+WORDS = (
+    "invoice meeting schedule update newsletter offer account security review "
+    "project deadline team weekly report order shipped delivery payment"
+).split()
+DOMAINS = ['example.com', 'news.example.org', 'mail.test']
+LABELS = ['INBOX', 'UNREAD', 'CATEGORY_UPDATES', 'CATEGORY_PROMOTIONS', 'IMPORTANT']
+BASE_MS = 1_600_000_000_000
+INTERVAL_MS = 3_600_000  # Message n arrives at BASE_MS + n * INTERVAL_MS
+
+
+def _encode(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _html(rng: random.Random, paragraphs: int) -> str:
+    rows = ''.join(
+        f'<tr><td style="padding:4px"><a href="https://example.com/{n}">{_sentence(rng, 6)}</a></td></tr>'
+        for n in range(paragraphs)
+    )
+    body = ''.join(f'<p class="c{n}">{_sentence(rng, 30)} &amp; café</p>' for n in range(paragraphs))
+    return (
+        '<!DOCTYPE html><html><head><style>p{margin:0}</style></head>'
+        f'<body><div>{body}</div><table>{rows}</table></body></html>'
+    )
+
+
+def _part(mime_type: str, text: str) -> Dict[str, Any]:
+    return {'mimeType': mime_type, 'body': {'data': _encode(text), 'size': len(text)}}
+
+
+def make_payload(rng: random.Random, complexity: int = 3) -> Dict[str, Any]:
+    """
+    Build a MIME payload of one of several common shapes.
+
+    Args:
+        rng: Random source
+        complexity: Scales the number of paragraphs in HTML parts
+
+    Returns:
+        Gmail-style payload dict
+    """
+    paragraphs = rng.randint(1, 4 * complexity)
+    shape = rng.randrange(4)
+    if shape == 0:
+        payload = _part('text/plain', '\n'.join(_sentence(rng, 20) for _ in range(paragraphs)))
+    elif shape == 1:
+        payload = _part('text/html', _html(rng, paragraphs))
+    elif shape == 2:
+        payload = {'mimeType': 'multipart/alternative', 'parts': [
+            _part('text/plain', _sentence(rng, 40 * paragraphs)),
+            _part('text/html', _html(rng, paragraphs)),
+        ]}
+    else:
+        payload = {'mimeType': 'multipart/mixed', 'parts': [
+            {'mimeType': 'multipart/related', 'parts': [
+                {'mimeType': 'multipart/alternative', 'parts': [
+                    _part('text/plain', f'<b>{_sentence(rng, 40)}</b>'),
+                    _part('text/html', _html(rng, paragraphs)),
+                ]},
+                {'mimeType': 'image/png', 'filename': 'logo.png', 'body': {'attachmentId': 'a1', 'size': 2048}},
+            ]},
+            {'mimeType': 'application/pdf', 'filename': 'invoice.pdf', 'body': {'attachmentId': 'a2', 'size': 50000}},
+        ]}
+    return payload
+
+
+def _headers(n: int, address: str, subject: str) -> List[Dict[str, str]]:
+    return [
+        {'name': 'From', 'value': f"Sender {n % 200} <{address}>"},
+        {'name': 'To', 'value': 'me@example.com'},
+        {'name': 'Subject', 'value': subject},
+        {'name': 'Date', 'value': 'Tue, 01 Oct 2024 10:00:00 +0000'},
+        {'name': 'Message-ID', 'value': f"<{n}@example.com>"},
+    ]
+
+
+def make_message(n: int, seed: int = 0, complexity: int = 3,
+                 label_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Build message n of a mailbox without generating the messages before it.
+
+    Each message has its own random stream, so a fake server can produce any
+    message of an arbitrarily large mailbox on demand. The mailbox differs
+    from the one make_messages builds with the same seed.
+
+    Args:
+        n: Message index; also determines its ID, thread and internalDate
+        seed: Random seed of the mailbox
+        complexity: Scales MIME body size
+        label_ids: Labels of the message (two random ones if not given)
+
+    Returns:
+        Message dict
+    """
+    rng = random.Random((seed << 32) | n)
+    payload = make_payload(rng, complexity)
+    sender = rng.randrange(200)
+    payload['headers'] = _headers(n, f"sender{sender}@{DOMAINS[sender % len(DOMAINS)]}", _sentence(rng, 6))
+    return {
+        'id': f"{n:016x}",
+        'threadId': f"{n // 3:016x}",
+        'labelIds': label_ids if label_ids is not None else rng.sample(LABELS, 2),
+        'snippet': _sentence(rng, 10),
+        'internalDate': str(BASE_MS + n * INTERVAL_MS),
+        'sizeEstimate': rng.randint(2_000, 80_000),
+        'payload': payload,
+    }
+
+
+def make_messages(count: int, seed: int = 0, complexity: int = 3) -> List[Dict[str, Any]]:
+    """
+    Build full message resources as returned by messages.get.
+
+    Args:
+        count: Number of messages
+        seed: Random seed; the same seed always yields the same mailbox
+        complexity: Scales MIME body size
+
+    Returns:
+        List of message dicts
+    """
+    rng = random.Random(seed)
+    senders = [f"sender{n}@{rng.choice(DOMAINS)}" for n in range(200)]
+    messages = []
+    for n in range(count):
+        payload = make_payload(rng, complexity)
+        address = rng.choice(senders)
+        payload['headers'] = _headers(n, address, _sentence(rng, 6))
+        messages.append({
+            'id': f"{n:016x}",
+            'threadId': f"{n // 3:016x}",
+            'labelIds': rng.sample(LABELS, 2),
+            'snippet': _sentence(rng, 10),
+            'internalDate': str(BASE_MS + n * INTERVAL_MS),
+            'sizeEstimate': rng.randint(2_000, 80_000),
+            'payload': payload,
+        })
+    return messages
@@ -11,10 +11,79 @@ EMAILS_DIR = DATA_DIR / "emails"
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 CREDENTIALS_FILE = BASE_DIR / "credentials.json"
 TOKEN_FILE = BASE_DIR / "token.json"
+TOKENS_DIR = BASE_DIR / "tokens"  # <account>.json token per extra account of a sharded backfill
+LABEL_RULES_FILE = BASE_DIR / "label_rules.json"
 
 # Data processing settings
 DUMP_FREQUENCY = 10
+CHECKPOINT_COMPACT_MIN_BYTES = 1 << 20  # Checkpoint logs smaller than this are never compacted
 MAX_RESULTS_PER_PAGE = 500
+SYNC_STATE_FILE = EMAILS_DIR / "sync_state.json"
+
+# Sharded backfill settings
+BACKFILL_DIR = DATA_DIR / "backfill"
+BACKFILL_SHARD_DAYS = 30
+BACKFILL_LEASE_SECONDS = 600  # A shard whose worker stops renewing its lease this long is reassigned
+BACKFILL_MAX_ATTEMPTS = 3  # Failures before a shard is marked failed
+
+# Output settings
+OUTPUT_FORMAT = 'csv'  # 'csv' or 'parquet'
+PARQUET_ROW_GROUP_BYTES = 64 << 20
+PARQUET_MAX_BUFFER_BYTES = 256 << 20  # Total rows buffered across month partitions
+
+# SQLite message store (--output-format sqlite)
+MESSAGE_DB_FILE = DATA_DIR / "messages.sqlite3"
+
+# Fetch settings
+FETCH_PROFILE = 'full'  # 'minimal', 'metadata', 'full' or 'raw'
+METADATA_HEADERS = ['From', 'To', 'Cc', 'Subject', 'Date', 'List-Id', 'Message-ID', 'In-Reply-To']
+
+# Message cache settings
+MESSAGE_CACHE_FILE = DATA_DIR / "cache" / "messages.sqlite3"
+MESSAGE_CACHE_MAX_BYTES = 4 << 30  # Compressed payloads kept before LRU eviction
+CACHED_FETCH_PROFILES = ('full', 'raw')  # Profiles whose payloads are worth caching
+
+# Near-duplicate clustering settings
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 16  # 8 rows per band: candidate pairs mostly have Jaccard similarity above ~0.7
+SHINGLE_SIZE = 3  # Words per shingle
+NEAR_DUPLICATE_THRESHOLD = 0.8  # Estimated Jaccard similarity needed to join a cluster
+NEAR_DUPLICATE_DB_FILE = DATA_DIR / "near_duplicates.sqlite3"  # Clusters kept across runs
+
+# Search index settings
+SEARCH_INDEX_DIR = DATA_DIR / "search"
+SEARCH_SEGMENT_DOCS = 50_000  # Messages tokenized in memory per new index segment
+SEARCH_MAX_TERM_LENGTH = 40  # Longer tokens (hashes, encoded blobs) are not indexed
+BM25_K1 = 1.2
+BM25_B = 0.75
+SEARCH_EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+SEARCH_EMBEDDING_CHARS = 2000  # Leading characters of each message that are embedded
+SEARCH_IVF_MIN_VECTORS = 50_000  # Segments with at least this many vectors get an IVF quantizer
+SEARCH_IVF_PROBES = 16  # Inverted lists scanned per semantic query
+
+# Parsing settings
+HTML_PARSER_BACKEND = 'auto'  # 'auto', 'selectolax', 'lxml' or 'html.parser'
+PARSE_CHUNK_SIZE = 16  # Payloads per task sent to a parse worker process
+
+# Gmail API batch settings
+BATCH_SIZE = 100  # Gmail allows at most 100 calls per batch request
+BATCH_MODIFY_SIZE = 1000  # Gmail allows at most 1000 message IDs per batchModify call
+MAX_RETRIES = 5
+RETRY_BACKOFF_SECONDS = 1.0
+
+# Concurrent pipeline settings
+FETCH_WORKERS = 4
+PIPELINE_QUEUE_SIZE = 8  # Batches buffered between pipeline stages
+REQUESTS_PER_SECOND = 50  # messages.get costs 5 of the 250 quota units per user per second
+
+# Async client settings
+ASYNC_CONCURRENCY = 100  # Requests in flight per account
+ASYNC_MAX_CONNECTIONS = 100  # Pooled keep-alive connections per client
+
+# Metrics settings
+METRICS_PREFIX = 'inbox_insights'  # Prefix of exported Prometheus metric names
+# Upper bounds in seconds of the stage latency histogram buckets
+METRICS_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
 
 # Create necessary directories
 EMAILS_DIR.mkdir(parents=True, exist_ok=True) 
\ No newline at end of file
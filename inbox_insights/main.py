@@ -1,16 +1,238 @@
 import logging
 import argparse
+import asyncio
+import cProfile
+import multiprocessing
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 from src.auth import get_credentials
 from src.gmail_client import GmailClient
-from src.data_processor import DataProcessor
+from src.async_gmail_client import AsyncGmailClient
+from src.data_processor import DataProcessor, session_output_time
+from src.rate_limiter import TokenBucket
+from src.incremental_sync import IncrementalSync
+from src.message_cache import MessageCache
+from src.message_store import MessageStore
+from src.merge import merge_sessions
+from src.label_rules import RULE_COLUMNS, load_rules, plan_label_changes, apply_label_changes
+from src.filters import load_filter_rules
+from src.search_index import SearchIndex, SentenceEmbedder, stored_embedding_model
+from src.backfill import LEASE_DB_FILE, LeaseTable, BackfillWorker, plan_shards, merge_backfill
+from src.metrics import InMemoryMetrics, create_exporter
+from src import analytics
 from utils.helpers import setup_logging, combine_csv_files
-from config.settings import EMAILS_DIR
+from src.sinks import SINKS
+from src.gmail_client import FETCH_PROFILES
+from config.settings import (
+    EMAILS_DIR, OUTPUT_FORMAT, FETCH_PROFILE, MESSAGE_CACHE_FILE, MESSAGE_DB_FILE, LABEL_RULES_FILE,
+    SEARCH_INDEX_DIR, SEARCH_EMBEDDING_MODEL, TOKEN_FILE, TOKENS_DIR, BACKFILL_DIR, BACKFILL_SHARD_DAYS,
+    REQUESTS_PER_SECOND, CACHED_FETCH_PROFILES
+)
+
+# Account of TOKEN_FILE, the one used outside of multi-account backfills
+DEFAULT_ACCOUNT = 'default'
+
+def parse_date(value: str) -> int:
+    """Parse a YYYY-MM-DD date as UTC milliseconds since the epoch, like internalDate."""
+    date = datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    return int(date.timestamp() * 1000)
+
+def run_query(args):
+    store = MessageStore(MESSAGE_DB_FILE)
+    try:
+        messages = store.query(
+            sender=args.sender,
+            label=args.label,
+            thread_id=args.thread,
+            after=args.after,
+            before=args.before,
+            text=args.search,
+            cluster_id=args.cluster_id,
+            rule=args.rule,
+            account=args.account,
+            limit=args.limit
+        )
+    finally:
+        store.close()
+    
+    for message in messages:
+        date = datetime.fromtimestamp(message['internal_date'] / 1000, tz=timezone.utc)
+        print(f"{date:%Y-%m-%d %H:%M}  {message['id']}  {message['sender']:<30}  "
+              f"{message['subject']}  [{', '.join(message['labels'])}]")
+    print(f"{len(messages)} messages")
+
+def run_label_rules(args):
+    logger = logging.getLogger(__name__)
+    rules = load_rules(args.rules)
+    columns = RULE_COLUMNS + ['body'] if any(rule.body for rule in rules) else RULE_COLUMNS
+    changes = plan_label_changes(analytics.load_dataset(args.path, columns), rules)
+    logger.info(f"{sum(len(change['ids']) for change in changes)} messages to relabel in {len(changes)} changes")
+    gmail_client = None if args.dry_run else GmailClient(get_credentials(), rate_limiter=TokenBucket())
+    calls = apply_label_changes(gmail_client, changes, dry_run=args.dry_run)
+    logger.info(f"{'Would make' if args.dry_run else 'Made'} {calls} batchModify calls")
+
+def saved_outputs():
+    """Saved CSV files and Parquet datasets in the emails directory, oldest first."""
+    outputs = list(EMAILS_DIR.glob("email_*.csv")) + list(EMAILS_DIR.glob("email_*.parquet"))
+    # Not by modification time: incremental syncs rewrite older outputs in place
+    return sorted(outputs, key=lambda path: (session_output_time(path), path.name))
+
+def open_search_index(semantic: bool = False) -> SearchIndex:
+    """Open the search index with the embedding model it stores, or the default one if semantic."""
+    model = stored_embedding_model(SEARCH_INDEX_DIR) or (SEARCH_EMBEDDING_MODEL if semantic else None)
+    return SearchIndex(SEARCH_INDEX_DIR, SentenceEmbedder(model) if model else None)
+
+def index_saved_output(saved_file):
+    logger = logging.getLogger(__name__)
+    if saved_file is None or Path(saved_file).suffix not in ('.csv', '.parquet'):
+        logger.info("Nothing to index; SQLite output is searched with the query subcommand")
+        return
+    open_search_index().add(Path(saved_file))
+
+def run_search(args):
+    if args.semantic:
+        model = stored_embedding_model(SEARCH_INDEX_DIR)
+        if model is None:
+            raise SystemExit("The search index has no embeddings; build it with: index --semantic")
+        results = SearchIndex(SEARCH_INDEX_DIR, SentenceEmbedder(model)).semantic_search(args.text, limit=args.limit)
+    else:
+        results = SearchIndex(SEARCH_INDEX_DIR).search(args.text, limit=args.limit)
+    for result in results:
+        print(f"{result['score']:8.3f}  {result['id']}")
+    print(f"{len(results)} messages")
+
+def account_token_file(account: str) -> Path:
+    return TOKEN_FILE if account == DEFAULT_ACCOUNT else TOKENS_DIR / f"{account}.json"
+
+def run_backfill_worker(backfill_dir: Path, num_workers, rate: float):
+    """Entry point of one backfill worker process."""
+    setup_logging()
+    BackfillWorker(
+        LeaseTable(backfill_dir / LEASE_DB_FILE),
+        backfill_dir,
+        lambda account: GmailClient(get_credentials(account_token_file(account)), rate_limiter=TokenBucket(rate)),
+        num_workers=num_workers
+    ).run()
+
+def run_backfill(args):
+    logger = logging.getLogger(__name__)
+    leases = LeaseTable(args.dir / LEASE_DB_FILE)
+    if args.action == 'plan':
+        if args.since is None:
+            raise SystemExit("backfill plan needs --since")
+        accounts = args.accounts or [DEFAULT_ACCOUNT]
+        # Authorize every account now; workers cannot open a browser
+        for account in accounts:
+            get_credentials(account_token_file(account))
+        leases.set_config({
+            'labels': args.labels,
+            'fetch_profile': args.fetch_profile,
+            'metadata_headers': args.metadata_headers
+        })
+        since = datetime.fromtimestamp(args.since / 1000, tz=timezone.utc)
+        if args.until is None:
+            until = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        else:
+            until = datetime.fromtimestamp(args.until / 1000, tz=timezone.utc)
+        added = leases.add_shards(plan_shards(accounts, since, until, args.shard_days))
+        logger.info(f"Planned {added} new shards in {args.dir}")
+    elif args.action == 'work':
+        # Processes on one host share the account's request quota
+        rate = REQUESTS_PER_SECOND / args.processes
+        processes = [
+            multiprocessing.Process(target=run_backfill_worker, args=(args.dir, args.workers, rate))
+            for _ in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        logger.info(f"Backfill progress: {leases.progress()}")
+    elif args.action == 'status':
+        print(', '.join(f"{count} {status}" for status, count in sorted(leases.progress().items())))
+        for shard in leases.failures():
+            print(f"failed  {shard['shard_id']}  {shard['error']}")
+    elif args.action == 'retry':
+        logger.info(f"Queued {leases.retry_failed()} failed shards again")
+    elif args.action == 'merge':
+        merged = merge_backfill(leases, args.output or args.dir / 'merged', args.output_format)
+        logger.info(f"Merged backfill saved to: {merged}")
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Gmail Inbox Processing')
     parser.add_argument('--session-id', type=str, help='Custom session ID for processing')
     parser.add_argument('--fresh', action='store_true', help='Force fresh start even if checkpoint exists')
-    return parser.parse_args()
+    parser.add_argument('--workers', type=int, help='Number of concurrent fetch workers (enables pipelined mode)')
+    parser.add_argument('--parse-workers', type=int, help='Number of processes for parsing email bodies')
+    parser.add_argument('--fetch-profile', choices=list(FETCH_PROFILES), default=FETCH_PROFILE,
+                        help='What to download per message: minimal (labels), metadata (headers), full or raw (bodies)')
+    parser.add_argument('--metadata-headers', nargs='+', help='Headers to download with the metadata profile')
+    parser.add_argument('--output-format', choices=sorted(SINKS), default=OUTPUT_FORMAT, help='Output file format')
+    parser.add_argument('--incremental', action='store_true', help='Only fetch changes since the last sync')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Fetch messages with the asyncio client')
+    parser.add_argument('--cache', action='store_true', help='Keep downloaded messages in a local cache; only labels are re-fetched')
+    parser.add_argument('--by-thread', action='store_true', help='Fetch whole threads and also save a per-thread summary table')
+    parser.add_argument('--offline', action='store_true', help='Re-process cached messages without contacting Gmail')
+    parser.add_argument('--cluster', action='store_true', help='Tag each message with the ID of its near-duplicate cluster')
+    parser.add_argument('--filters', type=Path, help='JSON file with filter rules; tags each message with the rules it matches')
+    parser.add_argument('--index', action='store_true', help='Add the saved output to the local search index')
+    parser.add_argument('--prometheus-textfile', type=Path, help='Also write the run metrics in Prometheus text format to this file')
+    parser.add_argument('--profile', action='store_true', help='Run under cProfile and save the stats next to the output (main thread only)')
+    
+    subparsers = parser.add_subparsers(dest='command')
+    query_parser = subparsers.add_parser('query', help='Search messages stored with --output-format sqlite')
+    query_parser.add_argument('--sender', help="Sender address, or '@domain' for a whole domain")
+    query_parser.add_argument('--label', help='Label name')
+    query_parser.add_argument('--thread', help='Thread ID')
+    query_parser.add_argument('--after', type=parse_date, help='Received on or after this date (YYYY-MM-DD)')
+    query_parser.add_argument('--before', type=parse_date, help='Received before this date (YYYY-MM-DD)')
+    query_parser.add_argument('--search', help='Full-text query over subject and body (FTS5 syntax)')
+    query_parser.add_argument('--cluster', dest='cluster_id', help='Near-duplicate cluster ID')
+    query_parser.add_argument('--rule', help='Name of a filter rule the message matched')
+    query_parser.add_argument('--account', help='Account a backfilled message came from')
+    query_parser.add_argument('--limit', type=int, default=50, help='Maximum number of results')
+    merge_parser = subparsers.add_parser('merge', help='Merge session CSV files, keeping the newest copy of each message')
+    merge_parser.add_argument('files', nargs='*', type=Path, help='Session CSV files, oldest first (default: all in the emails directory)')
+    merge_parser.add_argument('--output', type=Path, default=EMAILS_DIR / 'merged', help='Output path without suffix')
+    merge_parser.add_argument('--output-format', choices=sorted(SINKS), default=OUTPUT_FORMAT, help='Output file format')
+    stats_parser = subparsers.add_parser('stats', help='Print inbox analytics for a saved CSV file or Parquet dataset')
+    stats_parser.add_argument('path', type=Path, help='Saved output to analyze')
+    stats_parser.add_argument('--top', type=int, default=10, help='Number of top senders and domains')
+    stats_parser.add_argument('--tz', help='Time zone for volume by hour (default UTC)')
+    label_parser = subparsers.add_parser('label', help='Apply label rules to the messages of a saved CSV file or Parquet dataset')
+    label_parser.add_argument('path', type=Path, help='Saved output to evaluate the rules on')
+    label_parser.add_argument('--rules', type=Path, default=LABEL_RULES_FILE, help='JSON file with label rules')
+    label_parser.add_argument('--dry-run', action='store_true', help='Only log the changes and the number of API calls')
+    backfill_parser = subparsers.add_parser('backfill', help='Sharded first-time backfill across worker processes and hosts')
+    backfill_parser.add_argument('action', choices=['plan', 'work', 'status', 'retry', 'merge'],
+                                 help='plan shards, work on them, show status, retry failed shards or merge the outputs')
+    backfill_parser.add_argument('--dir', type=Path, default=BACKFILL_DIR, help='Backfill directory; share it between hosts')
+    backfill_parser.add_argument('--accounts', nargs='+', help=f"Account names with a token in {TOKENS_DIR}/<name>.json (default: {TOKEN_FILE.name})")
+    backfill_parser.add_argument('--since', type=parse_date, help='Backfill messages received on or after this date (YYYY-MM-DD)')
+    backfill_parser.add_argument('--until', type=parse_date, help='Backfill messages received before this date (default: tomorrow)')
+    backfill_parser.add_argument('--shard-days', type=int, default=BACKFILL_SHARD_DAYS, help='Days per shard')
+    backfill_parser.add_argument('--labels', nargs='+', default=['INBOX'], help='Label IDs to backfill')
+    backfill_parser.add_argument('--processes', type=int, default=1, help='Worker processes to run on this host')
+    backfill_parser.add_argument('--output', type=Path, help='Merged output path without suffix (default: <dir>/merged)')
+    index_parser = subparsers.add_parser('index', help='Add saved CSV files or Parquet datasets to the local search index')
+    index_parser.add_argument('paths', nargs='*', type=Path, help='Saved outputs, oldest first (default: all in the emails directory)')
+    index_parser.add_argument('--semantic', action='store_true', help='Also store embeddings for semantic search (needs sentence-transformers)')
+    index_parser.add_argument('--force', action='store_true', help='Re-index outputs that are already indexed')
+    search_parser = subparsers.add_parser('search', help='Search the local search index')
+    search_parser.add_argument('text', help='Keywords, or a natural language query with --semantic')
+    search_parser.add_argument('--semantic', action='store_true', help='Rank by embedding similarity instead of BM25')
+    search_parser.add_argument('--limit', type=int, default=20, help='Maximum number of results')
+    
+    args = parser.parse_args()
+    if args.offline and (args.incremental or args.use_async or args.by_thread):
+        parser.error('--offline cannot be combined with --incremental, --async or --by-thread')
+    if args.use_async and (args.workers or args.by_thread or args.incremental or args.cache):
+        parser.error('--async cannot be combined with --workers, --by-thread, --incremental or --cache')
+    if args.offline and args.fetch_profile not in CACHED_FETCH_PROFILES:
+        parser.error(f"--offline needs a cached fetch profile: {', '.join(CACHED_FETCH_PROFILES)}")
+    if args.by_thread and args.fetch_profile == 'raw':
+        parser.error('--by-thread does not support the raw fetch profile')
+    return args
 
 def main():
     # Set up logging
@@ -20,30 +242,167 @@ def main():
     # Parse command line arguments
     args = parse_args()
     
+    if args.command == 'query':
+        run_query(args)
+        return
+    if args.command == 'label':
+        run_label_rules(args)
+        return
+    if args.command == 'search':
+        run_search(args)
+        return
+    if args.command == 'backfill':
+        run_backfill(args)
+        return
+    if args.command == 'index':
+        index = open_search_index(args.semantic)
+        for path in args.paths or saved_outputs():
+            index.add(path, force=args.force)
+        logger.info(f"Search index holds {len(index)} messages")
+        return
+    if args.command == 'stats':
+        report = analytics.summarize(analytics.load_dataset(args.path), n=args.top, tz=args.tz)
+        for name, result in report.items():
+            print(f"\n== {name.replace('_', ' ')}\n{result}")
+        return
+    if args.command == 'merge':
+        files = args.files or [path for path in saved_outputs() if path.suffix == '.csv']
+        logger.info(f"Merged output saved to: {merge_sessions(files, args.output, args.output_format)}")
+        return
+    
+    metrics = InMemoryMetrics()
+    profiler = cProfile.Profile() if args.profile else None
+    saved_file = None
+    try:
+        if profiler:
+            profiler.enable()
+        if args.use_async:
+            saved_file = asyncio.run(async_main(args, metrics))
+        else:
+            saved_file = run_sync(args, metrics)
+    finally:
+        if profiler:
+            profiler.disable()
+        export_run_metrics(args, metrics, profiler, saved_file)
+
+def export_run_metrics(args, metrics, profiler, saved_file):
+    """Log where the run spent its time and write the metrics and profile next to the output."""
+    logger = logging.getLogger(__name__)
+    for stage, stats in metrics.summary()['stages'].items():
+        logger.info(f"{stage}: {stats['calls']} calls, {stats['total_seconds']:.2f}s total, "
+                    f"p50 {stats['p50_ms']:.1f}ms, p99 {stats['p99_ms']:.1f}ms")
+    # Outputs are files or directories with a suffix, e.g. email_<session>.csv
+    if saved_file is not None:
+        base = Path(saved_file).with_suffix('')
+    else:
+        base = EMAILS_DIR / f"run_{datetime.now():%Y%m%d_%H%M%S}"
+    logger.info(f"Metrics summary saved to: {create_exporter('json', base.with_name(base.name + '.metrics.json')).export(metrics)}")
+    if args.prometheus_textfile:
+        logger.info(f"Prometheus metrics saved to: {create_exporter('prometheus', args.prometheus_textfile).export(metrics)}")
+    if profiler:
+        profile_file = base.with_name(base.name + '.prof')
+        profile_file.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(profile_file)
+        logger.info(f"Profile saved to: {profile_file} (view with: python -m pstats {profile_file})")
+
+def run_sync(args, metrics):
+    logger = logging.getLogger(__name__)
+    
     try:
-        # Get credentials
-        credentials = get_credentials()
-        
         # Initialize Gmail client
-        gmail_client = GmailClient(credentials)
-        
-        # Fetch messages
-        messages = gmail_client.get_messages()
+        cache = MessageCache(MESSAGE_CACHE_FILE) if args.cache or args.offline else None
+        if args.offline:
+            gmail_client = GmailClient(None, cache=cache, offline=True, metrics=metrics)
+        else:
+            credentials = get_credentials()
+            gmail_client = GmailClient(credentials, rate_limiter=TokenBucket(), cache=cache, metrics=metrics)
         
         # Get and display labels
         labels = gmail_client.get_labels()
         label_mappings = {label['id']: label['name'] for label in labels}
         logger.info(f"Total labels found: {len(labels)}")
         
+        data_processor = DataProcessor(
+            gmail_client,
+            output_format=args.output_format,
+            fetch_profile=args.fetch_profile,
+            metadata_headers=args.metadata_headers,
+            cluster_near_duplicates=args.cluster,
+            filter_rules=load_filter_rules(args.filters) if args.filters else None,
+            metrics=metrics
+        )
+        if args.incremental:
+            saved_file = IncrementalSync(gmail_client, data_processor).run(
+                ['INBOX'],
+                label_mappings,
+                session_id=args.session_id,
+                force_new=args.fresh,
+                parse_workers=args.parse_workers
+            )
+            logger.info(f"Messages saved to: {saved_file}")
+            if args.index:
+                index_saved_output(saved_file)
+            return saved_file
+        
+        # Stream message listing; fetching starts with the first page
+        messages = gmail_client.iter_messages(fetch_profile=args.fetch_profile)
+        
         # Process and save messages
-        data_processor = DataProcessor(gmail_client)
         saved_file = data_processor.save_messages(
             messages, 
             label_mappings,
             session_id=args.session_id,
-            force_new=args.fresh
+            force_new=args.fresh,
+            num_workers=args.workers,
+            parse_workers=args.parse_workers,
+            by_thread=args.by_thread
         )
         logger.info(f"Messages saved to: {saved_file}")
+        if args.index:
+            index_saved_output(saved_file)
+        return saved_file
+        
+    except Exception as e:
+        logger.error(f"An error occurred: {e}")
+        raise
+
+async def async_main(args, metrics):
+    logger = logging.getLogger(__name__)
+    
+    try:
+        # Get credentials
+        credentials = get_credentials()
+        
+        async with AsyncGmailClient(credentials, metrics=metrics) as gmail_client:
+            # Fetch messages and labels concurrently
+            messages, labels = await asyncio.gather(
+                gmail_client.get_messages(),
+                gmail_client.get_labels()
+            )
+            label_mappings = {label['id']: label['name'] for label in labels}
+            logger.info(f"Total labels found: {len(labels)}")
+            
+            # Process and save messages
+            data_processor = DataProcessor(
+                gmail_client,
+                output_format=args.output_format,
+                fetch_profile=args.fetch_profile,
+                metadata_headers=args.metadata_headers,
+                cluster_near_duplicates=args.cluster,
+                filter_rules=load_filter_rules(args.filters) if args.filters else None,
+                metrics=metrics
+            )
+            saved_file = await data_processor.save_messages_async(
+                messages,
+                label_mappings,
+                session_id=args.session_id,
+                force_new=args.fresh,
+                parse_workers=args.parse_workers
+            )
+            logger.info(f"Messages saved to: {saved_file}")
+            if args.index:
+                index_saved_output(saved_file)
+            return saved_file
         
     except Exception as e:
         logger.error(f"An error occurred: {e}")
@@ -0,0 +1,207 @@
+import ast
+import logging
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+logger = logging.getLogger(__name__)
+
+# Columns the analytics read; everything else (notably bodies) is never loaded
+ANALYTICS_COLUMNS = [
+    'id', 'threadId', 'internalDate', 'from_address', 'labels',
+    'rfc822_message_id', 'in_reply_to'
+]
+
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+def load_dataset(path: Path, columns: List[str] = ANALYTICS_COLUMNS) -> pd.DataFrame:
+    """
+    Load the columns needed for analytics from a stored output.
+
+    Args:
+        path: Parquet dataset directory or CSV file written by an output sink
+        columns: Columns to load
+
+    Returns:
+        DataFrame with internalDate as UTC timestamps and labels as lists
+    """
+    if path.suffix == '.parquet' or path.is_dir():
+        if pq is None:
+            raise ImportError("pyarrow is required to read Parquet output: pip install pyarrow")
+        # Keep labels as Arrow lists so they can be flattened without a per-row loop
+        df = pq.read_table(path, columns=columns).to_pandas(
+            types_mapper=lambda arrow_type: pd.ArrowDtype(arrow_type) if pa.types.is_list(arrow_type) else None
+        )
+    else:
+        available = set(pd.read_csv(path, nrows=0).columns)
+        df = pd.read_csv(
+            path,
+            usecols=[column for column in columns if column in available],
+            dtype=str,
+            keep_default_na=False
+        )
+        missing = [column for column in columns if column not in available]
+        if missing:
+            # Older outputs predate some columns, e.g. from_address
+            logger.warning(f"{path} has no {', '.join(missing)} column(s); treating them as empty")
+            df = df.reindex(columns=columns, fill_value='')
+        if 'internalDate' in df:
+            df['internalDate'] = pd.to_datetime(df['internalDate'].astype('int64'), unit='ms', utc=True)
+        if 'labels' in df:
+            # CSV stores label lists as Python literals: "['INBOX', 'UNREAD']";
+            # few distinct lists repeat across messages, so parse each once
+            parsed = {value: ast.literal_eval(value) if value else [] for value in df['labels'].unique()}
+            df['labels'] = df['labels'].map(parsed)
+    logger.info(f"Loaded {len(df)} messages from {path}")
+    return df
+
+
+def flatten_labels(df: pd.DataFrame) -> Tuple[np.ndarray, pd.Series]:
+    """
+    Flatten the label lists.
+
+    Returns:
+        Tuple of (row position of each label, label values)
+    """
+    if pa is None:
+        labels = df['labels'].reset_index(drop=True).explode().dropna()
+        positions, values = labels.index.to_numpy(), labels.reset_index(drop=True)
+    else:
+        if isinstance(df['labels'].dtype, pd.ArrowDtype):
+            labels = pa.array(df['labels'].array)
+        else:
+            labels = pa.array(df['labels'], type=pa.list_(pa.string()))
+        if isinstance(labels, pa.ChunkedArray):
+            labels = labels.combine_chunks()
+        positions = pc.list_parent_indices(labels).to_numpy(zero_copy_only=False)
+        values = pc.list_flatten(labels).to_pandas()
+    return positions, values
+
+
+def top_senders(df: pd.DataFrame, n: int = 20) -> pd.Series:
+    """Most frequent sender addresses with their message counts."""
+    return df['from_address'].value_counts().head(n)
+
+
+def top_domains(df: pd.DataFrame, n: int = 20) -> pd.Series:
+    """Most frequent sender domains with their message counts."""
+    # Split the distinct senders only, not every message
+    senders = df['from_address'].value_counts()
+    domains = senders.index.to_series().str.rpartition('@')[2].to_numpy()
+    return senders.groupby(domains).sum().sort_values(ascending=False).head(n).rename_axis('domain')
+
+
+def volume_by_hour(df: pd.DataFrame, tz: Optional[str] = None) -> pd.DataFrame:
+    """
+    Message counts per weekday and hour of day.
+
+    Args:
+        df: Messages
+        tz: Time zone to bucket in (default UTC)
+
+    Returns:
+        7 x 24 DataFrame indexed by weekday, columns are hours
+    """
+    dates = df['internalDate']
+    if tz:
+        dates = dates.dt.tz_convert(tz)
+    slots = dates.dt.weekday.to_numpy() * 24 + dates.dt.hour.to_numpy()
+    counts = np.bincount(slots, minlength=7 * 24).reshape(7, 24)
+    return pd.DataFrame(counts, index=WEEKDAYS, columns=range(24))
+
+
+def label_distribution(df: pd.DataFrame) -> pd.Series:
+    """Number of messages carrying each label."""
+    return flatten_labels(df)[1].value_counts()
+
+
+def thread_depth(df: pd.DataFrame) -> pd.Series:
+    """
+    Distribution of messages per thread.
+
+    Returns:
+        Number of threads for each thread depth, indexed by depth
+    """
+    depths = df['threadId'].value_counts()
+    return depths.value_counts().sort_index().rename_axis('depth').rename('threads')
+
+
+def reply_latency(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Time from each message to the replies it received.
+
+    Replies are matched to their parent through In-Reply-To and Message-ID
+    with a single hash join.
+
+    Returns:
+        DataFrame with id, parent_id and latency (Timedelta) per reply
+    """
+    parents = (
+        df.loc[df['rfc822_message_id'] != '', ['rfc822_message_id', 'id', 'internalDate']]
+        .drop_duplicates('rfc822_message_id')
+        .rename(columns={'id': 'parent_id', 'internalDate': 'parent_date'})
+    )
+    replies = df.loc[df['in_reply_to'] != '', ['id', 'in_reply_to', 'internalDate']]
+    joined = replies.merge(parents, left_on='in_reply_to', right_on='rfc822_message_id')
+    latency = joined['internalDate'] - joined['parent_date']
+    return pd.DataFrame({
+        'id': joined['id'],
+        'parent_id': joined['parent_id'],
+        'latency': latency,
+    })[latency >= pd.Timedelta(0)].reset_index(drop=True)
+
+
+def unread_backlog_age(df: pd.DataFrame, now: Optional[pd.Timestamp] = None) -> pd.Series:
+    """
+    Age distribution of unread messages.
+
+    Args:
+        df: Messages
+        now: Reference time (default: current time)
+
+    Returns:
+        Unread message counts per age bucket
+    """
+    now = now or pd.Timestamp.now(tz='UTC')
+    positions, labels = flatten_labels(df)
+    unread = np.zeros(len(df), dtype=bool)
+    unread[positions[(labels == 'UNREAD').to_numpy()]] = True
+    ages = now - df['internalDate'][unread]
+    buckets = [pd.Timedelta(0), pd.Timedelta(days=1), pd.Timedelta(days=7),
+               pd.Timedelta(days=30), pd.Timedelta(days=365), pd.Timedelta.max]
+    names = ['<1d', '1-7d', '7-30d', '30-365d', '>1y']
+    return pd.cut(ages, buckets, labels=names, right=False).value_counts().reindex(names)
+
+
+def summarize(df: pd.DataFrame, n: int = 10, tz: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Compute every report.
+
+    Args:
+        df: Messages, see load_dataset
+        n: Number of top senders/domains to report
+        tz: Time zone for volume by hour
+
+    Returns:
+        Mapping of report name to result
+    """
+    latency = reply_latency(df)['latency']
+    return {
+        'messages': len(df),
+        'top_senders': top_senders(df, n),
+        'top_domains': top_domains(df, n),
+        'volume_by_hour': volume_by_hour(df, tz),
+        'label_distribution': label_distribution(df),
+        'thread_depth': thread_depth(df),
+        'reply_latency': latency.describe(percentiles=[0.5, 0.9]) if len(latency) else latency,
+        'unread_backlog_age': unread_backlog_age(df),
+    }
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+from typing import List, Dict, Any, Optional
+import aiohttp
+from google.auth.transport.requests import Request
+from config.settings import (
+    MAX_RESULTS_PER_PAGE, MAX_RETRIES, RETRY_BACKOFF_SECONDS,
+    ASYNC_MAX_CONNECTIONS, ASYNC_CONCURRENCY, FETCH_PROFILE
+)
+from .gmail_client import GmailClient, RETRYABLE_STATUS_CODES, RATE_LIMIT_REASONS
+from .metrics import MetricsRecorder
+
+logger = logging.getLogger(__name__)
+
+GMAIL_API_URL = "https://gmail.googleapis.com/gmail/v1/users/me"
+
+class AsyncGmailClient:
+    """
+    asyncio Gmail client mirroring GmailClient on top of aiohttp.
+
+    All requests share one pooled keep-alive connector, so many requests can
+    be in flight without a thread per request. Use as an async context manager.
+    """
+
+    def __init__(self, credentials, concurrency: int = ASYNC_CONCURRENCY,
+                 max_connections: int = ASYNC_MAX_CONNECTIONS,
+                 api_endpoint: Optional[str] = None,
+                 metrics: Optional[MetricsRecorder] = None):
+        """
+        Initialize async Gmail API client.
+
+        Args:
+            credentials: Google API credentials from auth.get_credentials
+            concurrency: Maximum number of requests in flight
+            max_connections: Size of the HTTP connection pool
+            api_endpoint: Optional root URL of a Gmail API stand-in to use
+                instead of gmail.googleapis.com
+            metrics: Optional recorder of API calls, retries, bytes downloaded
+                and listing time
+        """
+        self.credentials = credentials
+        self.metrics = metrics or MetricsRecorder()
+        self.api_url = GMAIL_API_URL
+        if api_endpoint is not None:
+            self.api_url = f"{api_endpoint.rstrip('/')}/gmail/v1/users/me"
+        self.max_connections = max_connections
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._refresh_lock = asyncio.Lock()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> 'AsyncGmailClient':
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(connector=connector, raise_for_status=False)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Close the underlying HTTP session and its connection pool."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _refresh_token(self, stale_token: Optional[str]) -> None:
+        """Refresh the OAuth token in a worker thread so the event loop keeps running."""
+        async with self._refresh_lock:
+            # Another request may have refreshed the token while we waited
+            if self.credentials.token != stale_token and self.credentials.valid:
+                return
+            logger.info("Refreshing access token")
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.credentials.refresh, Request())
+
+    async def _request(self, path: str, params: Optional[Any] = None) -> Dict[str, Any]:
+        """
+        Make an authorized GET request with retries.
+
+        Args:
+            path: API path relative to the user resource
+            params: Query parameters
+
+        Returns:
+            Decoded JSON response
+        """
+        if self._session is None:
+            raise RuntimeError("AsyncGmailClient must be used as an async context manager")
+        # 'messages' is messages.list, 'messages/<id>' messages.get
+        method = path.split('/')[0] + ('.get' if '/' in path else '.list')
+
+        async with self._semaphore:
+            for attempt in range(MAX_RETRIES + 1):
+                if not self.credentials.valid:
+                    await self._refresh_token(self.credentials.token)
+                token = self.credentials.token
+                self.metrics.increment('api_calls', method=method)
+                async with self._session.get(
+                    f"{self.api_url}/{path}",
+                    params=params,
+                    headers={'Authorization': f"Bearer {token}"}
+                ) as response:
+                    content = await response.read()
+                    self.metrics.increment('bytes_downloaded', len(content))
+                    if response.status < 300:
+                        return json.loads(content)
+                    if response.status == 401:
+                        await self._refresh_token(token)
+                        continue
+                    retryable = response.status in RETRYABLE_STATUS_CODES or (
+                        response.status == 403
+                        and any(reason in content for reason in RATE_LIMIT_REASONS)
+                    )
+                    if not retryable or attempt == MAX_RETRIES:
+                        logger.error(f"An error occurred: {response.status} {content[:200]!r}")
+                        response.raise_for_status()
+                self.metrics.increment('api_retries', status=str(response.status))
+                delay = RETRY_BACKOFF_SECONDS * (2 ** attempt)
+                logger.warning(f"Retrying {path} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        raise RuntimeError(f"Could not authorize request to {path}")
+
+    async def get_messages(self, label_ids: List[str] = ['INBOX']) -> List[Dict[str, Any]]:
+        """
+        Fetch messages with specified labels.
+
+        Args:
+            label_ids: List of label IDs to filter messages
+
+        Returns:
+            List of message IDs and metadata
+        """
+        params = [('maxResults', MAX_RESULTS_PER_PAGE)] + [('labelIds', label_id) for label_id in label_ids]
+        message_list = []
+        page_token = None
+        while True:
+            page_params = params + ([('pageToken', page_token)] if page_token else [])
+            with self.metrics.timer('list'):
+                results = await self._request("messages", page_params)
+            message_list.extend(results.get("messages", []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+        logger.info(f"Total Number of mails fetched = {len(message_list)}")
+        return message_list
+
+    async def get_message_details(self, message_id: str, fetch_profile: str = FETCH_PROFILE,
+                                  metadata_headers: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Get detailed information about a specific message.
+
+        Args:
+            message_id: ID of the message to fetch
+            fetch_profile: One of gmail_client.FETCH_PROFILES
+            metadata_headers: Headers to return with the metadata profile
+
+        Returns:
+            Message details
+        """
+        params = []
+        for name, value in GmailClient.message_get_params(fetch_profile, metadata_headers).items():
+            values = value if isinstance(value, list) else [value]
+            params.extend((name, item) for item in values)
+        return await self._request(f"messages/{message_id}", params)
+
+    async def get_message_details_batch(self, message_ids: List[str],
+                                        fetch_profile: str = FETCH_PROFILE,
+                                        metadata_headers: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Get details for many messages concurrently.
+
+        Args:
+            message_ids: IDs of the messages to fetch
+            fetch_profile: One of gmail_client.FETCH_PROFILES
+            metadata_headers: Headers to return with the metadata profile
+
+        Returns:
+            Message details in the same order as message_ids
+        """
+        return list(await asyncio.gather(
+            *(self.get_message_details(message_id, fetch_profile, metadata_headers)
+              for message_id in message_ids)
+        ))
+
+    async def get_labels(self) -> List[Dict[str, Any]]:
+        """
+        Get all labels for the user.
+
+        Returns:
+            List of label information
+        """
+        results = await self._request("labels")
+        return results.get('labels', [])
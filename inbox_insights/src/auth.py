@@ -1,35 +1,43 @@
 import os
+from pathlib import Path
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from config.settings import SCOPES, CREDENTIALS_FILE, TOKEN_FILE
 
-def get_credentials():
+def get_credentials(token_file: Path = TOKEN_FILE):
     """
     Get valid user credentials from storage or initiate OAuth2 flow.
     
+    Args:
+        token_file: Where the account's token is stored, one file per account
+        
     Returns:
         Credentials: The obtained credentials.
     """
     creds = None
     
     # Load existing credentials if available
-    if os.path.exists(TOKEN_FILE):
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+    if os.path.exists(token_file):
+        creds = Credentials.from_authorized_user_file(token_file, SCOPES)
     
     # Refresh or get new credentials if needed
     if not creds or not creds.valid:
-        # if creds and creds.expired and creds.refresh_token:
-        #     creds.refresh(Request())
-        # else:
-        #     flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-        #     creds = flow.run_local_server(port=0)
-        
-        flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-        creds = flow.run_local_server(port=0)
+        if creds and creds.expired and creds.refresh_token:
+            # Headless backfill workers cannot open a browser, so never fall
+            # back to the consent flow while a refresh token is available
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+            creds = flow.run_local_server(port=0)
         
-        # Save credentials for future use
-        with open(TOKEN_FILE, 'w') as token:
+        # Save credentials for future use; concurrent workers may refresh at
+        # once, so replace the file atomically
+        token_file = Path(token_file)
+        token_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = token_file.with_name(f".{token_file.name}.{os.getpid()}.tmp")
+        with open(tmp_file, 'w') as token:
             token.write(creds.to_json())
+        os.replace(tmp_file, token_file)
     
     return creds 
\ No newline at end of file
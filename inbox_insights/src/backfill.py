@@ -0,0 +1,428 @@
+import os
+import json
+import socket
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Dict, Any, Callable, Iterator, Optional
+from config.settings import BACKFILL_SHARD_DAYS, BACKFILL_LEASE_SECONDS, BACKFILL_MAX_ATTEMPTS
+from .data_processor import DataProcessor, SessionCancelled
+from .merge import merge_sessions
+
+logger = logging.getLogger(__name__)
+
+LEASE_DB_FILE = 'leases.sqlite3'
+
+
+def plan_shards(accounts: List[str], since: datetime, until: datetime,
+                shard_days: int = BACKFILL_SHARD_DAYS) -> List[Dict[str, Any]]:
+    """
+    Split a backfill into one shard per account and time window.
+
+    Args:
+        accounts: Account names
+        since: Start of the backfill (inclusive)
+        until: End of the backfill (exclusive)
+        shard_days: Length of each window
+
+    Returns:
+        Shards with 'shard_id', 'account' and the 'after' and 'before'
+        bounds in epoch seconds, newest window first since recent mail is
+        usually the most wanted
+    """
+    shards = []
+    for account in accounts:
+        end = until
+        while end > since:
+            start = max(end - timedelta(days=shard_days), since)
+            shards.append({
+                'shard_id': f"{account}_{start:%Y%m%d}-{end:%Y%m%d}",
+                'account': account,
+                'after': int(start.timestamp()),
+                'before': int(end.timestamp()),
+            })
+            end = start
+    return shards
+
+
+def shard_query(shard: Dict[str, Any]) -> str:
+    """Gmail search query listing the messages of a shard's window."""
+    return f"after:{shard['after']} before:{shard['before']}"
+
+
+class LeaseTable:
+    """
+    Queue of backfill shards shared by workers through a SQLite database.
+
+    A worker leases one pending shard at a time and renews the lease while
+    it works. A shard whose lease expires, because its worker died or its
+    host went away, goes to the next worker that asks, and resumes from
+    the shard's checkpoint if the checkpoint directory is shared as well.
+    Every call uses its own short-lived connection and an immediate
+    transaction, so a table can be shared by threads, processes and hosts
+    (the database then has to be on a filesystem with working file locks).
+    """
+
+    def __init__(self, db_file: Path, lease_seconds: float = BACKFILL_LEASE_SECONDS,
+                 max_attempts: int = BACKFILL_MAX_ATTEMPTS):
+        """
+        Initialize lease table.
+
+        Args:
+            db_file: SQLite database file
+            lease_seconds: How long a lease lasts without renewal
+            max_attempts: Failed attempts after which a shard is given up on
+        """
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS shards (
+                    shard_id TEXT PRIMARY KEY,
+                    position INTEGER NOT NULL,
+                    account TEXT NOT NULL,
+                    after INTEGER NOT NULL,
+                    before INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    output TEXT,
+                    error TEXT,
+                    completed_at REAL
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(str(self.db_file), timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            # Take the write lock up front so two workers never lease the same shard
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def set_config(self, config: Dict[str, Any]) -> None:
+        """Store the options every worker of the backfill must use."""
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in config.items()]
+            )
+
+    def config(self) -> Dict[str, Any]:
+        """Options stored with set_config."""
+        with self._transaction() as conn:
+            return {row['key']: json.loads(row['value']) for row in conn.execute("SELECT key, value FROM config")}
+
+    def add_shards(self, shards: List[Dict[str, Any]]) -> int:
+        """
+        Queue shards; shards already in the table are left as they are.
+
+        Returns:
+            Number of shards added
+        """
+        with self._transaction() as conn:
+            position = conn.execute("SELECT COALESCE(MAX(position), -1) FROM shards").fetchone()[0]
+            added = 0
+            for shard in shards:
+                position += 1
+                added += conn.execute(
+                    "INSERT OR IGNORE INTO shards (shard_id, position, account, after, before) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [shard['shard_id'], position, shard['account'], shard['after'], shard['before']]
+                ).rowcount
+        return added
+
+    def acquire(self, owner: str) -> Optional[Dict[str, Any]]:
+        """
+        Lease the next pending shard, or one whose lease has expired.
+
+        Args:
+            owner: Worker identity, e.g. host:pid
+
+        Returns:
+            Shard, or None if no shard is available
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM shards WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY position LIMIT 1",
+                [now]
+            ).fetchone()
+            if row is None:
+                return None
+            if row['status'] == 'leased':
+                logger.warning(f"Lease of shard {row['shard_id']} held by {row['owner']} expired, taking it over")
+            conn.execute(
+                "UPDATE shards SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE shard_id = ?",
+                [owner, now + self.lease_seconds, row['shard_id']]
+            )
+        return dict(row, owner=owner)
+
+    def renew(self, shard_id: str, owner: str) -> bool:
+        """
+        Extend a lease by lease_seconds.
+
+        Returns:
+            False if the lease was lost to another worker
+        """
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE shards SET lease_expires = ? WHERE shard_id = ? AND owner = ? AND status = 'leased'",
+                [time.time() + self.lease_seconds, shard_id, owner]
+            ).rowcount == 1
+
+    def complete(self, shard_id: str, owner: str, output: Optional[str]) -> bool:
+        """
+        Mark a leased shard as done.
+
+        Args:
+            shard_id: Shard ID
+            owner: Worker holding the lease
+            output: Path of the shard's output, None if the window was empty
+
+        Returns:
+            False if the lease was lost to another worker
+        """
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE shards SET status = 'done', output = ?, completed_at = ?, lease_expires = NULL, "
+                "error = NULL WHERE shard_id = ? AND owner = ? AND status = 'leased'",
+                [output, time.time(), shard_id, owner]
+            ).rowcount == 1
+
+    def release(self, shard_id: str, owner: str, error: Optional[str] = None) -> None:
+        """
+        Give a leased shard back.
+
+        Args:
+            shard_id: Shard ID
+            owner: Worker holding the lease
+            error: Why the shard failed; the shard is marked failed after
+                max_attempts failures. Without an error (e.g. the worker is
+                shutting down) the attempt does not count.
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE shards SET "
+                "status = CASE WHEN ? IS NOT NULL AND attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "attempts = attempts - (? IS NULL), error = COALESCE(?, error), lease_expires = NULL "
+                "WHERE shard_id = ? AND owner = ? AND status = 'leased'",
+                [error, self.max_attempts, error, error, shard_id, owner]
+            )
+
+    def retry_failed(self) -> int:
+        """Queue failed shards again; returns how many."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE shards SET status = 'pending', attempts = 0 WHERE status = 'failed'"
+            ).rowcount
+
+    def progress(self) -> Dict[str, int]:
+        """Number of shards per status."""
+        with self._transaction() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall())
+
+    def failures(self) -> List[Dict[str, Any]]:
+        """Failed shards with their last error."""
+        with self._transaction() as conn:
+            return [dict(row) for row in conn.execute("SELECT * FROM shards WHERE status = 'failed'")]
+
+    def outputs(self) -> List[str]:
+        """Outputs of the done shards, in order of completion."""
+        with self._transaction() as conn:
+            return [row['output'] for row in conn.execute(
+                "SELECT output FROM shards WHERE status = 'done' AND output IS NOT NULL ORDER BY completed_at"
+            )]
+
+
+class _LeaseKeeper:
+    """
+    Renews a lease from a background thread while its shard is processed.
+
+    Sets the lost event once the lease may belong to another worker: when a
+    renewal is refused, or when renewals keep failing until the lease would
+    have expired. The shard's session is cancelled on that event, so two
+    workers never append to the same output and checkpoint.
+    """
+
+    def __init__(self, leases: LeaseTable, shard_id: str, owner: str):
+        self.leases = leases
+        self.shard_id = shard_id
+        self.owner = owner
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        # acquire() started the lease just before the keeper
+        expires = time.time() + self.leases.lease_seconds
+        while not self._stop.wait(self.leases.lease_seconds / 3):
+            renewed_at = time.time()
+            try:
+                if not self.leases.renew(self.shard_id, self.owner):
+                    logger.warning(f"Lost the lease of shard {self.shard_id}")
+                    self.lost.set()
+                    return
+                expires = renewed_at + self.leases.lease_seconds
+            except sqlite3.Error as error:
+                logger.warning(f"Could not renew the lease of shard {self.shard_id}: {error}")
+                if time.time() >= expires:
+                    logger.warning(f"Lease of shard {self.shard_id} expired before it could be renewed")
+                    self.lost.set()
+                    return
+
+    def __enter__(self) -> '_LeaseKeeper':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+class BackfillWorker:
+    """
+    Processes leased shards until none are left.
+
+    Each shard is saved as its own session (session ID = shard ID), so it
+    has its own checkpoint and its own CSV output in the backfill's shards
+    directory; merge_backfill combines them once every shard is done.
+    """
+
+    def __init__(self, leases: LeaseTable, backfill_dir: Path,
+                 make_client: Callable[[str], Any], owner: Optional[str] = None,
+                 num_workers: Optional[int] = None):
+        """
+        Initialize worker.
+
+        Args:
+            leases: Shared lease table
+            backfill_dir: Backfill directory holding checkpoints and shard outputs
+            make_client: Returns a GmailClient for an account name
+            owner: Worker identity (defaults to host:pid)
+            num_workers: Concurrent fetch workers per shard, see save_messages
+        """
+        self.leases = leases
+        self.backfill_dir = backfill_dir
+        self.make_client = make_client
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.num_workers = num_workers
+        self.config = leases.config()
+        self._accounts: Dict[str, Any] = {}
+
+    def _account(self, account: str):
+        """GmailClient, label mappings and DataProcessor of an account, created on first use."""
+        if account not in self._accounts:
+            client = self.make_client(account)
+            label_mappings = {label['id']: label['name'] for label in client.get_labels()}
+            processor = DataProcessor(
+                client,
+                checkpoint_dir=self.backfill_dir / 'checkpoints',
+                # Shard outputs are merged with merge_sessions, which reads CSV
+                output_format='csv',
+                fetch_profile=self.config['fetch_profile'],
+                metadata_headers=self.config.get('metadata_headers'),
+                output_dir=self.backfill_dir / 'shards',
+                interactive=False,
+                # Tell the mailboxes apart once the shards are merged
+                account=account
+            )
+            self._accounts[account] = (client, label_mappings, processor)
+        return self._accounts[account]
+
+    def process(self, shard: Dict[str, Any], cancel: Optional[threading.Event] = None) -> Optional[str]:
+        """
+        Save the messages of one shard.
+
+        Args:
+            shard: Leased shard
+            cancel: Event set when the lease is lost, see save_messages
+
+        Returns:
+            Path of the shard's output
+        """
+        client, label_mappings, processor = self._account(shard['account'])
+        messages = client.iter_messages(self.config['labels'], query=shard_query(shard))
+        return processor.save_messages(
+            messages, label_mappings, session_id=shard['shard_id'], num_workers=self.num_workers,
+            cancel=cancel
+        )
+
+    def run(self) -> int:
+        """
+        Process shards until the queue is empty.
+
+        Returns:
+            Number of shards completed by this worker
+        """
+        completed = 0
+        while True:
+            shard = self.leases.acquire(self.owner)
+            if shard is None:
+                break
+            shard_id = shard['shard_id']
+            logger.info(f"{self.owner} processing shard {shard_id} (attempt {shard['attempts'] + 1})")
+            try:
+                with _LeaseKeeper(self.leases, shard_id, self.owner) as keeper:
+                    output = self.process(shard, cancel=keeper.lost)
+            except SessionCancelled:
+                # The shard's new holder resumes it from the checkpoint
+                logger.warning(f"Stopped shard {shard_id} after losing its lease")
+                continue
+            except Exception as error:
+                logger.error(f"Shard {shard_id} failed: {error}")
+                self.leases.release(shard_id, self.owner, error=f"{type(error).__name__}: {error}")
+                continue
+            except BaseException:
+                self.leases.release(shard_id, self.owner)
+                raise
+            if self.leases.complete(shard_id, self.owner, output):
+                completed += 1
+            else:
+                logger.warning(f"Shard {shard_id} was reassigned while it was processed")
+        logger.info(f"{self.owner} completed {completed} shards; progress: {self.leases.progress()}")
+        return completed
+
+
+def merge_backfill(leases: LeaseTable, output_path: Path,
+                   output_format: str = 'csv') -> Optional[Path]:
+    """
+    Merge the outputs of a finished backfill into one deduplicated dataset.
+
+    Args:
+        leases: Lease table of the backfill
+        output_path: Output location without suffix
+        output_format: Output sink name, see sinks.SINKS
+
+    Returns:
+        Path of the merged output, or None if every shard was empty
+
+    Raises:
+        ValueError: If some shards are not done yet
+    """
+    progress = leases.progress()
+    unfinished = sum(count for status, count in progress.items() if status != 'done')
+    if unfinished:
+        raise ValueError(f"{unfinished} shards are not done yet: {progress}")
+    outputs = [Path(output) for output in leases.outputs()]
+    if not outputs:
+        return None
+    return merge_sessions(outputs, output_path, output_format)
@@ -1,60 +1,167 @@
 import json
+import os
+import struct
+import zlib
 from pathlib import Path
-from typing import Set, Optional
+from typing import Set, Optional, Iterable, Tuple
 import logging
+from config.settings import CHECKPOINT_COMPACT_MIN_BYTES
 
 logger = logging.getLogger(__name__)
 
+# Log record header: payload length and CRC32 of the payload
+_RECORD_HEADER = struct.Struct('<II')
+
 class CheckpointManager:
+    """
+    Append-only checkpoint store.
+
+    Each session keeps a compacted, sorted ID file plus a log of ID batches.
+    Appending a batch costs O(batch) bytes and one fsync; the log is folded
+    into the compact file once it outgrows it, so compaction is amortized
+    O(1) per ID. A torn final log record (crash mid-append) is detected by
+    its length/CRC header and discarded on load.
+    """
+
     def __init__(self, checkpoint_dir: Path):
         """
         Initialize checkpoint manager.
-        
+
         Args:
             checkpoint_dir: Directory to store checkpoint files
         """
         self.checkpoint_dir = checkpoint_dir
         self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
-        
+
+    def _paths(self, session_id: str) -> Tuple[Path, Path]:
+        return (self.checkpoint_dir / f"checkpoint_{session_id}.ids",
+                self.checkpoint_dir / f"checkpoint_{session_id}.log")
+
+    def _legacy_path(self, session_id: str) -> Path:
+        return self.checkpoint_dir / f"checkpoint_{session_id}.json"
+
+    def append_checkpoint(self, session_id: str, new_ids: Iterable[str]) -> None:
+        """
+        Durably record a batch of newly processed message IDs.
+
+        Args:
+            session_id: Unique identifier for the processing session
+            new_ids: Message IDs processed since the last append
+        """
+        payload = '\n'.join(new_ids).encode('utf-8')
+        if not payload:
+            return
+        compact_path, log_path = self._paths(session_id)
+        with open(log_path, 'ab') as f:
+            f.write(_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+            log_size = f.tell()
+
+        compact_size = compact_path.stat().st_size if compact_path.exists() else 0
+        if log_size > max(CHECKPOINT_COMPACT_MIN_BYTES, compact_size):
+            self.compact(session_id)
+
     def save_checkpoint(self, session_id: str, processed_ids: Set[str]) -> None:
         """
-        Save checkpoint of processed message IDs.
-        
+        Replace the checkpoint with a full set of processed message IDs.
+
         Args:
             session_id: Unique identifier for the processing session
             processed_ids: Set of processed message IDs
         """
-        checkpoint_file = self.checkpoint_dir / f"checkpoint_{session_id}.json"
-        with open(checkpoint_file, 'w') as f:
-            json.dump(list(processed_ids), f)
+        compact_path, log_path = self._paths(session_id)
+        self._write_compact(compact_path, processed_ids)
+        for path in (log_path, self._legacy_path(session_id)):
+            if path.exists():
+                path.unlink()
         logger.info(f"Checkpoint saved: {len(processed_ids)} messages")
-    
+
+    def compact(self, session_id: str) -> None:
+        """
+        Fold the log into the compact ID file.
+
+        The new compact file is written atomically before the log is removed,
+        so a crash at any point leaves a loadable checkpoint.
+
+        Args:
+            session_id: Session identifier to compact
+        """
+        processed_ids = self.load_checkpoint(session_id) or set()
+        self.save_checkpoint(session_id, processed_ids)
+
     def load_checkpoint(self, session_id: str) -> Optional[Set[str]]:
         """
         Load checkpoint of processed message IDs.
-        
+
         Args:
             session_id: Session identifier to load
-            
+
         Returns:
             Set of processed message IDs if checkpoint exists, None otherwise
         """
-        checkpoint_file = self.checkpoint_dir / f"checkpoint_{session_id}.json"
-        if checkpoint_file.exists():
-            with open(checkpoint_file, 'r') as f:
-                processed_ids = set(json.load(f))
-            logger.info(f"Checkpoint loaded: {len(processed_ids)} messages")
-            return processed_ids
-        return None
-    
+        compact_path, log_path = self._paths(session_id)
+        legacy_path = self._legacy_path(session_id)
+        if not (compact_path.exists() or log_path.exists() or legacy_path.exists()):
+            return None
+
+        processed_ids = set()
+        if legacy_path.exists():
+            with open(legacy_path, 'r') as f:
+                processed_ids.update(json.load(f))
+        if compact_path.exists():
+            with open(compact_path, 'r', encoding='utf-8') as f:
+                processed_ids.update(f.read().split())
+        if log_path.exists():
+            processed_ids.update(self._read_log(log_path))
+
+        logger.info(f"Checkpoint loaded: {len(processed_ids)} messages")
+        return processed_ids
+
+    @staticmethod
+    def _read_log(log_path: Path) -> Set[str]:
+        """Read all complete log records, truncating a torn final record."""
+        ids = set()
+        with open(log_path, 'rb') as f:
+            data = f.read()
+
+        offset = 0
+        while offset + _RECORD_HEADER.size <= len(data):
+            length, crc = _RECORD_HEADER.unpack_from(data, offset)
+            start = offset + _RECORD_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            ids.update(payload.decode('utf-8').split('\n'))
+            offset = start + length
+
+        if offset < len(data):
+            logger.warning(f"Discarding torn checkpoint record in {log_path.name}")
+            with open(log_path, 'r+b') as f:
+                f.truncate(offset)
+                f.flush()
+                os.fsync(f.fileno())
+        return ids
+
+    @staticmethod
+    def _write_compact(compact_path: Path, processed_ids: Set[str]) -> None:
+        tmp_path = compact_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(sorted(processed_ids)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, compact_path)
+
     def clear_checkpoint(self, session_id: str) -> None:
         """
-        Clear checkpoint file.
-        
+        Clear checkpoint files.
+
         Args:
             session_id: Session identifier to clear
         """
-        checkpoint_file = self.checkpoint_dir / f"checkpoint_{session_id}.json"
-        if checkpoint_file.exists():
-            checkpoint_file.unlink()
-            logger.info(f"Checkpoint cleared: {session_id}")
\ No newline at end of file
+        paths = [*self._paths(session_id), self._legacy_path(session_id)]
+        existing = [path for path in paths if path.exists()]
+        for path in existing:
+            path.unlink()
+        if existing:
+            logger.info(f"Checkpoint cleared: {session_id}")
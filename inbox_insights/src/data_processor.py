@@ -1,9 +1,15 @@
 import pandas as pd
 from datetime import datetime
 import os
-from typing import List, Dict, Any, Set, Optional
+import asyncio
+import threading
+import time
+from typing import List, Dict, Any, Callable, Set, Optional, Iterable, Sized
 import logging
-from config.settings import EMAILS_DIR, DUMP_FREQUENCY
+from config.settings import (
+    EMAILS_DIR, DUMP_FREQUENCY, BATCH_SIZE, ASYNC_CONCURRENCY, OUTPUT_FORMAT, FETCH_PROFILE,
+    NEAR_DUPLICATE_DB_FILE
+)
 from tqdm import tqdm
 import ast
 import base64
@@ -12,152 +18,533 @@ import numpy as np
 from pathlib import Path
 from .email_parser import EmailParser
 from .checkpoint_manager import CheckpointManager
+from .pipeline import FetchPipeline
+from .sinks import OutputSink, create_sink
+from .parse_pool import ParsePool
+from .threads import ThreadTable
+from .near_duplicates import NearDuplicateIndex
+from .filters import FilterRule, RuleMatcher
+from .metrics import MetricsRecorder
+from utils.helpers import batched
 
 
 logger = logging.getLogger(__name__)
 
+# Timestamps in session IDs and output names: email_<session_id>_<end time>
+SESSION_TIME_FORMAT = "%d-%m-%Y-%H-%M-%S"
+
+def session_output_time(path: Path) -> datetime:
+    """
+    When a saved session output was finished, from the end time in its name.
+    
+    Outputs of sessions that never finished are dated by their session ID if
+    it is a timestamp, or else by their modification time.
+    """
+    name = path.stem[len('email_'):] if path.stem.startswith('email_') else path.stem
+    for stamp in (name.rpartition('_')[2], name):
+        try:
+            return datetime.strptime(stamp, SESSION_TIME_FORMAT)
+        except ValueError:
+            continue
+    return datetime.fromtimestamp(path.stat().st_mtime)
+
+class SessionCancelled(Exception):
+    """Raised when a session's cancel event is set; nothing more is written or checkpointed."""
+
 class DataProcessor:
-    def __init__(self, gmail_client, checkpoint_dir: Optional[Path] = None):
-        """Initialize data processor with necessary directories."""
-        if not EMAILS_DIR.exists():
-            logger.info(f"Creating directory: {EMAILS_DIR}")
-            EMAILS_DIR.mkdir(parents=True, exist_ok=True)
+    # Fields of a processed message the thread table needs
+    _THREAD_ROW_KEYS = ('id', 'threadId', 'internalDate', 'labels', 'subject',
+                        'from_address', 'to_addresses', 'cc_addresses')
+    
+    def __init__(self, gmail_client, checkpoint_dir: Optional[Path] = None,
+                 output_format: str = OUTPUT_FORMAT,
+                 fetch_profile: str = FETCH_PROFILE,
+                 metadata_headers: Optional[List[str]] = None,
+                 cluster_near_duplicates: bool = False,
+                 filter_rules: Optional[List[FilterRule]] = None,
+                 output_dir: Optional[Path] = None,
+                 interactive: bool = True,
+                 metrics: Optional[MetricsRecorder] = None,
+                 account: Optional[str] = None):
+        """
+        Initialize data processor with necessary directories.
+        
+        Args:
+            gmail_client: GmailClient (or AsyncGmailClient) to fetch messages with
+            checkpoint_dir: Optional directory for checkpoint files
+            output_format: Output sink name, see sinks.SINKS
+            fetch_profile: What to download per message, see gmail_client.FETCH_PROFILES
+            metadata_headers: Headers to download with the metadata profile
+            cluster_near_duplicates: Tag each message with the 'cluster_id' of
+                its near-duplicate cluster (see NearDuplicateIndex); clusters
+                are kept in NEAR_DUPLICATE_DB_FILE across sessions
+            filter_rules: Tag each message with the names of the rules it
+                matches, in 'matched_rules'
+            output_dir: Directory for session outputs (defaults to EMAILS_DIR)
+            interactive: Ask before resuming a session that has a checkpoint;
+                otherwise it is resumed unless force_new is set
+            metrics: Optional recorder of the time spent fetching, parsing,
+                mapping labels, writing and checkpointing, and of queue depths
+            account: Mailbox the messages come from, written to an 'account'
+                column of every row (used by multi-account backfills)
+        """
+        self.output_dir = output_dir or EMAILS_DIR
+        if not self.output_dir.exists():
+            logger.info(f"Creating directory: {self.output_dir}")
+            self.output_dir.mkdir(parents=True, exist_ok=True)
             
         self.gmail_client = gmail_client
+        self.output_format = output_format
+        self.fetch_options = {'fetch_profile': fetch_profile, 'metadata_headers': metadata_headers}
         self.email_parser = EmailParser()
         self.checkpoint_manager = CheckpointManager(
-            checkpoint_dir or EMAILS_DIR / "checkpoints"
+            checkpoint_dir or self.output_dir / "checkpoints"
         )
+        self.interactive = interactive
+        self.metrics = metrics or MetricsRecorder()
+        self.account = account
+        self.parse_pool: Optional[ParsePool] = None
+        self.near_duplicates = NearDuplicateIndex(db_file=NEAR_DUPLICATE_DB_FILE) if cluster_near_duplicates else None
+        self.rule_matcher = RuleMatcher(filter_rules) if filter_rules else None
+        # Thread mode state, set for the duration of a save_messages call
+        self.thread_table: Optional[ThreadTable] = None
+        self._thread_rows: Dict[str, Dict[str, Any]] = {}
+        self._skip_ids: frozenset = frozenset()
+        self._cancel: Optional[threading.Event] = None
     
     def _get_header(self, message: Dict[str, Any], header_name: str) -> str:
         """Extract header value from message headers."""
         headers = message.get('payload', {}).get('headers', [])
-        for header in headers:
-            if header['name'].lower() == header_name.lower():
-                return header['value']
-        return ''
+        return self.email_parser.header_map(headers).get(header_name.lower(), '')
+    
+    def _process_batch(self, batch_details: List[Dict[str, Any]],
+                       label_mappings: Dict[str, str]) -> List[Dict[str, Any]]:
+        """Parse the bodies of fetched messages and resolve their label names."""
+        return self._submit_batch(batch_details, label_mappings)()
+    
+    def _submit_batch(self, batch_details: List[Dict[str, Any]],
+                      label_mappings: Dict[str, str]) -> Callable[[], List[Dict[str, Any]]]:
+        """
+        Start parsing the bodies of fetched messages.
+        
+        With a parse pool the bodies are parsed in the background, so the
+        caller can fetch the next batch meanwhile.
+        
+        Returns:
+            Function that waits for the bodies, resolves label names and
+            returns the processed rows
+        """
+        if self._skip_ids:
+            # Thread fetches return messages already saved before a resume
+            batch_details = [details for details in batch_details if details['id'] not in self._skip_ids]
+        fetch_profile = self.fetch_options['fetch_profile']
+        started = time.perf_counter()
+        if fetch_profile == 'raw':
+            items = [message_details.get('raw', '') for message_details in batch_details]
+            parse = self.email_parser.parse_raw_with_error_handling
+            # Keep the headers, drop the raw source once it has been parsed
+            batch_details = [
+                {
+                    **{key: value for key, value in message_details.items() if key != 'raw'},
+                    'payload': {'headers': self.email_parser.raw_headers(raw)}
+                }
+                for message_details, raw in zip(batch_details, items)
+            ]
+        else:
+            items = [message_details.get('payload', {}) for message_details in batch_details]
+            parse = self.email_parser.parse_with_error_handling
+        
+        # Parse email bodies, in worker processes if a parse pool is running.
+        # Profiles without bodies skip parsing altogether.
+        if fetch_profile not in ('full', 'raw'):
+            bodies = lambda: [''] * len(batch_details)
+        elif self.parse_pool:
+            bodies = self.parse_pool.submit_bodies(items, raw=fetch_profile == 'raw')
+        else:
+            bodies = lambda: [parse(item) for item in items]
+        submit_seconds = time.perf_counter() - started
+        
+        def finish() -> List[Dict[str, Any]]:
+            # One parse call per batch: submitting plus waiting for the bodies
+            started = time.perf_counter()
+            parsed_bodies = bodies()
+            self.metrics.observe('parse', submit_seconds + time.perf_counter() - started)
+            
+            # Label names and typed header columns
+            with self.metrics.timer('label_mapping'):
+                rows = [
+                    self._process_message(message_details, body, label_mappings)
+                    for message_details, body in zip(batch_details, parsed_bodies)
+                ]
+            if self.rule_matcher:
+                for row in rows:
+                    row['matched_rules'] = self.rule_matcher.match(row)
+            return rows
+        
+        return finish
+    
+    def _process_message(self, message_details: Dict[str, Any], body: str,
+                         label_mappings: Dict[str, str]) -> Dict[str, Any]:
+        """Combine a fetched message with its parsed body, label names and header fields."""
+        # Convert label IDs to names
+        label_ids = message_details.get('labelIds', [])
+        labels = [label_mappings.get(label_id, label_id) for label_id in label_ids]
+        
+        # Parse the headers once here so downstream code reads typed columns
+        headers = message_details.get('payload', {}).get('headers', [])
+        
+        row = {
+            **message_details,
+            **self.email_parser.header_fields(headers),
+            'body': body,
+            'labels': labels
+        }
+        if self.account is not None:
+            row['account'] = self.account
+        return row
+    
+    def _check_cancelled(self) -> None:
+        """Stop the session before anything else reaches its output or checkpoint."""
+        if self._cancel is not None and self._cancel.is_set():
+            raise SessionCancelled("Session cancelled")
+    
+    def _write_batch(self, sink: OutputSink, message_response: List[Dict[str, Any]],
+                     session_id: str, processed_ids: Set[str]) -> None:
+        """Write processed messages to the output sink and checkpoint their IDs."""
+        self._check_cancelled()
+        if self.near_duplicates is not None:
+            # The writer is a single thread in every mode, so the index needs no lock
+            cluster_ids = self.near_duplicates.assign(
+                [row['id'] for row in message_response],
+                [row.get('body') or row.get('snippet', '') for row in message_response]
+            )
+            for row, cluster_id in zip(message_response, cluster_ids):
+                row['cluster_id'] = cluster_id
+        if self.thread_table:
+            # Held until the sink reports the rows as written, like the checkpoint
+            self._thread_rows.update(
+                (row['id'], {key: row.get(key) for key in self._THREAD_ROW_KEYS})
+                for row in message_response
+            )
+        with self.metrics.timer('write'):
+            written_ids = sink.write(message_response)
+        self._checkpoint(written_ids, session_id, processed_ids)
     
-    def save_messages(self, messages: List[Dict[str, Any]], 
+    def _flush_sink(self, sink: OutputSink, session_id: str, processed_ids: Set[str]) -> None:
+        """Write out rows buffered by the sink and checkpoint their IDs."""
+        self._check_cancelled()
+        with self.metrics.timer('write'):
+            written_ids = sink.flush()
+        self._checkpoint(written_ids, session_id, processed_ids)
+    
+    def _checkpoint(self, new_ids: List[str], session_id: str, processed_ids: Set[str]) -> None:
+        # Only IDs the sink reports as on disk are checkpointed
+        if new_ids:
+            if self.thread_table:
+                self.thread_table.write([
+                    self._thread_rows.pop(message_id)
+                    for message_id in new_ids if message_id in self._thread_rows
+                ])
+            processed_ids.update(new_ids)
+            self.metrics.increment('messages_written', len(new_ids))
+            with self.metrics.timer('checkpoint'):
+                self.checkpoint_manager.append_checkpoint(session_id, new_ids)
+    
+    def save_messages(self, messages: Iterable[Dict[str, Any]], 
                      label_mappings: Dict[str, str],
                      session_id: Optional[str] = None,
-                     force_new: bool = False) -> str:
+                     force_new: bool = False,
+                     num_workers: Optional[int] = None,
+                     parse_workers: Optional[int] = None,
+                     by_thread: bool = False,
+                     label_ids: List[str] = ['INBOX'],
+                     cancel: Optional[threading.Event] = None) -> Optional[str]:
         """
-        Save messages to CSV file with timestamps and resume support.
+        Save messages to the output sink with timestamps and resume support.
         
         Args:
-            messages: List of message data to save
+            messages: Messages to save; may be a generator such as
+                GmailClient.iter_messages, in which case fetching starts
+                as soon as the first listing page arrives
             label_mappings: Dictionary mapping label IDs to label names
             session_id: Optional custom session identifier
             force_new: If True, starts a fresh process even if checkpoint exists
+            num_workers: If set, fetch with this many concurrent workers in a
+                pipeline that overlaps fetching, parsing and writing
+            parse_workers: If set, parse bodies in a pool of this many processes
+            by_thread: Fetch whole threads with one threads.get call each
+                (messages need their 'threadId', as listed) and also write a
+                per-thread summary table
+            label_ids: Label IDs the messages were listed with; thread fetches
+                keep only the thread messages that have all of them
+            cancel: Optional event; once it is set the session stops at the
+                next batch, leaving its output and checkpoint as they are
             
         Returns:
-            Path to the saved file
+            Path to the saved file, or None if there was nothing to save
+            
+        Raises:
+            SessionCancelled: If cancel was set before the session finished
+        """
+        session_id, sink, processed_ids, remaining_messages = self._start_session(
+            messages, session_id, force_new
+        )
+        
+        fetch_method = 'get_message_details_batch'
+        fetch_options = self.fetch_options
+        fetch_ids = (message['id'] for message in remaining_messages)
+        if by_thread:
+            fetch_method = 'get_thread_messages_batch'
+            fetch_options = {**self.fetch_options, 'label_ids': label_ids}
+            fetch_ids = self._unique_threads(remaining_messages)
+            self._skip_ids = frozenset(processed_ids)
+            self.thread_table = ThreadTable(self.output_dir / f"threads_{session_id}", self.output_format)
+            if not processed_ids:
+                self.thread_table.remove()
+        
+        # Add progress bar
+        progress = tqdm(total=self._progress_total(messages, processed_ids), desc="Processing emails")
+        if parse_workers:
+            self.parse_pool = ParsePool(parse_workers)
+        self._cancel = cancel
+        try:
+            if num_workers:
+                self._save_pipelined(fetch_ids, fetch_method, fetch_options, label_mappings, sink,
+                                     session_id, processed_ids, num_workers, progress)
+            else:
+                self._save_sequential(fetch_ids, fetch_method, fetch_options, label_mappings, sink,
+                                      session_id, processed_ids, progress)
+            return self._finish_session(sink, session_id)
+        finally:
+            progress.close()
+            if self.parse_pool:
+                self.parse_pool.close()
+                self.parse_pool = None
+            self.thread_table = None
+            self._thread_rows = {}
+            self._skip_ids = frozenset()
+            self._cancel = None
+    
+    @staticmethod
+    def _unique_threads(messages: Iterable[Dict[str, Any]]) -> Iterable[str]:
+        """Yield the thread ID of each listed message the first time it appears."""
+        seen: Set[str] = set()
+        for message in messages:
+            if message['threadId'] not in seen:
+                seen.add(message['threadId'])
+                yield message['threadId']
+    
+    async def save_messages_async(self, messages: Iterable[Dict[str, Any]],
+                                  label_mappings: Dict[str, str],
+                                  session_id: Optional[str] = None,
+                                  force_new: bool = False,
+                                  parse_workers: Optional[int] = None) -> Optional[str]:
+        """
+        Save messages fetched through an AsyncGmailClient.
+        
+        Same output and resume semantics as save_messages; details for each
+        batch are fetched concurrently on the event loop while the previous
+        batch is parsed.
+        
+        Args:
+            messages: Messages to save
+            label_mappings: Dictionary mapping label IDs to label names
+            session_id: Optional custom session identifier
+            force_new: If True, starts a fresh process even if checkpoint exists
+            parse_workers: If set, parse bodies in a pool of this many processes
+            
+        Returns:
+            Path to the saved file, or None if there was nothing to save
+        """
+        session_id, sink, processed_ids, remaining_messages = self._start_session(
+            messages, session_id, force_new
+        )
+        
+        loop = asyncio.get_running_loop()
+        progress = tqdm(total=self._progress_total(messages, processed_ids), desc="Processing emails")
+        if parse_workers:
+            self.parse_pool = ParsePool(parse_workers)
+        
+        async def collect(pending: asyncio.Future) -> None:
+            # Parse off the event loop so fetches keep flowing
+            message_response = await loop.run_in_executor(None, await pending)
+            self._write_batch(sink, message_response, session_id, processed_ids)
+            progress.update(len(message_response))
+        
+        try:
+            pending = None
+            for batch in batched(remaining_messages, ASYNC_CONCURRENCY):
+                with self.metrics.timer('fetch'):
+                    batch_details = await self.gmail_client.get_message_details_batch(
+                        [message['id'] for message in batch], **self.fetch_options
+                    )
+                self.metrics.increment('messages_fetched', len(batch_details))
+                
+                submitted = loop.run_in_executor(None, self._submit_batch, batch_details, label_mappings)
+                if pending:
+                    await collect(pending)
+                pending = submitted
+            if pending:
+                await collect(pending)
+        except Exception as e:
+            logger.error(f"Error during processing: {e}")
+            self._flush_sink(sink, session_id, processed_ids)
+            raise
+        finally:
+            progress.close()
+            if self.parse_pool:
+                self.parse_pool.close()
+                self.parse_pool = None
+        
+        return self._finish_session(sink, session_id)
+    
+    def _start_session(self, messages: Iterable[Dict[str, Any]], session_id: Optional[str],
+                       force_new: bool):
+        """
+        Resolve the session, load or clear its checkpoint and filter processed messages.
+        
+        Returns:
+            Tuple of (session_id, sink, processed_ids, remaining_messages)
         """
         # Use custom session_id if provided, otherwise use timestamp
-        start_time = datetime.now().strftime("%d-%m-%Y-%H-%M-%S")
+        start_time = datetime.now().strftime(SESSION_TIME_FORMAT)
         session_id = session_id or start_time
-        file_path = EMAILS_DIR / f"email_{session_id}.csv"
+        sink = create_sink(self.output_format, self.output_dir / f"email_{session_id}")
         
         # Check for existing checkpoint
         existing_checkpoint = self.checkpoint_manager.load_checkpoint(session_id)
         if existing_checkpoint and not force_new:
             logger.info(f"Found existing checkpoint for session {session_id}")
-            if input("Resume existing session? (y/n): ").lower() != 'y':
+            if self.interactive and input("Resume existing session? (y/n): ").lower() != 'y':
                 force_new = True
         
         # Handle fresh start with existing session_id
         if force_new:
             logger.info(f"Starting fresh process with session ID: {session_id}")
             self.checkpoint_manager.clear_checkpoint(session_id)
-            if file_path.exists():
-                file_path.unlink()  # Remove existing file
+            sink.remove()  # Remove existing output
             processed_ids = set()
         else:
             processed_ids = existing_checkpoint or set()
         
-        # Filter out already processed messages
-        remaining_messages = [
+        # Lazily filter out already processed messages. The snapshot keeps the
+        # filter independent of processed_ids, which grows while we consume it.
+        skip_ids = frozenset(processed_ids)
+        remaining_messages = (
             msg for msg in messages 
-            if msg['id'] not in processed_ids
-        ]
+            if msg['id'] not in skip_ids
+        )
         
         if processed_ids:
-            logger.info(f"Resuming processing: {len(remaining_messages)} messages remaining")
+            logger.info(f"Resuming processing: skipping {len(processed_ids)} processed messages")
+        
+        return session_id, sink, processed_ids, remaining_messages
+    
+    @staticmethod
+    def _progress_total(messages: Iterable[Dict[str, Any]], processed_ids: Set[str]) -> Optional[int]:
+        """Number of messages left to process, if the input has a known length."""
+        if isinstance(messages, Sized):
+            return max(len(messages) - len(processed_ids), 0)
+        return None
+    
+    def _finish_session(self, sink: OutputSink, session_id: str) -> Optional[str]:
+        """Rename the session output with its end timestamp and clear the checkpoint."""
+        self._flush_sink(sink, session_id, set())
+        sink.close()
+        if not sink.exists():
+            logger.info("No new messages to save")
+            if self.thread_table:
+                self.thread_table.remove()
+            self.checkpoint_manager.clear_checkpoint(session_id)
+            return None
         
+        # Rename file with end timestamp
+        end_time = datetime.now().strftime(SESSION_TIME_FORMAT)
+        final_path = sink.finalize(self.output_dir / f"email_{session_id}_{end_time}")
+        if self.thread_table:
+            self.thread_table.finalize(self.output_dir / f"threads_{session_id}_{end_time}")
+        
+        # Clear checkpoint after successful completion
+        self.checkpoint_manager.clear_checkpoint(session_id)
+        
+        return str(final_path)
+    
+    def _save_sequential(self, fetch_ids: Iterable[str], fetch_method: str,
+                         fetch_options: Dict[str, Any], label_mappings: Dict[str, str], sink: OutputSink,
+                         session_id: str, processed_ids: Set[str], progress) -> None:
+        """
+        Fetch, parse and write messages one batch at a time.
+        
+        Each batch is submitted for parsing before the next one is fetched, so
+        with a parse pool the workers parse while the API is being waited on.
+        fetch_ids are message IDs, or thread IDs with get_thread_messages_batch.
+        """
         message_response = []
-        try:
-            # Add progress bar
-            for i, message in tqdm(enumerate(remaining_messages), 
-                                 total=len(remaining_messages),
-                                 desc="Processing emails"):
-                # Get full message details
-                message_details = self.gmail_client.get_message_details(message['id'])
-                
-                # Parse email body
-                body = self.email_parser.parse_with_error_handling(
-                    message_details.get('payload', {})
-                )
-                
-                # Convert label IDs to names
-                label_ids = message_details.get('labelIds', [])
-                labels = [label_mappings.get(label_id, label_id) for label_id in label_ids]
-                
-                # Create processed message
-                processed_message = {
-                    **message_details,
-                    'body': body,
-                    'labels': labels
-                }
-                
-                if (i % DUMP_FREQUENCY == 0) and (i != 0):
-                    # Write batch to file
-                    mode = 'w' if i == DUMP_FREQUENCY and not processed_ids else 'a'
-                    header = i == DUMP_FREQUENCY and not processed_ids
-                    
-                    pd.DataFrame(message_response).to_csv(
-                        file_path,
-                        header=header,
-                        index=False,
-                        mode=mode
-                    )
-                    
-                    # Update checkpoint
-                    processed_ids.update(msg['id'] for msg in message_response)
-                    self.checkpoint_manager.save_checkpoint(session_id, processed_ids)
-                    
+        
+        def collect(pending: Callable[[], List[Dict[str, Any]]]) -> None:
+            nonlocal message_response
+            rows = pending()
+            for processed_message in rows:
+                message_response.append(processed_message)
+                if len(message_response) >= DUMP_FREQUENCY:
+                    self._write_batch(sink, message_response, session_id, processed_ids)
                     message_response = []
+            progress.update(len(rows))
+        
+        try:
+            pending = None
+            for batch in batched(fetch_ids, BATCH_SIZE):
+                self._check_cancelled()
+                # Get full message details for the whole batch in one request
+                with self.metrics.timer('fetch'):
+                    batch_details = getattr(self.gmail_client, fetch_method)(batch, **fetch_options)
+                self.metrics.increment('messages_fetched', len(batch_details))
                 
-                message_response.append(processed_message)
+                submitted = self._submit_batch(batch_details, label_mappings)
+                if pending:
+                    collect(pending)
+                pending = submitted
+            if pending:
+                self._check_cancelled()
+                collect(pending)
             
             # Write remaining messages
             if message_response:
-                pd.DataFrame(message_response).to_csv(
-                    file_path,
-                    header=not file_path.exists(),
-                    index=False,
-                    mode='a'
-                )
-                
-                # Final checkpoint update
-                processed_ids.update(msg['id'] for msg in message_response)
-                self.checkpoint_manager.save_checkpoint(session_id, processed_ids)
-            
-            # Rename file with end timestamp
-            end_time = datetime.now().strftime("%d-%m-%Y-%H-%M-%S")
-            final_path = EMAILS_DIR / f"email_{session_id}_{end_time}.csv"
-            os.rename(file_path, final_path)
-            
-            # Clear checkpoint after successful completion
-            self.checkpoint_manager.clear_checkpoint(session_id)
-            
-            return str(final_path)
+                self._write_batch(sink, message_response, session_id, processed_ids)
             
+        except SessionCancelled:
+            raise
         except Exception as e:
             logger.error(f"Error during processing: {e}")
-            # Save checkpoint before raising exception
+            # Save processed messages before raising exception
             if message_response:
-                processed_ids.update(msg['id'] for msg in message_response)
-                self.checkpoint_manager.save_checkpoint(session_id, processed_ids)
+                self._write_batch(sink, message_response, session_id, processed_ids)
+            self._flush_sink(sink, session_id, processed_ids)
+            raise
+    
+    def _save_pipelined(self, fetch_ids: Iterable[str], fetch_method: str,
+                        fetch_options: Dict[str, Any], label_mappings: Dict[str, str], sink: OutputSink,
+                        session_id: str, processed_ids: Set[str],
+                        num_workers: int, progress) -> None:
+        """Fetch, parse and write messages concurrently through a FetchPipeline."""
+        pipeline = FetchPipeline(
+            client_factory=self.gmail_client.clone,
+            fetch_method=fetch_method,
+            fetch_options=fetch_options,
+            process_batch=lambda batch_details: self._process_batch(batch_details, label_mappings),
+            write_batch=lambda rows: self._write_batch(sink, rows, session_id, processed_ids),
+            num_workers=num_workers,
+            num_parsers=self.parse_pool.num_workers if self.parse_pool else 1,
+            on_progress=progress.update,
+            metrics=self.metrics
+        )
+        try:
+            pipeline.run(fetch_ids)
+        except SessionCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Error during processing: {e}")
+            self._flush_sink(sink, session_id, processed_ids)
             raise
 
 # def base64url_decode(data):
@@ -1,74 +1,230 @@
 import base64
+import email
+import email.policy
+import re
+from datetime import datetime, timezone
+from email.parser import BytesHeaderParser
+from email.utils import getaddresses, parseaddr, parsedate_to_datetime
 from bs4 import BeautifulSoup
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from config.settings import HTML_PARSER_BACKEND
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+try:
+    import lxml  # noqa: F401
+    _BS4_DEFAULT_FEATURES = 'lxml'
+except ImportError:
+    _BS4_DEFAULT_FEATURES = 'html.parser'
+
+# Anything that could start a tag, comment or doctype. Text without a match
+# cannot contain HTML, so it never reaches a parser.
+_TAG_START = re.compile(r'<[A-Za-z!/?]')
+_NON_ASCII = re.compile(r'[^\x00-\x7f]+')
+# Elements whose contents are never shown as text. BeautifulSoup's get_text
+# already skips style and script; noscript is dropped by every backend.
+_INVISIBLE_TAGS = ['style', 'script', 'noscript']
+
+
+def _resolve_backend(backend: str) -> str:
+    if backend == 'auto':
+        return 'selectolax' if HTMLParser is not None else _BS4_DEFAULT_FEATURES
+    if backend == 'selectolax' and HTMLParser is None:
+        raise ImportError("selectolax is not installed: pip install selectolax")
+    return backend
+
 
 class EmailParser:
+    backend = _resolve_backend(HTML_PARSER_BACKEND)
+
     @staticmethod
     def base64url_decode(data: str) -> bytes:
         """Decode base64url-encoded data."""
         data = data.encode('utf-8')
-        data += b'=' * (4 - (len(data) % 4))
+        data += b'=' * (-len(data) % 4)
         return base64.urlsafe_b64decode(data)
 
     @staticmethod
-    def is_html_text(text: str) -> bool:
+    def might_be_html(text: str) -> bool:
+        """Cheap check ruling out text that cannot contain any HTML tag."""
+        return _TAG_START.search(text) is not None
+
+    @classmethod
+    def is_html_text(cls, text: str) -> bool:
         """Check if text contains HTML."""
+        if not cls.might_be_html(text):
+            return False
         try:
-            soup = BeautifulSoup(text, 'html.parser')
-            return len(soup.find_all()) > 0
-        except:
+            return cls._has_elements(BeautifulSoup(text, _BS4_DEFAULT_FEATURES))
+        except Exception:
             return False
 
+    @staticmethod
+    def _has_elements(soup: BeautifulSoup) -> bool:
+        """Check whether parsed markup contains any tag of its own."""
+        # lxml wraps every input in <html><body>, so look inside the body
+        root = soup.body or soup
+        return root.find() is not None
+
     @classmethod
-    def find_text_part(cls, parts: list) -> str:
-        """Extract text from message parts."""
-        res_string = ""
+    def html_to_text(cls, html: str, plain_fallback: bool = False) -> str:
+        """
+        Convert HTML to text with a single parse.
+
+        Args:
+            html: Markup to convert
+            plain_fallback: Return the input unchanged if it turns out to
+                contain no tags (used for text/plain parts)
+
+        Returns:
+            Visible text, space separated
+        """
+        if plain_fallback and not cls.might_be_html(html):
+            return html
+        if cls.backend == 'selectolax':
+            tree = HTMLParser(html)
+            # iter() yields element children only, not text nodes
+            if plain_fallback and (tree.body is None or next(tree.body.iter(), None) is None):
+                return html
+            tree.strip_tags(_INVISIBLE_TAGS)
+            return tree.text(separator=' ')
+        soup = BeautifulSoup(html, cls.backend)
+        if plain_fallback and not cls._has_elements(soup):
+            return html
+        for element in soup.find_all(_INVISIBLE_TAGS):
+            element.decompose()
+        return soup.get_text(separator=' ')
+
+    @classmethod
+    def _part_text(cls, part: Dict[str, Any]) -> Optional[str]:
+        data = part.get('body', {}).get('data')
+        if not data:
+            return None
+        text = cls.base64url_decode(data).decode('utf-8')
+        return cls.html_to_text(text, plain_fallback=part.get('mimeType') == 'text/plain')
+
+    @classmethod
+    def _collect_text(cls, parts: list, pieces: List[str]) -> None:
         for part in parts:
             mimeType = part.get('mimeType')
-            if mimeType == 'text/plain':
-                data = part.get('body', {}).get('data')
-                if data:
-                    text = cls.base64url_decode(data).decode('utf-8')
-                    if cls.is_html_text(text):
-                        soup = BeautifulSoup(text, 'html.parser')
-                        res_string = res_string + " " + soup.get_text(separator=' ')
-                    else:
-                        res_string = res_string + " " + text           
-            elif mimeType == 'text/html':
-                data = part.get('body', {}).get('data')
-                if data:
-                    html = cls.base64url_decode(data).decode('utf-8')
-                    soup = BeautifulSoup(html, 'html.parser')
-                    res_string = res_string + " " + soup.get_text(separator=' ')
-            elif mimeType in ['multipart/alternative', 'multipart/related']:
-                res_string = res_string + " " + cls.find_text_part(part.get('parts', []))
-        return res_string
+            if mimeType in ('text/plain', 'text/html'):
+                text = cls._part_text(part)
+                if text is not None:
+                    pieces.append(text)
+            elif mimeType in ('multipart/alternative', 'multipart/related'):
+                cls._collect_text(part.get('parts', []), pieces)
+
+    @classmethod
+    def find_text_part(cls, parts: list) -> str:
+        """Extract text from message parts."""
+        pieces: List[str] = []
+        cls._collect_text(parts, pieces)
+        return ' '.join(pieces)
 
     @classmethod
     def parse_email_body(cls, payload: Dict[str, Any]) -> str:
         """Parse email body from payload."""
-        if payload['mimeType'] == 'text/plain':
-            data = payload.get('body', {}).get('data')
-            if data:
-                return cls.base64url_decode(data).decode('utf-8')
-        elif payload['mimeType'] == 'text/html':
+        mimeType = payload['mimeType']
+        if mimeType in ('text/plain', 'text/html'):
             data = payload.get('body', {}).get('data')
             if data:
-                html = cls.base64url_decode(data).decode('utf-8')
-                soup = BeautifulSoup(html, 'html.parser')
-                return soup.get_text(separator=' ')
-        elif payload['mimeType'].startswith('multipart/'):
-            parts = payload.get('parts', [])
-            text = cls.find_text_part(parts)
-            if text:
-                return text
+                text = cls.base64url_decode(data).decode('utf-8')
+                return text if mimeType == 'text/plain' else cls.html_to_text(text)
+        elif mimeType.startswith('multipart/'):
+            return cls.find_text_part(payload.get('parts', []))
         return ""
 
+    @classmethod
+    def parse_raw_body(cls, raw: str) -> str:
+        """Parse email body from a base64url-encoded RFC 822 message (format=raw)."""
+        message = email.message_from_bytes(cls.base64url_decode(raw), policy=email.policy.default)
+        pieces = []
+        for part in message.walk():
+            content_type = part.get_content_type()
+            if content_type in ('text/plain', 'text/html') and not part.is_attachment():
+                pieces.append(cls.html_to_text(
+                    part.get_content(), plain_fallback=content_type == 'text/plain'
+                ))
+        return ' '.join(pieces)
+
+    @classmethod
+    def raw_headers(cls, raw: str) -> List[Dict[str, str]]:
+        """Extract the headers of a raw message in the payload 'headers' format."""
+        message = BytesHeaderParser(policy=email.policy.default).parsebytes(cls.base64url_decode(raw))
+        return [{'name': name, 'value': str(value)} for name, value in message.items()]
+
+    @staticmethod
+    def header_map(headers: List[Dict[str, str]]) -> Dict[str, str]:
+        """Map lower-cased header names to their first value."""
+        mapping: Dict[str, str] = {}
+        for header in headers:
+            mapping.setdefault(header['name'].lower(), header['value'])
+        return mapping
+
+    @staticmethod
+    def parse_date(value: str) -> Optional[datetime]:
+        """Parse an RFC 2822 Date header to a UTC datetime, or None if malformed."""
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            return None
+        if date.tzinfo is None:
+            # RFC 2822 "-0000": no zone information, treat as UTC
+            return date.replace(tzinfo=timezone.utc)
+        return date.astimezone(timezone.utc)
+
+    @classmethod
+    def header_fields(cls, headers: List[Dict[str, str]]) -> Dict[str, Any]:
+        """
+        Extract the typed header fields stored as columns.
+
+        Args:
+            headers: Message headers in the payload 'headers' format
+
+        Returns:
+            from_name, from_address, to_addresses, cc_addresses, subject,
+            date (UTC), list_id, rfc822_message_id and in_reply_to
+        """
+        mapping = cls.header_map(headers)
+        from_name, from_address = parseaddr(mapping.get('from', ''))
+        date = mapping.get('date')
+        return {
+            'from_name': from_name,
+            'from_address': from_address.lower(),
+            'to_addresses': [address.lower() for _, address in getaddresses([mapping.get('to', '')]) if address],
+            'cc_addresses': [address.lower() for _, address in getaddresses([mapping.get('cc', '')]) if address],
+            'subject': mapping.get('subject', ''),
+            'date': cls.parse_date(date) if date else None,
+            'list_id': mapping.get('list-id', '').rpartition('<')[2].rstrip('>').strip(),
+            'rfc822_message_id': mapping.get('message-id', '').strip(),
+            'in_reply_to': mapping.get('in-reply-to', '').strip(),
+        }
+
+    @classmethod
+    def message_header_fields(cls, message: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Typed header fields of a processed message.
+
+        Rows from DataProcessor already carry them; rows read back from older
+        output files only have the payload headers, which are parsed here.
+        Merging older files with newer ones adds the columns to the old rows
+        with empty values, so an empty sender also falls back to the headers.
+        """
+        headers = message.get('payload', {}).get('headers')
+        if message.get('from_address') or ('from_address' in message and not headers):
+            return message
+        return cls.header_fields(headers or [])
+
     @staticmethod
     def clean_text(text: str) -> str:
         """Clean and normalize text."""
-        y = ''.join([i if ord(i) < 128 else ' ' for i in text])
-        return ' '.join(y.strip().split())
+        return ' '.join(_NON_ASCII.sub(' ', text).split())
 
     @classmethod
     def parse_with_error_handling(cls, payload: Dict[str, Any]) -> str:
@@ -77,4 +233,12 @@ class EmailParser:
             text = cls.parse_email_body(payload)
             return cls.clean_text(text)
         except:
-            return "Unable to Parse" 
\ No newline at end of file
+            return "Unable to Parse"
+
+    @classmethod
+    def parse_raw_with_error_handling(cls, raw: str) -> str:
+        """Safely parse email body of a raw message with error handling."""
+        try:
+            return cls.clean_text(cls.parse_raw_body(raw))
+        except:
+            return "Unable to Parse"
@@ -0,0 +1,336 @@
+import base64
+import json
+from collections import Counter
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import List, Dict, Any, Callable, Optional
+from httplib2 import Response
+from googleapiclient.errors import HttpError, BatchError
+from config.settings import BATCH_SIZE, BATCH_MODIFY_SIZE
+from .email_parser import EmailParser
+
+
+def error_content(status: int, reason: str = 'rateLimitExceeded') -> bytes:
+    """JSON error body shaped like the ones returned by the Gmail API."""
+    return json.dumps({
+        'error': {
+            'code': status,
+            'message': reason,
+            'errors': [{'reason': reason}]
+        }
+    }).encode('utf-8')
+
+
+def make_http_error(status: int, reason: str = 'rateLimitExceeded') -> HttpError:
+    """Build an HttpError shaped like the ones returned by the Gmail API."""
+    return HttpError(Response({'status': str(status)}), error_content(status, reason))
+
+
+def date_range(query: Optional[str]):
+    """
+    (after, before) bounds in epoch milliseconds of a search query.
+
+    Only the after:/before: operators with epoch seconds are understood;
+    like Gmail, after: is inclusive and before: exclusive.
+    """
+    after, before = 0, float('inf')
+    for term in (query or '').split():
+        operator, _, value = term.partition(':')
+        if operator == 'after':
+            after = int(value) * 1000
+        elif operator == 'before':
+            before = int(value) * 1000
+    return after, before
+
+
+def _payload_to_mime(payload: Dict[str, Any]):
+    """Rebuild a MIME tree from a Gmail payload, as the raw format would return it."""
+    maintype, _, subtype = payload.get('mimeType', 'text/plain').partition('/')
+    if maintype == 'multipart':
+        part = MIMEMultipart(subtype)
+        for child in payload.get('parts', []):
+            part.attach(_payload_to_mime(child))
+    elif maintype == 'text':
+        data = payload.get('body', {}).get('data')
+        text = EmailParser.base64url_decode(data).decode('utf-8') if data else ''
+        part = MIMEText(text, subtype, 'utf-8')
+    else:
+        part = MIMEBase(maintype, subtype)
+        part.set_payload(b'')
+        if payload.get('filename'):
+            part.add_header('Content-Disposition', 'attachment', filename=payload['filename'])
+    return part
+
+
+def format_message(message: Dict[str, Any], format: str = 'full',
+                   metadataHeaders: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Render a full message resource in a messages.get format.
+
+    Args:
+        message: Full message resource
+        format: 'full', 'metadata', 'minimal' or 'raw'
+        metadataHeaders: Headers kept by the metadata format (all if empty)
+
+    Returns:
+        Message resource as messages.get returns it in that format
+    """
+    if format == 'full':
+        return message
+
+    result = {key: value for key, value in message.items() if key != 'payload'}
+    headers = message.get('payload', {}).get('headers', [])
+    if format == 'metadata':
+        wanted = {name.lower() for name in metadataHeaders or []}
+        result['payload'] = {'headers': [
+            header for header in headers
+            if not wanted or header['name'].lower() in wanted
+        ]}
+    elif format == 'raw':
+        mime = _payload_to_mime(message.get('payload', {}))
+        for header in headers:
+            mime[header['name']] = header['value']
+        result['raw'] = base64.urlsafe_b64encode(mime.as_bytes()).decode('ascii')
+    return result
+
+
+class FakeRequest:
+    """Stand-in for googleapiclient.http.HttpRequest."""
+
+    def __init__(self, service: 'FakeGmailService', method: str, handler: Callable[[], Any]):
+        self.service = service
+        self.method = method
+        self.methodId = f"gmail.users.{method}"
+        self._handler = handler
+
+    def execute(self, num_retries: int = 0) -> Any:
+        self.service.calls[self.method] += 1
+        return self._handler()
+
+
+class FakeBatchRequest:
+    """Stand-in for googleapiclient.http.BatchHttpRequest."""
+
+    def __init__(self, service: 'FakeGmailService', callback: Optional[Callable] = None):
+        self.service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request: FakeRequest, callback: Optional[Callable] = None,
+            request_id: Optional[str] = None) -> None:
+        if len(self._requests) >= BATCH_SIZE:
+            raise BatchError(f"Exceeded the maximum of {BATCH_SIZE} calls in a single batch.")
+        if request_id is None:
+            request_id = str(len(self._requests) + 1)
+        self._requests.append((request_id, request, callback))
+
+    def execute(self) -> None:
+        self.service.calls['batch'] += 1
+        if self.service.batch_failures:
+            raise make_http_error(self.service.batch_failures.pop(0))
+        for request_id, request, callback in self._requests:
+            response, exception = None, None
+            try:
+                response = request.execute()
+            except HttpError as error:
+                exception = error
+            callback = callback or self._callback
+            if callback:
+                callback(request_id, response, exception)
+
+
+class _Resource:
+    def __init__(self, service: 'FakeGmailService'):
+        self.service = service
+
+
+class _Messages(_Resource):
+    def get(self, userId: str, id: str, **kwargs) -> FakeRequest:
+        return FakeRequest(self.service, 'messages.get', lambda: self.service._get_message(id, **kwargs))
+
+    def list(self, userId: str, **kwargs) -> FakeRequest:
+        return FakeRequest(self.service, 'messages.list', lambda: self.service._list_messages(**kwargs))
+
+    def batchModify(self, userId: str, body: Dict[str, Any]) -> FakeRequest:
+        return FakeRequest(self.service, 'messages.batchModify', lambda: self.service._batch_modify(**body))
+
+
+class _Threads(_Resource):
+    def get(self, userId: str, id: str, **kwargs) -> FakeRequest:
+        return FakeRequest(self.service, 'threads.get', lambda: self.service._get_thread(id, **kwargs))
+
+
+class _Labels(_Resource):
+    def list(self, userId: str, **kwargs) -> FakeRequest:
+        return FakeRequest(self.service, 'labels.list', lambda: {'labels': list(self.service.labels)})
+
+    def create(self, userId: str, body: Dict[str, Any]) -> FakeRequest:
+        return FakeRequest(self.service, 'labels.create', lambda: self.service._create_label(**body))
+
+
+class _History(_Resource):
+    def list(self, userId: str, **kwargs) -> FakeRequest:
+        return FakeRequest(self.service, 'history.list', lambda: self.service._list_history(**kwargs))
+
+
+class _Users(_Resource):
+    def messages(self) -> _Messages:
+        return _Messages(self.service)
+
+    def threads(self) -> _Threads:
+        return _Threads(self.service)
+
+    def labels(self) -> _Labels:
+        return _Labels(self.service)
+
+    def history(self) -> _History:
+        return _History(self.service)
+
+    def getProfile(self, userId: str) -> FakeRequest:
+        return FakeRequest(self.service, 'getProfile', lambda: {
+            'emailAddress': self.service.email_address,
+            'messagesTotal': len(self.service.messages),
+            'historyId': str(self.service.history_id)
+        })
+
+
+class FakeGmailService:
+    """
+    In-memory Gmail service exposing the subset of the discovery API used by GmailClient.
+
+    Lets batching, pagination and retry behaviour be exercised offline by passing
+    an instance as GmailClient(credentials=None, service=FakeGmailService(...)).
+    """
+
+    def __init__(self, messages: List[Dict[str, Any]],
+                 labels: Optional[List[Dict[str, Any]]] = None,
+                 failures: Optional[Dict[str, List[int]]] = None,
+                 history: Optional[List[Dict[str, Any]]] = None,
+                 batch_failures: Optional[List[int]] = None,
+                 email_address: str = 'me@example.com'):
+        """
+        Initialize fake service.
+
+        Args:
+            messages: Full message resources, in listing order
+            labels: Label resources returned by labels.list
+            failures: Message ID to a list of HTTP status codes that messages.get
+                (or a batchModify including the ID) raises, one per call,
+                before succeeding
+            history: History records with increasing integer 'id's; start IDs
+                older than the first record are treated as expired
+            batch_failures: HTTP status codes that whole batch requests raise,
+                one per call, before any sub-request runs
+            email_address: Address reported by getProfile
+        """
+        self.messages = {message['id']: message for message in messages}
+        self.thread_index: Dict[str, List[str]] = {}
+        for message in messages:
+            self.thread_index.setdefault(message.get('threadId'), []).append(message['id'])
+        self.labels = labels or []
+        self.failures = {message_id: list(codes) for message_id, codes in (failures or {}).items()}
+        self.history = history or []
+        self.batch_failures = list(batch_failures or [])
+        self.history_id = max((int(record['id']) for record in self.history), default=1)
+        self.email_address = email_address
+        self.calls = Counter()
+
+    def users(self) -> _Users:
+        return _Users(self)
+
+    def new_batch_http_request(self, callback: Optional[Callable] = None) -> FakeBatchRequest:
+        return FakeBatchRequest(self, callback)
+
+    def _get_message(self, message_id: str, format: str = 'full',
+                     metadataHeaders: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+        codes = self.failures.get(message_id)
+        if codes:
+            raise make_http_error(codes.pop(0))
+        if message_id not in self.messages:
+            raise make_http_error(404, 'notFound')
+        return format_message(self.messages[message_id], format, metadataHeaders)
+
+    def _get_thread(self, thread_id: str, **kwargs) -> Dict[str, Any]:
+        message_ids = [
+            message_id for message_id in self.thread_index.get(thread_id, [])
+            if message_id in self.messages
+        ]
+        if not message_ids:
+            raise make_http_error(404, 'notFound')
+        return {
+            'id': thread_id,
+            'messages': [self._get_message(message_id, **kwargs) for message_id in message_ids]
+        }
+
+    def _batch_modify(self, ids: List[str], addLabelIds: Optional[List[str]] = None,
+                      removeLabelIds: Optional[List[str]] = None) -> Dict[str, Any]:
+        if len(ids) > BATCH_MODIFY_SIZE:
+            raise make_http_error(400, 'invalidArgument')
+        for message_id in ids:
+            codes = self.failures.get(message_id)
+            if codes:
+                raise make_http_error(codes.pop(0))
+        
+        added, removed = [], []
+        for message_id in ids:
+            message = self.messages.get(message_id)
+            if message is None:
+                continue
+            old = message.get('labelIds', [])
+            new = [label for label in old if label not in (removeLabelIds or [])]
+            new += [label for label in addLabelIds or [] if label not in new]
+            message['labelIds'] = new
+            entry = {'id': message_id, 'threadId': message.get('threadId'), 'labelIds': new}
+            if set(new) - set(old):
+                added.append({'message': entry, 'labelIds': sorted(set(new) - set(old))})
+            if set(old) - set(new):
+                removed.append({'message': entry, 'labelIds': sorted(set(old) - set(new))})
+        
+        # Record the change so incremental syncs see it
+        if added or removed:
+            self.history_id += 1
+            self.history.append({'id': str(self.history_id), 'labelsAdded': added, 'labelsRemoved': removed})
+        return {}
+
+    def _create_label(self, name: str, **kwargs) -> Dict[str, Any]:
+        if any(label['name'] == name for label in self.labels):
+            raise make_http_error(409, 'duplicate')
+        label = {'id': f"Label_{len(self.labels) + 1}", 'name': name, 'type': 'user', **kwargs}
+        self.labels.append(label)
+        return label
+
+    def _list_messages(self, maxResults: int = 100, labelIds: Optional[List[str]] = None,
+                       pageToken: Optional[str] = None, q: Optional[str] = None,
+                       **kwargs) -> Dict[str, Any]:
+        after, before = date_range(q)
+        matching = [
+            message for message in self.messages.values()
+            if (not labelIds or set(labelIds) <= set(message.get('labelIds', [])))
+            and after <= int(message.get('internalDate') or 0) < before
+        ]
+        start = int(pageToken or 0)
+        page = matching[start:start + maxResults]
+        results = {
+            'messages': [{'id': m['id'], 'threadId': m.get('threadId')} for m in page],
+            'resultSizeEstimate': len(page)
+        }
+        if start + maxResults < len(matching):
+            results['nextPageToken'] = str(start + maxResults)
+        return results
+
+    def _list_history(self, startHistoryId: str, maxResults: int = 100,
+                      labelId: Optional[str] = None, pageToken: Optional[str] = None,
+                      **kwargs) -> Dict[str, Any]:
+        start_id = int(startHistoryId)
+        if self.history and start_id < int(self.history[0]['id']) - 1:
+            raise make_http_error(404, 'notFound')
+        records = [record for record in self.history if int(record['id']) > start_id]
+        start = int(pageToken or 0)
+        results = {
+            'history': records[start:start + maxResults],
+            'historyId': str(self.history_id)
+        }
+        if start + maxResults < len(records):
+            results['nextPageToken'] = str(start + maxResults)
+        return results
@@ -0,0 +1,373 @@
+import re
+import json
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Set, Tuple
+from .email_parser import EmailParser
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+_REGEX_META = re.compile(r'[.^$*+?{}\[\]\\|()]')
+_GLOBAL_FLAGS = re.compile(r'^\(\?([aiLmsux]+)\)')
+# Patterns that change meaning or fail to compile inside a larger alternation:
+# group references (backreferences, named groups, conditionals) and a trailing
+# verbose-mode comment, which would swallow the closing parenthesis
+_UNFUSABLE = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?\(|#[^\n]*\Z')
+_SCOPED_FLAGS = (('i', re.IGNORECASE), ('m', re.MULTILINE), ('s', re.DOTALL), ('x', re.VERBOSE))
+# Shorter required strings occur in too many texts to be worth gating a regex on
+MIN_REQUIRED_LITERAL = 3
+
+
+class FilterRule:
+    """
+    Named set of conditions a message must all satisfy.
+
+    Conditions:
+        sender: Sender address, or '@domain' for a whole domain
+        subject: Regular expression searched in the subject
+        list_id: List-Id of a mailing list
+        labels: Label names the message must all carry
+        body: Regular expression searched in the cleaned body
+    """
+
+    def __init__(self, name: str, sender: Optional[str] = None, subject: Optional[str] = None,
+                 list_id: Optional[str] = None, labels: Optional[List[str]] = None,
+                 body: Optional[str] = None):
+        """
+        Initialize rule.
+
+        Args:
+            name: Rule name
+            sender: Sender condition
+            subject: Subject regex condition
+            list_id: List-Id condition
+            labels: Required labels condition
+            body: Body regex condition
+        """
+        if not (sender or subject or list_id or labels or body):
+            raise ValueError(f"Rule {name!r} has no conditions")
+        self.name = name
+        self.sender = sender.lower() if sender else None
+        self.subject = re.compile(subject) if subject else None
+        self.list_id = list_id.strip('<>').lower() if list_id else None
+        self.labels = list(labels or [])
+        self.body = re.compile(body) if body else None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'FilterRule':
+        """Build a rule from its JSON form, see load_filter_rules."""
+        return cls(data['name'], **data.get('match', {}))
+
+    def matches(self, message: Dict[str, Any]) -> bool:
+        """
+        Test the rule against one processed message.
+
+        This is the reference semantics of RuleMatcher, one condition at a time.
+        """
+        fields = EmailParser.message_header_fields(message)
+        sender = fields['from_address'].lower()
+        if self.sender and not (sender.endswith(self.sender) if self.sender.startswith('@')
+                                else sender == self.sender):
+            return False
+        if self.subject and not self.subject.search(fields['subject']):
+            return False
+        if self.list_id and fields['list_id'].lower() != self.list_id:
+            return False
+        if self.body and not self.body.search(message.get('body') or ''):
+            return False
+        return set(self.labels) <= set(message.get('labels', []))
+
+
+def load_filter_rules(rules_file: Path) -> List[FilterRule]:
+    """
+    Load filter rules from a JSON file.
+
+    The file holds a list of rules such as
+    {"name": "invoices", "match": {"sender": "@example.com", "subject": "(?i)invoice"}}.
+    Keys other than name and match are ignored, so a label rules file
+    (see label_rules.load_rules) can be used as well.
+
+    Args:
+        rules_file: Rules file
+
+    Returns:
+        Rules in file order
+    """
+    with open(rules_file) as f:
+        return [FilterRule.from_dict(rule) for rule in json.load(f)]
+
+
+def _literal(pattern: re.Pattern) -> Optional[Tuple[str, bool]]:
+    """The (text, ignore_case) of a pattern that only matches a fixed string, else None."""
+    text = _GLOBAL_FLAGS.sub('', pattern.pattern)
+    if not text or _REGEX_META.search(text) or pattern.flags & (re.VERBOSE | re.ASCII | re.LOCALE):
+        return None
+    return text, bool(pattern.flags & re.IGNORECASE)
+
+
+def _required_literal(pattern: re.Pattern) -> Optional[Tuple[str, bool]]:
+    """
+    The longest fixed string every match of a regex contains, as (text, ignore_case).
+
+    Only top-level literals are considered, so the result is None for
+    alternations and patterns without a run of MIN_REQUIRED_LITERAL characters.
+    """
+    if pattern.flags & (re.ASCII | re.LOCALE):
+        return None
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except (re.error, RecursionError):
+        return None
+    best, run = '', ''
+    for op, value in parsed:
+        if op is sre_parse.LITERAL:
+            run += chr(value)
+            continue
+        if (op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and value[0] >= 1
+                and len(value[2]) == 1 and value[2][0][0] is sre_parse.LITERAL):
+            # x+ or x{2,}: x is required, but whatever follows may come after a repeat
+            run += chr(value[2][0][1])
+        best, run = max(best, run, key=len), ''
+    best = max(best, run, key=len)
+    if len(best) < MIN_REQUIRED_LITERAL:
+        return None
+    return best, bool(parsed.state.flags & re.IGNORECASE)
+
+
+def _fusable(pattern: re.Pattern) -> Optional[str]:
+    """The pattern with its flags scoped to a group, for use in an alternation, or None."""
+    text = _GLOBAL_FLAGS.sub('', pattern.pattern)
+    if _UNFUSABLE.search(text) or pattern.flags & (re.ASCII | re.LOCALE):
+        return None
+    letters = ''.join(letter for letter, flag in _SCOPED_FLAGS if pattern.flags & flag)
+    return f"(?{letters}:{text})"
+
+
+def _trie_pattern(words: List[str]) -> str:
+    """
+    Regex matching any of the words, shaped like their prefix trie.
+
+    At every position the engine follows one branch per character instead
+    of trying each word, and the greedy optional groups make it return the
+    longest word starting there.
+    """
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if '' in node else body
+
+    return build(trie)
+
+
+class _PatternSet:
+    """
+    The subject or body patterns of all rules, compiled into a few combined automata.
+
+    Fixed strings, and the fixed string each regex requires (if it has
+    one), go into one trie regex per case sensitivity that finds every one
+    of them in a single scan; a regex is only run when its required string
+    occurs. The remaining regexes are fused into one alternation that
+    rules out most texts with a single search.
+    """
+
+    def __init__(self):
+        # ignore_case -> fixed string -> (rules it satisfies, regex rules it gates)
+        self._words: Dict[bool, Dict[str, Tuple[List[int], List[int]]]] = {False: {}, True: {}}
+        self.regexes: Dict[int, re.Pattern] = {}
+        self.gated: Set[int] = set()
+        self.unfused: Set[int] = set()
+        self._fused: List[str] = []
+        self._tries: List[Tuple[re.Pattern, Dict[str, Tuple[Set[int], Set[int]]], bool]] = []
+        self._prefilter: Optional[re.Pattern] = None
+
+    def _word(self, text: str, ignore_case: bool) -> Tuple[List[int], List[int]]:
+        return self._words[ignore_case].setdefault(text.lower() if ignore_case else text, ([], []))
+
+    def add(self, index: int, pattern: re.Pattern) -> bool:
+        """
+        Add the pattern of rule index.
+
+        Returns:
+            True if the pattern is a fixed string, False if it is a regex
+        """
+        literal = _literal(pattern)
+        if literal:
+            self._word(*literal)[0].append(index)
+            return True
+        self.regexes[index] = pattern
+        required = _required_literal(pattern)
+        fused = None if required else _fusable(pattern)
+        if required:
+            self._word(*required)[1].append(index)
+            self.gated.add(index)
+        elif fused:
+            self._fused.append(fused)
+        else:
+            self.unfused.add(index)
+        return False
+
+    def compile(self) -> None:
+        """Build the automata once every pattern has been added."""
+        for ignore_case, words in self._words.items():
+            if not words:
+                continue
+            # Every word matching where the longest one does is one of its prefixes
+            implied = {}
+            for word in words:
+                prefixes = [words[word[:end]] for end in range(1, len(word) + 1) if word[:end] in words]
+                implied[word] = (
+                    {index for literal, _ in prefixes for index in literal},
+                    {index for _, gated in prefixes for index in gated}
+                )
+            trie = re.compile(_trie_pattern(list(words)), re.IGNORECASE if ignore_case else 0)
+            self._tries.append((trie, implied, ignore_case))
+        if self._fused:
+            self._prefilter = re.compile('|'.join(self._fused))
+
+    def scan(self, text: str) -> Tuple[Set[int], Set[int]]:
+        """
+        Find the fixed strings occurring in text.
+
+        Returns:
+            Tuple of (rules whose fixed string occurs, regex rules whose
+            required string occurs)
+        """
+        found: Set[int] = set()
+        gated: Set[int] = set()
+        for trie, implied, ignore_case in self._tries:
+            position = 0
+            while True:
+                match = trie.search(text, position)
+                if match is None:
+                    break
+                word = match.group()
+                literal, regexes = implied.get(word.lower() if ignore_case else word, ((), ()))
+                found.update(literal)
+                gated.update(regexes)
+                # Resume one character later to also find words overlapping this one
+                position = match.start() + 1
+        return found, gated
+
+    def any_fused(self, text: str) -> bool:
+        """Whether any fused regex matches text."""
+        return self._prefilter is not None and self._prefilter.search(text) is not None
+
+
+class RuleMatcher:
+    """
+    Evaluates many filter rules against a message in one pass.
+
+    Sender, domain, List-Id and label conditions are looked up in hash
+    indexes; subject and body patterns are compiled into combined automata
+    per field (see _PatternSet). Each satisfied condition counts towards
+    its rule, and a rule matches once all of its conditions are counted.
+    Individual regexes only run for rules whose other conditions already
+    hold and whose automaton reported a possible match.
+    """
+
+    _TEXT_FIELDS = ('subject', 'body')
+
+    def __init__(self, rules: List[FilterRule]):
+        """
+        Compile rules.
+
+        Args:
+            rules: Rules to evaluate; results keep this order
+        """
+        self.rules = list(rules)
+        self._needed: List[int] = []
+        self._by_sender: Dict[str, List[int]] = {}
+        self._by_list_id: Dict[str, List[int]] = {}
+        self._by_label: Dict[str, List[int]] = {}
+        self._patterns = {field: _PatternSet() for field in self._TEXT_FIELDS}
+        # Regex conditions of each rule not yet evaluated when a field's regexes run
+        self._open_regexes: Dict[str, Dict[int, int]] = {field: {} for field in self._TEXT_FIELDS}
+
+        for index, rule in enumerate(self.rules):
+            labels = set(rule.labels)
+            needed = len(labels)
+            if rule.sender:
+                self._by_sender.setdefault(rule.sender, []).append(index)
+                needed += 1
+            if rule.list_id:
+                self._by_list_id.setdefault(rule.list_id, []).append(index)
+                needed += 1
+            for label in labels:
+                self._by_label.setdefault(label, []).append(index)
+            regex_fields = []
+            for field in self._TEXT_FIELDS:
+                pattern = getattr(rule, field)
+                if pattern is not None:
+                    needed += 1
+                    if not self._patterns[field].add(index, pattern):
+                        regex_fields.append(field)
+            for position, field in enumerate(regex_fields):
+                self._open_regexes[field][index] = len(regex_fields) - position
+            self._needed.append(needed)
+
+        for patterns in self._patterns.values():
+            patterns.compile()
+        logger.info(f"Compiled {len(self.rules)} filter rules")
+
+    def match(self, message: Dict[str, Any]) -> List[str]:
+        """
+        Find every rule a processed message satisfies.
+
+        Args:
+            message: Processed message, as produced by DataProcessor
+
+        Returns:
+            Names of the matching rules, in rule order
+        """
+        fields = EmailParser.message_header_fields(message)
+        counts: Counter = Counter()
+        sender = fields['from_address'].lower()
+        counts.update(self._by_sender.get(sender, ()))
+        counts.update(self._by_sender.get('@' + sender.rpartition('@')[2], ()))
+        counts.update(self._by_list_id.get(fields['list_id'].lower(), ()))
+        for label in set(message.get('labels', [])):
+            counts.update(self._by_label.get(label, ()))
+
+        texts = {'subject': fields['subject'], 'body': message.get('body') or ''}
+        gated = {}
+        for field in self._TEXT_FIELDS:
+            found, gated[field] = self._patterns[field].scan(texts[field])
+            counts.update(found)
+        for field in self._TEXT_FIELDS:
+            patterns = self._patterns[field]
+            # Only rules whose remaining conditions are all regexes can still match
+            candidates = [
+                index for index, open_regexes in self._open_regexes[field].items()
+                if counts[index] + open_regexes == self._needed[index]
+                and (index not in patterns.gated or index in gated[field])
+            ]
+            if not candidates:
+                continue
+            if not patterns.any_fused(texts[field]):
+                candidates = [
+                    index for index in candidates
+                    if index in patterns.gated or index in patterns.unfused
+                ]
+            for index in candidates:
+                if patterns.regexes[index].search(texts[field]):
+                    counts[index] += 1
+
+        return [
+            self.rules[index].name for index in sorted(counts)
+            if counts[index] == self._needed[index]
+        ]
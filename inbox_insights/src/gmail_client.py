@@ -1,78 +1,533 @@
-from googleapiclient.discovery import build
+import json
+import socket
+from collections import Counter
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
 from googleapiclient.errors import HttpError
-from typing import List, Dict, Any
+from googleapiclient.http import DEFAULT_HTTP_TIMEOUT_SEC
+from typing import List, Dict, Any, Callable, Iterator, Optional
 import logging
-from config.settings import MAX_RESULTS_PER_PAGE
+import time
+from config.settings import (
+    MAX_RESULTS_PER_PAGE, BATCH_SIZE, BATCH_MODIFY_SIZE, MAX_RETRIES, RETRY_BACKOFF_SECONDS,
+    FETCH_PROFILE, METADATA_HEADERS, CACHED_FETCH_PROFILES
+)
+from .metrics import MetricsRecorder
 
 logger = logging.getLogger(__name__)
 
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded')
+
+# messages.get format and partial-response field mask per fetch profile
+FETCH_PROFILES = {
+    # Label analytics: IDs, labels and timestamps only
+    'minimal': {
+        'format': 'minimal',
+        'fields': 'id,threadId,labelIds,internalDate,sizeEstimate',
+    },
+    # Sender/subject stats: adds the selected headers
+    'metadata': {
+        'format': 'metadata',
+        'fields': 'id,threadId,labelIds,internalDate,sizeEstimate,payload/headers',
+    },
+    # Bodies: MIME tree with part data, without attachment bookkeeping
+    'full': {
+        'format': 'full',
+        'fields': 'id,threadId,labelIds,snippet,internalDate,sizeEstimate,'
+                  'payload(mimeType,headers,body/data,parts)',
+    },
+    # Bodies parsed locally from the RFC 822 source
+    'raw': {
+        'format': 'raw',
+        'fields': 'id,threadId,labelIds,snippet,internalDate,sizeEstimate,raw',
+    },
+}
+
+# Labels are the only mutable part of a message; cached messages refresh just these
+LABEL_REFRESH_PARAMS = {'format': 'minimal', 'fields': 'id,labelIds'}
+
+# batchModify costs 50 quota units, as much as ten messages.get calls
+BATCH_MODIFY_COST = 10
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Check whether an API error means requests are being sent too fast."""
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    content = error.content or b''
+    return status == 429 or (status == 403 and any(reason in content for reason in RATE_LIMIT_REASONS))
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Check whether an API error is transient and worth retrying."""
+    if not isinstance(error, HttpError):
+        return False
+    return error.resp.status in RETRYABLE_STATUS_CODES or is_rate_limit_error(error)
+
+
+def api_method(request: Any) -> str:
+    """Gmail API method of a request, e.g. 'messages.get'."""
+    return request.methodId.replace('gmail.users.', '', 1)
+
+
+class MeteredHttp(httplib2.Http):
+    """httplib2.Http that counts the bytes of the response bodies it receives."""
+    
+    def __init__(self, metrics: MetricsRecorder):
+        # Same defaults as googleapiclient.http.build_http
+        super().__init__(timeout=socket.getdefaulttimeout() or DEFAULT_HTTP_TIMEOUT_SEC)
+        self.redirect_codes = self.redirect_codes - {308}
+        self.metrics = metrics
+    
+    def request(self, *args, **kwargs):
+        response, content = super().request(*args, **kwargs)
+        self.metrics.increment('bytes_downloaded', len(content or b''))
+        return response, content
+
+
+def build_service(credentials, api_endpoint: Optional[str] = None,
+                  metrics: Optional[MetricsRecorder] = None):
+    """
+    Build a Gmail service object.
+    
+    Args:
+        credentials: Google API credentials
+        api_endpoint: Optional root URL to send requests to instead of
+            gmail.googleapis.com, e.g. a local fake server
+        metrics: Optional recorder of the bytes downloaded
+            
+    Returns:
+        googleapiclient Resource for the Gmail API
+    """
+    auth = {'credentials': credentials}
+    if metrics is not None:
+        auth = {'http': AuthorizedHttp(credentials, http=MeteredHttp(metrics))}
+    if api_endpoint is None:
+        return build('gmail', 'v1', **auth)
+    # client_options would move the API calls but not the batch endpoint,
+    # which is taken from the discovery document's rootUrl
+    document = json.loads(discovery_cache.get_static_doc('gmail', 'v1'))
+    document['rootUrl'] = api_endpoint.rstrip('/') + '/'
+    return build_from_document(document, **auth)
+
+
 class GmailClient:
-    def __init__(self, credentials):
+    def __init__(self, credentials, service: Optional[Any] = None,
+                 rate_limiter: Optional[Any] = None, cache: Optional[Any] = None,
+                 offline: bool = False, api_endpoint: Optional[str] = None,
+                 metrics: Optional[MetricsRecorder] = None):
         """
         Initialize Gmail API client.
         
         Args:
             credentials: Google API credentials
+            service: Optional prebuilt Gmail service (e.g. a fake for tests)
+            rate_limiter: Optional TokenBucket throttling batch requests
+            cache: Optional MessageCache consulted before downloading messages
+            offline: Serve everything from the cache without touching the API
+            api_endpoint: Optional root URL of a Gmail API stand-in, see build_service
+            metrics: Optional recorder of API calls, retries, bytes downloaded
+                and listing time
         """
-        self.service = build('gmail', 'v1', credentials=credentials)
+        if offline and cache is None:
+            raise ValueError("Offline mode requires a message cache")
+        self.credentials = credentials
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.offline = offline
+        self.api_endpoint = api_endpoint
+        self.metrics = metrics or MetricsRecorder()
+        self.service = service
+        if service is None and not offline:
+            self.service = build_service(credentials, api_endpoint, metrics)
     
-    def get_messages(self, label_ids: List[str] = ['INBOX']) -> List[Dict[str, Any]]:
+    def clone(self) -> 'GmailClient':
         """
-        Fetch messages with specified labels.
+        Create a client with its own service object.
+        
+        googleapiclient service objects are not thread-safe, so every worker
+        thread needs its own. Credentials and rate limiter are shared; an
+        injected service without credentials (a fake) is shared as well.
+        
+        Returns:
+            New GmailClient
+        """
+        service = self.service if self.credentials is None else None
+        return GmailClient(self.credentials, service=service, rate_limiter=self.rate_limiter,
+                           cache=self.cache, offline=self.offline, api_endpoint=self.api_endpoint,
+                           metrics=self.metrics)
+    
+    def iter_messages(self, label_ids: List[str] = ['INBOX'],
+                      query: Optional[str] = None,
+                      fetch_profile: str = FETCH_PROFILE) -> Iterator[Dict[str, Any]]:
+        """
+        Stream messages with specified labels, one listing page at a time.
         
         Args:
             label_ids: List of label IDs to filter messages
+            query: Optional Gmail search query, e.g. 'after:1262304000 before:1264982400'
+                (not supported offline)
+            fetch_profile: Profile the messages will be fetched with; offline,
+                only messages cached with it are listed
             
-        Returns:
-            List of message IDs and metadata
+        Yields:
+            Message IDs and metadata, as soon as their page has been listed
+            (offline: cached messages with all of label_ids, as of their last fetch)
         """
+        if self.offline:
+            if query:
+                raise ValueError("Search queries are not supported offline")
+            yield from self.cache.iter_ids(profile=fetch_profile, label_ids=label_ids)
+            return
         try:
-            results = self.service.users().messages().list(
-                userId='me',
-                maxResults=MAX_RESULTS_PER_PAGE,
-                labelIds=label_ids
-            ).execute()
-            
-            message_list = results.get("messages", [])
-            iter_num = 1
+            page_token = None
+            iter_num = 0
+            total = 0
+            params = {'q': query} if query else {}
             
-            while 'nextPageToken' in results:
+            while True:
                 iter_num += 1
-                results = self.service.users().messages().list(
-                    userId='me',
-                    maxResults=MAX_RESULTS_PER_PAGE,
-                    pageToken=results['nextPageToken']
-                ).execute()
-                message_list.extend(results.get("messages", []))
+                with self.metrics.timer('list'):
+                    results = self._execute(self.service.users().messages().list(
+                        userId='me',
+                        maxResults=MAX_RESULTS_PER_PAGE,
+                        labelIds=label_ids,
+                        pageToken=page_token,
+                        **params
+                    ))
+                
+                page = results.get("messages", [])
+                total += len(page)
+                yield from page
+                
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
             
             logger.info(f"Total Number of iterations = {iter_num}")
-            logger.info(f"Total Number of mails fetched = {len(message_list)}")
-            
-            return message_list
+            logger.info(f"Total Number of mails fetched = {total}")
             
         except HttpError as error:
             logger.error(f"An error occurred: {error}")
             raise
     
-    def get_message_details(self, message_id: str) -> Dict[str, Any]:
+    def get_messages(self, label_ids: List[str] = ['INBOX']) -> List[Dict[str, Any]]:
+        """
+        Fetch messages with specified labels.
+        
+        Args:
+            label_ids: List of label IDs to filter messages
+            
+        Returns:
+            List of message IDs and metadata
+        """
+        return list(self.iter_messages(label_ids))
+    
+    @staticmethod
+    def message_get_params(fetch_profile: str = FETCH_PROFILE,
+                           metadata_headers: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Build the messages.get query parameters for a fetch profile.
+        
+        Args:
+            fetch_profile: One of FETCH_PROFILES
+            metadata_headers: Headers to return with the metadata profile
+            
+        Returns:
+            format, fields and, for metadata, metadataHeaders parameters
+        """
+        if fetch_profile not in FETCH_PROFILES:
+            raise ValueError(f"Unknown fetch profile: {fetch_profile}")
+        params = dict(FETCH_PROFILES[fetch_profile])
+        if params['format'] == 'metadata':
+            params['metadataHeaders'] = metadata_headers or METADATA_HEADERS
+        return params
+    
+    def get_message_details(self, message_id: str, fetch_profile: str = FETCH_PROFILE,
+                            metadata_headers: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Get detailed information about a specific message.
         
         Args:
             message_id: ID of the message to fetch
+            fetch_profile: One of FETCH_PROFILES
+            metadata_headers: Headers to return with the metadata profile
             
         Returns:
             Message details
         """
+        if self.cache is not None and fetch_profile in CACHED_FETCH_PROFILES:
+            return self.get_message_details_batch([message_id], fetch_profile, metadata_headers)[0]
         try:
-            return self.service.users().messages().get(
+            return self._execute(self.service.users().messages().get(
                 userId="me",
-                id=message_id
-            ).execute()
+                id=message_id,
+                **self.message_get_params(fetch_profile, metadata_headers)
+            ))
         except HttpError as error:
             logger.error(f"An error occurred: {error}")
             raise
     
+    def get_message_details_batch(self, message_ids: List[str],
+                                  fetch_profile: str = FETCH_PROFILE,
+                                  metadata_headers: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Get detailed information about many messages using batch requests.
+        
+        Args:
+            message_ids: IDs of the messages to fetch
+            fetch_profile: One of FETCH_PROFILES
+            metadata_headers: Headers to return with the metadata profile
+            
+        Returns:
+            Message details in the same order as message_ids
+        """
+        params = self.message_get_params(fetch_profile, metadata_headers)
+        if self.cache is not None and fetch_profile in CACHED_FETCH_PROFILES:
+            return self._get_cached_details(message_ids, fetch_profile, params)
+        # Building a discovery resource costs more than serializing a request,
+        # so build it once rather than once per message
+        messages = self.service.users().messages()
+        return self._execute_batched(
+            lambda message_id: messages.get(
+                userId="me",
+                id=message_id,
+                **params
+            ),
+            message_ids
+        )
+    
+    def get_thread_messages_batch(self, thread_ids: List[str],
+                                  fetch_profile: str = FETCH_PROFILE,
+                                  metadata_headers: Optional[List[str]] = None,
+                                  label_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Get the messages of many threads with one threads.get call per thread.
+        
+        Args:
+            thread_ids: IDs of the threads to fetch
+            fetch_profile: One of FETCH_PROFILES except raw, which threads.get
+                does not support
+            metadata_headers: Headers to return with the metadata profile
+            label_ids: If set, keep only messages with all of these labels, as
+                messages.list would; threads.get also returns e.g. SENT replies
+            
+        Returns:
+            Message details, grouped by thread in the order of thread_ids
+        """
+        params = self.message_get_params(fetch_profile, metadata_headers)
+        if params['format'] == 'raw':
+            raise ValueError("threads.get does not support the raw format")
+        params['fields'] = f"id,messages({params['fields']})"
+        resource = self.service.users().threads()
+        threads = self._execute_batched(
+            lambda thread_id: resource.get(
+                userId="me",
+                id=thread_id,
+                **params
+            ),
+            thread_ids
+        )
+        wanted = set(label_ids or [])
+        return [
+            message for thread in threads for message in thread.get('messages', [])
+            if wanted <= set(message.get('labelIds', []))
+        ]
+    
+    def _get_cached_details(self, message_ids: List[str], fetch_profile: str,
+                            params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Fetch messages through the cache.
+        
+        Cache misses are downloaded in full and stored. Message content never
+        changes, so for hits only the current labels are fetched (a minimal,
+        id/labelIds-only request), or nothing at all when offline.
+        
+        Args:
+            message_ids: IDs of the messages to fetch
+            fetch_profile: Cacheable fetch profile
+            params: messages.get parameters for the profile
+            
+        Returns:
+            Message details in the same order as message_ids
+        """
+        details = self.cache.get_many(message_ids, fetch_profile)
+        missing = [message_id for message_id in message_ids if message_id not in details]
+        if missing and self.offline:
+            raise KeyError(f"{len(missing)} messages are not cached, e.g. {missing[0]}")
+        
+        hits = list(details)
+        messages = None if self.offline else self.service.users().messages()
+        if hits and not self.offline:
+            refreshed = self._execute_batched(
+                lambda message_id: messages.get(
+                    userId="me",
+                    id=message_id,
+                    **LABEL_REFRESH_PARAMS
+                ),
+                hits
+            )
+            changed = []
+            for message_id, labels in zip(hits, refreshed):
+                label_ids = labels.get('labelIds', [])
+                if details[message_id].get('labelIds', []) != label_ids:
+                    details[message_id]['labelIds'] = label_ids
+                    changed.append(details[message_id])
+            # Keep the latest labels for offline runs
+            if changed:
+                self.cache.put_many(changed, fetch_profile)
+        
+        if missing:
+            fetched = self._execute_batched(
+                lambda message_id: messages.get(
+                    userId="me",
+                    id=message_id,
+                    **params
+                ),
+                missing
+            )
+            self.cache.put_many(fetched, fetch_profile)
+            details.update(zip(missing, fetched))
+        
+        logger.debug(f"Message cache: {len(hits)} hits, {len(missing)} misses")
+        return [details[message_id] for message_id in message_ids]
+    
+    def _execute_batched(self, make_request: Callable[[str], Any],
+                         keys: List[str]) -> List[Dict[str, Any]]:
+        """
+        Execute one API call per key, packed into batch requests.
+        
+        Sub-requests that fail with a retryable error are re-sent in a
+        later batch with exponential backoff; other errors are raised.
+        
+        Args:
+            make_request: Builds the API request for a single key
+            keys: Keys to build requests for
+            
+        Returns:
+            Responses in the same order as keys
+        """
+        results: Dict[int, Dict[str, Any]] = {}
+        pending = list(range(len(keys)))
+        
+        for attempt in range(MAX_RETRIES + 1):
+            failed: Dict[int, HttpError] = {}
+            for start in range(0, len(pending), BATCH_SIZE):
+                chunk = pending[start:start + BATCH_SIZE]
+                if self.rate_limiter:
+                    self.rate_limiter.acquire(len(chunk))
+                try:
+                    responses, errors = self._execute_batch(
+                        {str(index): make_request(keys[index]) for index in chunk}
+                    )
+                except HttpError as error:
+                    # The multipart request itself failed: every sub-request is retried
+                    if not is_retryable_error(error):
+                        logger.error(f"An error occurred: {error}")
+                        raise
+                    responses, errors = {}, {str(index): error for index in chunk}
+                results.update((int(index), response) for index, response in responses.items())
+                for index, error in errors.items():
+                    if not is_retryable_error(error):
+                        logger.error(f"An error occurred: {error}")
+                        raise error
+                    failed[int(index)] = error
+            
+            if not failed:
+                if self.rate_limiter:
+                    self.rate_limiter.recover()
+                break
+            if attempt == MAX_RETRIES:
+                error = next(iter(failed.values()))
+                logger.error(f"Giving up after {MAX_RETRIES} retries: {error}")
+                raise error
+            
+            pending = sorted(failed)
+            for status, count in Counter(error.resp.status for error in failed.values()).items():
+                self.metrics.increment('api_retries', count, status=str(status))
+            delay = RETRY_BACKOFF_SECONDS * (2 ** attempt)
+            logger.warning(f"Retrying {len(pending)} failed requests in {delay:.1f}s")
+            if self.rate_limiter and any(map(is_rate_limit_error, failed.values())):
+                # The limiter holds back every worker sharing it, not just this one
+                self.rate_limiter.backoff(delay)
+            else:
+                time.sleep(delay)
+        
+        return [results[index] for index in range(len(keys))]
+    
+    def _execute_with_retry(self, make_request: Callable[[], Any], cost: int = 1) -> Any:
+        """
+        Execute a single API call, retrying transient errors with exponential backoff.
+        
+        Args:
+            make_request: Builds the API request
+            cost: Rate limiter tokens the call takes
+            
+        Returns:
+            The response
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire(cost)
+            try:
+                response = self._execute(make_request())
+            except HttpError as error:
+                if not is_retryable_error(error):
+                    logger.error(f"An error occurred: {error}")
+                    raise
+                if attempt == MAX_RETRIES:
+                    logger.error(f"Giving up after {MAX_RETRIES} retries: {error}")
+                    raise
+                self.metrics.increment('api_retries', status=str(error.resp.status))
+                delay = RETRY_BACKOFF_SECONDS * (2 ** attempt)
+                logger.warning(f"Retrying failed request in {delay:.1f}s")
+                if self.rate_limiter and is_rate_limit_error(error):
+                    self.rate_limiter.backoff(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            if self.rate_limiter:
+                self.rate_limiter.recover()
+            return response
+    
+    def _execute(self, request: Any) -> Any:
+        """Execute a single API request, counting the call."""
+        self.metrics.increment('api_calls', method=api_method(request))
+        return request.execute()
+    
+    def _execute_batch(self, requests: Dict[str, Any]):
+        """
+        Send requests as a single multipart batch request.
+        
+        Args:
+            requests: Mapping of request ID to API request
+            
+        Returns:
+            Tuple of (responses, errors), each keyed by request ID
+        """
+        responses: Dict[str, Dict[str, Any]] = {}
+        errors: Dict[str, HttpError] = {}
+        
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                responses[request_id] = response
+        
+        batch = self.service.new_batch_http_request(callback=callback)
+        for request_id, request in requests.items():
+            batch.add(request, request_id=request_id)
+        self.metrics.increment('api_calls', method='batch')
+        for method, count in Counter(map(api_method, requests.values())).items():
+            self.metrics.increment('api_calls', count, method=method)
+        batch.execute()
+        
+        return responses, errors
+    
     def get_labels(self) -> List[Dict[str, Any]]:
         """
         Get all labels for the user.
@@ -80,9 +535,123 @@ class GmailClient:
         Returns:
             List of label information
         """
+        if self.offline:
+            return self.cache.get_labels()
         try:
-            results = self.service.users().labels().list(userId='me').execute()
-            return results.get('labels', [])
+            results = self._execute(self.service.users().labels().list(userId='me'))
+            labels = results.get('labels', [])
+            if self.cache is not None:
+                self.cache.put_labels(labels)
+            return labels
         except HttpError as error:
             logger.error(f"An error occurred: {error}")
-            raise 
\ No newline at end of file
+            raise
+    
+    def create_label(self, name: str) -> Dict[str, Any]:
+        """
+        Create a user label.
+        
+        Args:
+            name: Label name
+            
+        Returns:
+            The new label, with its ID
+        """
+        return self._execute_with_retry(
+            lambda: self.service.users().labels().create(
+                userId='me',
+                body={'name': name, 'labelListVisibility': 'labelShow', 'messageListVisibility': 'show'}
+            )
+        )
+    
+    def batch_modify(self, message_ids: List[str],
+                     add_label_ids: Optional[List[str]] = None,
+                     remove_label_ids: Optional[List[str]] = None) -> int:
+        """
+        Add and remove labels on many messages with messages.batchModify.
+        
+        IDs are sent in chunks of BATCH_MODIFY_SIZE, one call per chunk.
+        Label changes are idempotent, so failed calls are simply retried.
+        
+        Args:
+            message_ids: IDs of the messages to change
+            add_label_ids: Label IDs to add
+            remove_label_ids: Label IDs to remove
+            
+        Returns:
+            Number of batchModify calls made
+        """
+        if self.offline:
+            raise ValueError("Labels cannot be modified offline")
+        changes = {}
+        if add_label_ids:
+            changes['addLabelIds'] = list(add_label_ids)
+        if remove_label_ids:
+            changes['removeLabelIds'] = list(remove_label_ids)
+        if not changes:
+            return 0
+        
+        calls = 0
+        for start in range(0, len(message_ids), BATCH_MODIFY_SIZE):
+            chunk = list(message_ids[start:start + BATCH_MODIFY_SIZE])
+            self._execute_with_retry(
+                lambda: self.service.users().messages().batchModify(
+                    userId='me',
+                    body={'ids': chunk, **changes}
+                ),
+                cost=BATCH_MODIFY_COST
+            )
+            calls += 1
+        logger.info(f"Modified labels of {len(message_ids)} messages in {calls} batchModify calls")
+        return calls
+    
+    def get_profile(self) -> Dict[str, Any]:
+        """
+        Get the profile of the authenticated user.
+        
+        Returns:
+            Profile with emailAddress, messagesTotal and the current historyId
+        """
+        try:
+            return self._execute(self.service.users().getProfile(userId='me'))
+        except HttpError as error:
+            logger.error(f"An error occurred: {error}")
+            raise
+    
+    def get_history(self, start_history_id: str,
+                    label_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Fetch mailbox changes since a history ID.
+        
+        Args:
+            start_history_id: History ID of the last sync
+            label_id: Optional label to restrict the history to
+            
+        Returns:
+            History records in chronological order
+            
+        Raises:
+            HttpError: With status 404 if start_history_id has expired
+        """
+        params = {
+            'userId': 'me',
+            'startHistoryId': start_history_id,
+            'maxResults': MAX_RESULTS_PER_PAGE,
+            'historyTypes': ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+        }
+        if label_id:
+            params['labelId'] = label_id
+        
+        history = []
+        page_token = None
+        while True:
+            if page_token:
+                params['pageToken'] = page_token
+            results = self._execute(self.service.users().history().list(**params))
+            history.extend(results.get('history', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+        
+        logger.info(f"Total Number of history records fetched = {len(history)}")
+        return history
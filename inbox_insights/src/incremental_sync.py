@@ -0,0 +1,161 @@
+import logging
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Set, Optional
+from googleapiclient.errors import HttpError
+from config.settings import SYNC_STATE_FILE, MESSAGE_DB_FILE
+from utils.helpers import apply_message_changes, saved_message_ids
+from .message_store import MessageStore
+from .sinks import apply_parquet_changes, saved_parquet_ids
+from .sync_state import SyncStateManager
+
+logger = logging.getLogger(__name__)
+
+class IncrementalSync:
+    def __init__(self, gmail_client, data_processor, state_manager: Optional[SyncStateManager] = None):
+        """
+        Initialize incremental sync.
+
+        Args:
+            gmail_client: GmailClient used to read the mailbox history
+            data_processor: DataProcessor used to save newly added messages
+            state_manager: Optional SyncStateManager (defaults to SYNC_STATE_FILE)
+        """
+        self.gmail_client = gmail_client
+        self.data_processor = data_processor
+        self.state_manager = state_manager or SyncStateManager(SYNC_STATE_FILE)
+
+    @staticmethod
+    def collect_changes(history: List[Dict[str, Any]], label_ids: List[str]):
+        """
+        Reduce history records to the net set of changes.
+
+        Args:
+            history: History records in chronological order
+            label_ids: Label set being synced
+
+        Returns:
+            Tuple of (added_ids, deleted_ids, label_updates) where label_updates
+            maps message IDs to their latest list of label IDs
+        """
+        wanted = set(label_ids)
+        added: Dict[str, None] = {}
+        deleted: Set[str] = set()
+        label_updates: Dict[str, List[str]] = {}
+
+        for record in history:
+            for entry in record.get('messagesAdded', []):
+                message = entry['message']
+                if wanted & set(message.get('labelIds', [])):
+                    added[message['id']] = None
+                    deleted.discard(message['id'])
+            for entry in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                message = entry['message']
+                label_updates[message['id']] = message.get('labelIds', [])
+                # A message relabeled into the synced set has to be downloaded
+                if wanted & set(entry.get('labelIds', [])) & set(message.get('labelIds', [])):
+                    added[message['id']] = None
+            for entry in record.get('messagesDeleted', []):
+                message_id = entry['message']['id']
+                deleted.add(message_id)
+                added.pop(message_id, None)
+                label_updates.pop(message_id, None)
+
+        return list(added), deleted, label_updates
+
+    def _saved_outputs(self, suffix: str) -> List[Path]:
+        return sorted(self.data_processor.output_dir.glob(f"email_*.{suffix}"))
+
+    def _saved_ids(self, message_ids: Iterable[str]) -> Set[str]:
+        """The given message IDs that earlier syncs already saved."""
+        message_ids = list(message_ids)
+        if not message_ids:
+            return set()
+        output_format = self.data_processor.output_format
+        if output_format == 'sqlite':
+            store = MessageStore(MESSAGE_DB_FILE)
+            try:
+                return store.existing_ids(message_ids)
+            finally:
+                store.close()
+        if output_format == 'parquet':
+            return saved_parquet_ids(self._saved_outputs('parquet'), message_ids)
+        return saved_message_ids(self._saved_outputs('csv'), message_ids)
+
+    def run(self, label_ids: List[str], label_mappings: Dict[str, str],
+            session_id: Optional[str] = None, force_new: bool = False,
+            parse_workers: Optional[int] = None) -> Optional[str]:
+        """
+        Sync the stored dataset with the mailbox.
+
+        Falls back to a full sync if the account was never synced, force_new is
+        set, or the stored history ID has expired.
+
+        Args:
+            label_ids: Labels to sync
+            label_mappings: Dictionary mapping label IDs to label names
+            session_id: Optional custom session identifier
+            force_new: If True, ignore the stored history ID
+            parse_workers: If set, parse bodies in a pool of this many processes
+
+        Returns:
+            Path to the saved file, or None if there was nothing new to download
+        """
+        # Read the history ID before listing so changes made during the sync
+        # are picked up by the next run
+        profile = self.gmail_client.get_profile()
+        account = profile['emailAddress']
+        current_history_id = profile['historyId']
+
+        start_history_id = None if force_new else self.state_manager.get_history_id(account, label_ids)
+        history = None
+        if start_history_id:
+            try:
+                history = self.gmail_client.get_history(
+                    start_history_id,
+                    label_id=label_ids[0] if len(label_ids) == 1 else None
+                )
+            except HttpError as error:
+                if error.resp.status != 404:
+                    raise
+                logger.warning(f"History ID {start_history_id} has expired, running a full sync")
+
+        if history is None:
+            messages = self.gmail_client.iter_messages(label_ids)
+            saved_file = self.data_processor.save_messages(
+                messages, label_mappings, session_id=session_id, force_new=force_new,
+                parse_workers=parse_workers
+            )
+        else:
+            added_ids, deleted_ids, label_updates = self.collect_changes(history, label_ids)
+            # A message relabeled back into the synced set is already saved;
+            # its new labels are in label_updates, so it is not downloaded again
+            saved_ids = self._saved_ids(added_ids)
+            added_ids = [message_id for message_id in added_ids if message_id not in saved_ids]
+            logger.info(
+                f"Incremental sync: {len(added_ids)} added, {len(deleted_ids)} deleted, "
+                f"{len(label_updates)} relabeled"
+            )
+            if deleted_ids or label_updates:
+                output_format = self.data_processor.output_format
+                if output_format == 'sqlite':
+                    store = MessageStore(MESSAGE_DB_FILE)
+                    store.apply_changes(deleted_ids, label_updates, label_mappings)
+                    store.close()
+                elif output_format == 'parquet':
+                    apply_parquet_changes(
+                        self._saved_outputs('parquet'), deleted_ids, label_updates, label_mappings
+                    )
+                else:
+                    apply_message_changes(
+                        self._saved_outputs('csv'), deleted_ids, label_updates, label_mappings
+                    )
+            saved_file = None
+            if added_ids:
+                saved_file = self.data_processor.save_messages(
+                    [{'id': message_id} for message_id in added_ids],
+                    label_mappings, session_id=session_id, force_new=force_new,
+                    parse_workers=parse_workers
+                )
+
+        self.state_manager.save_history_id(account, label_ids, current_history_id)
+        return saved_file
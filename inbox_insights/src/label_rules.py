@@ -0,0 +1,198 @@
+import json
+import logging
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+import pandas as pd
+from config.settings import BATCH_MODIFY_SIZE
+from .analytics import flatten_labels
+from .filters import FilterRule
+
+logger = logging.getLogger(__name__)
+
+# Columns of a saved output the rules are evaluated on
+RULE_COLUMNS = ['id', 'from_address', 'subject', 'list_id', 'labels']
+
+
+class LabelRule(FilterRule):
+    """Label change for every message matching all of the rule's conditions, see FilterRule."""
+
+    def __init__(self, name: str, add_labels: Optional[List[str]] = None,
+                 remove_labels: Optional[List[str]] = None, **conditions):
+        """
+        Initialize rule.
+
+        Args:
+            name: Rule name, for logging
+            add_labels: Label names to add
+            remove_labels: Label names to remove
+            **conditions: Conditions, see FilterRule
+        """
+        super().__init__(name, **conditions)
+        if not (add_labels or remove_labels):
+            raise ValueError(f"Rule {name!r} changes no labels")
+        self.add_labels = list(add_labels or [])
+        self.remove_labels = list(remove_labels or [])
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'LabelRule':
+        """Build a rule from its JSON form, see load_rules."""
+        return cls(
+            data['name'],
+            add_labels=data.get('add_labels'),
+            remove_labels=data.get('remove_labels'),
+            **data.get('match', {})
+        )
+
+
+def load_rules(rules_file: Path) -> List[LabelRule]:
+    """
+    Load label rules from a JSON file.
+
+    The file holds a list of rules such as
+    {"name": "news", "match": {"list_id": "news.example.com", "labels": ["INBOX"]},
+     "add_labels": ["Newsletters"], "remove_labels": ["INBOX"]}.
+    When rules disagree about a label, the later rule wins.
+
+    Args:
+        rules_file: Rules file
+
+    Returns:
+        Rules in file order
+    """
+    with open(rules_file) as f:
+        return [LabelRule.from_dict(rule) for rule in json.load(f)]
+
+
+class _LabelIndex:
+    """Per-label membership masks over the rows of a dataset, built on demand."""
+
+    def __init__(self, df: pd.DataFrame):
+        self._rows = len(df)
+        self._positions, self._values = flatten_labels(df)
+        self._values = self._values.to_numpy()
+        self._masks: Dict[str, np.ndarray] = {}
+
+    def mask(self, label: str) -> np.ndarray:
+        if label not in self._masks:
+            mask = np.zeros(self._rows, dtype=bool)
+            mask[self._positions[self._values == label]] = True
+            self._masks[label] = mask
+        return self._masks[label]
+
+
+def _rule_mask(df: pd.DataFrame, rule: LabelRule, label_index: _LabelIndex) -> np.ndarray:
+    mask = np.ones(len(df), dtype=bool)
+    if rule.sender:
+        senders = df['from_address'].str.lower()
+        if rule.sender.startswith('@'):
+            mask &= senders.str.endswith(rule.sender).to_numpy(dtype=bool)
+        else:
+            mask &= (senders == rule.sender).to_numpy(dtype=bool)
+    for column in ('subject', 'body'):
+        pattern = getattr(rule, column)
+        if pattern is not None:
+            # Bulk mail repeats subjects and bodies; search each distinct value once
+            codes, values = pd.factorize(df[column].fillna(''))
+            found = np.fromiter((bool(pattern.search(value)) for value in values),
+                                dtype=bool, count=len(values))
+            mask &= found[codes]
+    if rule.list_id:
+        mask &= (df['list_id'].str.lower() == rule.list_id).to_numpy(dtype=bool)
+    for label in rule.labels:
+        mask &= label_index.mask(label)
+    return mask
+
+
+def plan_label_changes(df: pd.DataFrame, rules: List[LabelRule]) -> List[Dict[str, Any]]:
+    """
+    Evaluate rules over a dataset and group the matching messages by label change.
+
+    Every rule is evaluated as one vectorized mask over all messages.
+    Messages are then grouped by the combination of rules they match, and
+    messages that already have the resulting labels are dropped, so each
+    distinct change is one list of IDs for batchModify.
+
+    Args:
+        df: Messages with the RULE_COLUMNS (and body, for rules with a body
+            condition), see analytics.load_dataset
+        rules: Rules in priority order (later rules win)
+
+    Returns:
+        Changes, largest first, each with 'add' and 'remove' label names,
+        the matching 'rules' and the message 'ids'
+    """
+    if not rules or df.empty:
+        return []
+    label_index = _LabelIndex(df)
+    matches = np.column_stack([_rule_mask(df, rule, label_index) for rule in rules])
+    rows = np.flatnonzero(matches.any(axis=1))
+    # One group per distinct combination of matched rules
+    patterns, inverse = np.unique(np.packbits(matches[rows], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    ids = df['id'].to_numpy()
+    changes: Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], Dict[str, Any]] = {}
+    for pattern_index, pattern in enumerate(patterns):
+        matched_rules = [rule for rule, bit in zip(rules, np.unpackbits(pattern)[:len(rules)]) if bit]
+        add, remove = set(), set()
+        for rule in matched_rules:
+            add = (add - set(rule.remove_labels)) | set(rule.add_labels)
+            remove = (remove - set(rule.add_labels)) | set(rule.remove_labels)
+
+        group = rows[inverse == pattern_index]
+        done = np.ones(len(group), dtype=bool)
+        for label in add:
+            done &= label_index.mask(label)[group]
+        for label in remove:
+            done &= ~label_index.mask(label)[group]
+        group = group[~done]
+        if not len(group):
+            continue
+
+        key = (tuple(sorted(add)), tuple(sorted(remove)))
+        change = changes.setdefault(key, {'add': list(key[0]), 'remove': list(key[1]),
+                                          'rules': [], 'ids': []})
+        change['rules'] += [rule.name for rule in matched_rules if rule.name not in change['rules']]
+        change['ids'] += ids[group].tolist()
+
+    return sorted(changes.values(), key=lambda change: len(change['ids']), reverse=True)
+
+
+def apply_label_changes(gmail_client, changes: List[Dict[str, Any]],
+                        dry_run: bool = False) -> int:
+    """
+    Apply planned label changes with batchModify.
+
+    User labels that are added but do not exist yet are created first.
+
+    Args:
+        gmail_client: GmailClient to modify messages with (unused in a dry run)
+        changes: Changes as returned by plan_label_changes
+        dry_run: Only log what would be changed
+
+    Returns:
+        Number of batchModify calls made (or needed, in a dry run)
+    """
+    calls = 0
+    if dry_run:
+        for change in changes:
+            needed = -(-len(change['ids']) // BATCH_MODIFY_SIZE)
+            calls += needed
+            logger.info(f"[dry run] {len(change['ids'])} messages: +{change['add']} -{change['remove']} "
+                        f"({', '.join(change['rules'])}; {needed} batchModify calls)")
+        return calls
+
+    label_ids = {label['name']: label['id'] for label in gmail_client.get_labels()}
+    for change in changes:
+        for name in change['add']:
+            if name not in label_ids:
+                label_ids[name] = gmail_client.create_label(name)['id']
+                logger.info(f"Created label {name}")
+        calls += gmail_client.batch_modify(
+            change['ids'],
+            add_label_ids=[label_ids[name] for name in change['add']],
+            # A label that does not exist is on no message
+            remove_label_ids=[label_ids[name] for name in change['remove'] if name in label_ids]
+        )
+    return calls
@@ -0,0 +1,146 @@
+import ast
+import hashlib
+import logging
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+import numpy as np
+import pandas as pd
+from utils.helpers import CSV_CHUNK_SIZE
+from .sinks import CsvSink, create_sink
+
+logger = logging.getLogger(__name__)
+
+
+def hash_ids(message_ids: List[str]) -> np.ndarray:
+    """
+    Map message IDs to 64-bit integers.
+
+    Gmail message IDs are 64-bit hex numbers and map to themselves, so there
+    are no collisions; anything else is hashed with BLAKE2b.
+    """
+    hashes = np.empty(len(message_ids), dtype=np.uint64)
+    for index, message_id in enumerate(message_ids):
+        try:
+            hashes[index] = int(message_id, 16)
+        except (ValueError, OverflowError):
+            hashes[index] = int.from_bytes(
+                hashlib.blake2b(message_id.encode('utf-8'), digest_size=8).digest(), 'little'
+            )
+    return hashes
+
+
+class HashedIdSet:
+    """
+    Compact set of message IDs at 8 bytes per ID.
+
+    IDs are stored as sorted uint64 runs whose sizes roughly double, like
+    a binary counter: adding a chunk merges it into the small runs only,
+    so inserts are amortized O(log n) per ID and lookups binary-search
+    O(log n) runs.
+    """
+
+    def __init__(self):
+        self._runs: List[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self._runs)
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        Vectorized membership test.
+
+        Args:
+            hashes: Hashed IDs, see hash_ids
+
+        Returns:
+            Boolean mask of the hashes already in the set
+        """
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self._runs:
+            positions = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+            found |= run[positions] == hashes
+        return found
+
+    def add(self, hashes: np.ndarray) -> None:
+        """Add hashed IDs to the set."""
+        run = np.unique(hashes)
+        run = run[~self.contains(run)]
+        while self._runs and len(self._runs[-1]) <= 2 * len(run):
+            run = np.union1d(self._runs.pop(), run)
+        if len(run):
+            self._runs.append(run)
+
+
+def _read_columns(file_path: Path) -> List[str]:
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+
+def _to_rows(chunk: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Turn a CSV chunk back into processed-message rows for a sink."""
+    rows = chunk.to_dict('records')
+    # CSV stores the payload and label lists as Python literals
+    for row in rows:
+        for column, empty in (('payload', {}), ('labelIds', []), ('labels', []),
+                              ('to_addresses', []), ('cc_addresses', []), ('matched_rules', [])):
+            value = row.get(column)
+            row[column] = ast.literal_eval(value) if value else empty
+    return rows
+
+
+def merge_sessions(file_paths: List[Path], output_path: Path,
+                   output_format: str = 'csv',
+                   chunk_size: int = CSV_CHUNK_SIZE) -> Optional[Path]:
+    """
+    Merge session CSV files into one deduplicated output with bounded memory.
+
+    Files are streamed in chunks of chunk_size rows, newest first, and a
+    message is kept only the first time its ID is seen, so every message
+    comes with the label state of the newest session that saved it. Memory
+    use is one chunk plus 8 bytes per unique message ID.
+
+    Args:
+        file_paths: Session CSV files, oldest first
+        output_path: Output location without suffix
+        output_format: Output sink name, see sinks.SINKS
+        chunk_size: Rows read per chunk
+
+    Returns:
+        Path of the merged output, or None if there was nothing to merge
+    """
+    # Columns can differ between fetch profiles; write the union in every chunk
+    columns: List[str] = []
+    for file_path in file_paths:
+        columns += [column for column in _read_columns(file_path) if column not in columns]
+
+    sink = create_sink(output_format, output_path.with_name(output_path.name + '.partial'))
+    sink.remove()
+    seen = HashedIdSet()
+    total = duplicates = 0
+
+    for file_path in reversed(file_paths):
+        for chunk in pd.read_csv(file_path, dtype=str, keep_default_na=False,
+                                 chunksize=chunk_size):
+            hashes = hash_ids(chunk['id'].tolist())
+            # Drop IDs seen in newer files and repeats within the chunk
+            _, first = np.unique(hashes, return_index=True)
+            keep = np.zeros(len(chunk), dtype=bool)
+            keep[first] = True
+            keep &= ~seen.contains(hashes)
+            seen.add(hashes[keep])
+
+            total += len(chunk)
+            duplicates += int((~keep).sum())
+            if keep.any():
+                chunk = chunk[keep].reindex(columns=columns, fill_value='')
+                if isinstance(sink, CsvSink):
+                    sink.write_frame(chunk)
+                else:
+                    sink.write(_to_rows(chunk))
+        logger.info(f"Merged {file_path}")
+
+    logger.info(f"Merged {total} rows: {len(seen)} messages, {duplicates} duplicates dropped")
+    sink.flush()
+    sink.close()
+    if not sink.exists():
+        return None
+    return sink.finalize(output_path)
@@ -0,0 +1,218 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+import logging
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+from config.settings import MESSAGE_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+class MessageCache:
+    """
+    Persistent on-disk cache of downloaded messages keyed by message ID.
+
+    Message content never changes in Gmail (only labels do), so a cached
+    payload can be reused forever. Entries are zlib-compressed JSON stored
+    per (id, fetch profile) in SQLite; once the cache exceeds max_bytes the
+    least recently used entries are evicted. Safe to share between threads.
+    """
+
+    EVICT_TO = 0.9  # Fraction of max_bytes to shrink to when evicting
+
+    def __init__(self, cache_file: Path, max_bytes: int = MESSAGE_CACHE_MAX_BYTES):
+        """
+        Initialize message cache.
+
+        Args:
+            cache_file: SQLite database file
+            max_bytes: Maximum total size of compressed entries
+        """
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(cache_file), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        index_labels = not self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_labels'"
+        ).fetchone()
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id TEXT NOT NULL,
+                profile TEXT NOT NULL,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (id, profile)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_messages_last_access ON messages (last_access);
+            CREATE TABLE IF NOT EXISTS labels (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            -- Latest labelIds of every cached message, so listings filter in SQL
+            CREATE TABLE IF NOT EXISTS message_labels (
+                message_id TEXT NOT NULL,
+                label_id TEXT NOT NULL,
+                PRIMARY KEY (message_id, label_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_message_labels_label ON message_labels (label_id, message_id);
+        """)
+        if index_labels:
+            # Caches created before the label table: index the stored messages once
+            with self._lock:
+                self._set_labels(
+                    json.loads(zlib.decompress(data))
+                    for data, in self._conn.execute("SELECT data FROM messages ORDER BY last_access")
+                )
+                self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM messages"
+        ).fetchone()[0]
+
+    def get_many(self, message_ids: List[str], profile: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Look up cached messages.
+
+        Args:
+            message_ids: IDs to look up
+            profile: Fetch profile the messages were downloaded with
+
+        Returns:
+            Mapping of message ID to message for the IDs found in the cache
+        """
+        if not message_ids:
+            return {}
+        found = {}
+        with self._lock:
+            for start in range(0, len(message_ids), 500):
+                chunk = message_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT id, data FROM messages WHERE profile = ? AND id IN ({placeholders})",
+                    [profile, *chunk]
+                ).fetchall()
+                found.update((message_id, json.loads(zlib.decompress(data))) for message_id, data in rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE messages SET last_access = ? WHERE id = ? AND profile = ?",
+                    [(now, message_id, profile) for message_id in found]
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, messages: List[Dict[str, Any]], profile: str) -> None:
+        """
+        Store downloaded messages, evicting old entries if the cache is full.
+
+        Args:
+            messages: Messages as returned by messages.get
+            profile: Fetch profile the messages were downloaded with
+        """
+        now = time.time()
+        rows = []
+        for message in messages:
+            data = zlib.compress(json.dumps(message, separators=(',', ':')).encode('utf-8'))
+            rows.append((message['id'], profile, data, len(data), now))
+        with self._lock:
+            replaced = self._conn.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM messages WHERE profile = ? "
+                f"AND id IN ({','.join('?' * len(rows))})",
+                [profile, *(row[0] for row in rows)]
+            ).fetchone()[0] if rows else 0
+            self._conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)", rows)
+            self._set_labels(messages)
+            self._total_bytes += sum(row[3] for row in rows) - replaced
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        target = int(self.max_bytes * self.EVICT_TO)
+        evicted = 0
+        cursor = self._conn.execute("SELECT id, profile, size FROM messages ORDER BY last_access")
+        victims = []
+        for message_id, profile, size in cursor:
+            if self._total_bytes <= target:
+                break
+            victims.append((message_id, profile))
+            self._total_bytes -= size
+            evicted += 1
+        self._conn.executemany("DELETE FROM messages WHERE id = ? AND profile = ?", victims)
+        # Drop the labels of messages no longer cached under any profile
+        self._conn.executemany(
+            "DELETE FROM message_labels WHERE message_id = ? "
+            "AND NOT EXISTS (SELECT 1 FROM messages WHERE id = ?)",
+            [(message_id, message_id) for message_id, _ in victims]
+        )
+        logger.info(f"Evicted {evicted} messages from cache")
+    
+    def _set_labels(self, messages: Iterable[Dict[str, Any]]) -> None:
+        """Replace the indexed labels of messages; the caller holds the lock."""
+        for message in messages:
+            self._conn.execute("DELETE FROM message_labels WHERE message_id = ?", (message['id'],))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO message_labels VALUES (?, ?)",
+                [(message['id'], label_id) for label_id in message.get('labelIds', [])]
+            )
+
+    def iter_ids(self, profile: Optional[str] = None,
+                 label_ids: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        List cached messages in the same shape as GmailClient.iter_messages.
+
+        Args:
+            profile: Only list messages cached with this fetch profile
+            label_ids: Only list messages that had all of these labels when
+                they were last fetched, like messages.list does
+
+        Yields:
+            Dicts with the message id
+        """
+        conditions, params = [], []
+        if profile:
+            conditions.append("profile = ?")
+            params.append(profile)
+        if label_ids:
+            wanted = sorted(set(label_ids))
+            conditions.append(
+                f"id IN (SELECT message_id FROM message_labels WHERE label_id IN ({','.join('?' * len(wanted))}) "
+                f"GROUP BY message_id HAVING COUNT(*) = ?)"
+            )
+            params += [*wanted, len(wanted)]
+        query = "SELECT DISTINCT id FROM messages"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            message_ids = [row[0] for row in self._conn.execute(query + " ORDER BY id DESC", params)]
+        for message_id in message_ids:
+            yield {'id': message_id}
+
+    def put_labels(self, labels: List[Dict[str, Any]]) -> None:
+        """Store the account's label list for offline runs."""
+        with self._lock:
+            self._conn.execute("DELETE FROM labels")
+            self._conn.executemany(
+                "INSERT INTO labels VALUES (?, ?)",
+                [(label['id'], json.dumps(label)) for label in labels]
+            )
+            self._conn.commit()
+
+    def get_labels(self) -> List[Dict[str, Any]]:
+        """Return the label list stored by the last online run."""
+        with self._lock:
+            return [json.loads(row[0]) for row in self._conn.execute("SELECT data FROM labels")]
+
+    @property
+    def total_bytes(self) -> int:
+        """Total size of the compressed entries."""
+        return self._total_bytes
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,362 @@
+import json
+import sqlite3
+import threading
+import logging
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Set, Optional
+from config.settings import MESSAGE_DB_FILE
+from .email_parser import EmailParser
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    thread_id TEXT,
+    internal_date INTEGER,
+    sender TEXT,
+    sender_domain TEXT,
+    sender_name TEXT,
+    recipients TEXT,
+    subject TEXT,
+    snippet TEXT,
+    body TEXT,
+    size INTEGER,
+    cluster_id TEXT,
+    account TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender, internal_date);
+CREATE INDEX IF NOT EXISTS idx_messages_sender_domain ON messages (sender_domain, internal_date);
+CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages (thread_id, internal_date);
+CREATE INDEX IF NOT EXISTS idx_messages_date ON messages (internal_date);
+
+CREATE TABLE IF NOT EXISTS message_labels (
+    message_id TEXT NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+    label TEXT NOT NULL,
+    PRIMARY KEY (message_id, label)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_message_labels_label ON message_labels (label, message_id);
+
+CREATE TABLE IF NOT EXISTS message_rules (
+    message_id TEXT NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+    rule TEXT NOT NULL,
+    PRIMARY KEY (message_id, rule)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_message_rules_rule ON message_rules (rule, message_id);
+
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    subject TEXT,
+    message_count INTEGER,
+    participants TEXT,
+    first_date INTEGER,
+    last_date INTEGER,
+    labels TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_threads_last_date ON threads (last_date);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    subject, body, content='messages', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, subject, body) VALUES (new.rowid, new.subject, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, subject, body)
+    VALUES ('delete', old.rowid, old.subject, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, subject, body)
+    VALUES ('delete', old.rowid, old.subject, old.body);
+    INSERT INTO messages_fts (rowid, subject, body) VALUES (new.rowid, new.subject, new.body);
+END;
+"""
+
+_UPSERT = """
+INSERT INTO messages (id, thread_id, internal_date, sender, sender_domain, sender_name,
+                      recipients, subject, snippet, body, size, cluster_id, account)
+VALUES (:id, :thread_id, :internal_date, :sender, :sender_domain, :sender_name,
+        :recipients, :subject, :snippet, :body, :size, :cluster_id, :account)
+ON CONFLICT (id) DO UPDATE SET
+    thread_id = excluded.thread_id,
+    internal_date = excluded.internal_date,
+    sender = excluded.sender,
+    sender_domain = excluded.sender_domain,
+    sender_name = excluded.sender_name,
+    recipients = excluded.recipients,
+    subject = excluded.subject,
+    snippet = excluded.snippet,
+    body = excluded.body,
+    size = excluded.size,
+    cluster_id = COALESCE(excluded.cluster_id, messages.cluster_id),
+    account = COALESCE(excluded.account, messages.account)
+"""
+
+_COLUMNS = ('id', 'thread_id', 'internal_date', 'sender', 'sender_domain', 'sender_name',
+            'recipients', 'subject', 'snippet', 'body', 'size', 'cluster_id', 'account')
+
+
+class MessageStore:
+    """
+    Queryable SQLite database of processed messages.
+
+    Messages are upserted by ID, so re-running a session or syncing changes
+    never duplicates rows. Sender, thread and internalDate are indexed,
+    labels live in a join table and subject/body are full-text indexed with
+    FTS5, so typical lookups touch only the matching rows.
+    """
+
+    def __init__(self, db_file: Path = MESSAGE_DB_FILE):
+        """
+        Open (and create if needed) the message database.
+
+        Args:
+            db_file: SQLite database file
+        """
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_SCHEMA)
+        # Databases created before near-duplicate clustering or multi-account
+        # backfills lack the columns
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(messages)")}
+        if 'cluster_id' not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN cluster_id TEXT")
+        if 'account' not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN account TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_cluster ON messages (cluster_id)"
+        )
+
+    @staticmethod
+    def _to_record(row: Dict[str, Any]) -> Dict[str, Any]:
+        """Flatten a processed message into a messages table record."""
+        fields = EmailParser.message_header_fields(row)
+        sender = fields['from_address']
+        return {
+            'id': row['id'],
+            'thread_id': row.get('threadId'),
+            'internal_date': int(row.get('internalDate') or 0),
+            'sender': sender,
+            'sender_domain': sender.rpartition('@')[2],
+            'sender_name': fields['from_name'],
+            'recipients': ', '.join(list(fields['to_addresses']) + list(fields['cc_addresses'])),
+            'subject': fields['subject'],
+            'snippet': row.get('snippet', ''),
+            'body': row.get('body', ''),
+            'size': int(row.get('sizeEstimate') or 0),
+            'cluster_id': row.get('cluster_id') or None,
+            'account': row.get('account') or None,
+        }
+
+    def upsert(self, rows: List[Dict[str, Any]]) -> List[str]:
+        """
+        Insert or update processed messages and their labels.
+
+        Args:
+            rows: Processed messages, as produced by DataProcessor
+
+        Returns:
+            IDs of the stored messages
+        """
+        records = [self._to_record(row) for row in rows]
+        message_ids = [record['id'] for record in records]
+        with self._lock, self._conn:
+            self._conn.executemany(_UPSERT, records)
+            self._replace_labels({row['id']: row.get('labels', []) for row in rows})
+            # Rule matches are only known for rows processed with filter rules
+            self._replace_rules({row['id']: row['matched_rules'] for row in rows if 'matched_rules' in row})
+        return message_ids
+
+    def _replace_labels(self, labels: Dict[str, List[str]]) -> None:
+        self._conn.executemany(
+            "DELETE FROM message_labels WHERE message_id = ?",
+            [(message_id,) for message_id in labels]
+        )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO message_labels (message_id, label) VALUES (?, ?)",
+            [(message_id, label) for message_id, names in labels.items() for label in names]
+        )
+
+    def _replace_rules(self, rules: Dict[str, List[str]]) -> None:
+        self._conn.executemany(
+            "DELETE FROM message_rules WHERE message_id = ?",
+            [(message_id,) for message_id in rules]
+        )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO message_rules (message_id, rule) VALUES (?, ?)",
+            [(message_id, rule) for message_id, names in rules.items() for rule in names]
+        )
+
+    def apply_changes(self, deleted_ids: Set[str], label_updates: Dict[str, List[str]],
+                      label_mappings: Dict[str, str]) -> int:
+        """
+        Apply deletions and label changes from an incremental sync.
+
+        Args:
+            deleted_ids: IDs of messages to drop
+            label_updates: Message ID to its current list of label IDs
+            label_mappings: Dictionary mapping label IDs to label names
+
+        Returns:
+            Number of messages removed or updated
+        """
+        with self._lock, self._conn:
+            changed = self._conn.executemany(
+                "DELETE FROM messages WHERE id = ?", [(message_id,) for message_id in deleted_ids]
+            ).rowcount
+            stored = self.existing_ids(label_updates)
+            self._replace_labels({
+                message_id: [label_mappings.get(label_id, label_id) for label_id in label_ids]
+                for message_id, label_ids in label_updates.items()
+                if message_id in stored
+            })
+        return max(changed, 0) + len(stored)
+
+    def existing_ids(self, message_ids: Iterable[str]) -> Set[str]:
+        """The given message IDs that are stored."""
+        message_ids = list(message_ids)
+        existing = set()
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            existing.update(row[0] for row in self._conn.execute(
+                f"SELECT id FROM messages WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ))
+        return existing
+
+    def query(self, sender: Optional[str] = None, label: Optional[str] = None,
+              thread_id: Optional[str] = None, after: Optional[int] = None,
+              before: Optional[int] = None, text: Optional[str] = None,
+              cluster_id: Optional[str] = None, rule: Optional[str] = None,
+              account: Optional[str] = None, limit: Optional[int] = 100) -> List[Dict[str, Any]]:
+        """
+        Find messages matching all of the given filters, newest first.
+
+        Args:
+            sender: Sender address, or a domain such as '@example.com'
+            label: Label name
+            thread_id: Thread ID
+            after: Only messages with internalDate (ms since epoch) >= after
+            before: Only messages with internalDate (ms since epoch) < before
+            text: FTS5 query over subject and body
+            cluster_id: Near-duplicate cluster ID
+            rule: Name of a filter rule the message matched
+            account: Mailbox the message was backfilled from
+            limit: Maximum number of messages to return (None for all)
+
+        Returns:
+            Messages with their label names
+        """
+        clauses, params = [], []
+        if sender:
+            sender = sender.lower()
+            if sender.startswith('@'):
+                clauses.append("m.sender_domain = ?")
+                params.append(sender[1:])
+            else:
+                clauses.append("m.sender = ?")
+                params.append(sender)
+        if label:
+            clauses.append("m.id IN (SELECT message_id FROM message_labels WHERE label = ?)")
+            params.append(label)
+        if rule:
+            clauses.append("m.id IN (SELECT message_id FROM message_rules WHERE rule = ?)")
+            params.append(rule)
+        if thread_id:
+            clauses.append("m.thread_id = ?")
+            params.append(thread_id)
+        if cluster_id:
+            clauses.append("m.cluster_id = ?")
+            params.append(cluster_id)
+        if account:
+            clauses.append("m.account = ?")
+            params.append(account)
+        if after is not None:
+            clauses.append("m.internal_date >= ?")
+            params.append(after)
+        if before is not None:
+            clauses.append("m.internal_date < ?")
+            params.append(before)
+        if text:
+            clauses.append("m.rowid IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+            params.append(text)
+
+        sql = f"SELECT {', '.join('m.' + column for column in _COLUMNS)} FROM messages m"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY m.internal_date DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            messages = [dict(row) for row in self._conn.execute(sql, params)]
+            labels = self._labels_for([message['id'] for message in messages])
+        for message in messages:
+            message['labels'] = labels.get(message['id'], [])
+        return messages
+
+    def _labels_for(self, message_ids: List[str]) -> Dict[str, List[str]]:
+        labels: Dict[str, List[str]] = {}
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            for message_id, label in self._conn.execute(
+                f"SELECT message_id, label FROM message_labels "
+                f"WHERE message_id IN ({','.join('?' * len(chunk))}) ORDER BY label",
+                chunk
+            ):
+                labels.setdefault(message_id, []).append(label)
+        return labels
+
+    def upsert_threads(self, threads: List[Dict[str, Any]]) -> None:
+        """
+        Insert or replace thread summaries.
+
+        Args:
+            threads: Rows as produced by threads.summarize_threads
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO threads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (thread['threadId'], thread['subject'], thread['message_count'],
+                     json.dumps(list(thread['participants'])), thread['first_date'],
+                     thread['last_date'], json.dumps(list(thread['labels'])))
+                    for thread in threads
+                ]
+            )
+
+    def get_thread(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a thread summary.
+
+        Args:
+            thread_id: Thread ID
+
+        Returns:
+            Thread summary, or None if the thread was never saved in thread mode
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is None:
+            return None
+        thread = dict(row)
+        thread['participants'] = json.loads(thread['participants'])
+        thread['labels'] = json.loads(thread['labels'])
+        return thread
+
+    def count(self) -> int:
+        """Number of stored messages."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,305 @@
+import json
+import os
+import threading
+import time
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, Iterator, Tuple, Sequence
+from config.settings import METRICS_PREFIX, METRICS_LATENCY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+# Stages timed by the ingestion pipeline, in pipeline order
+STAGES = ('list', 'fetch', 'parse', 'label_mapping', 'write', 'checkpoint')
+
+# Help text of the metrics the pipeline records, by name
+METRIC_HELP = {
+    'stage_seconds': 'Duration of ingestion stage calls',
+    'api_calls': 'Gmail API calls made; calls in a batch count individually, the batch itself as method "batch"',
+    'api_retries': 'Gmail API calls retried after a transient error',
+    'bytes_downloaded': 'Bytes of API response bodies received',
+    'messages_fetched': 'Messages downloaded',
+    'messages_written': 'Messages durably written to the output',
+    'queue_depth': 'Batches waiting in a pipeline queue',
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class MetricsRecorder:
+    """
+    Interface through which the pipeline reports stage timings, counters and gauges.
+
+    This base class discards everything, so instrumented code can report
+    unconditionally. InMemoryMetrics keeps the numbers for the exporters;
+    other backends, such as a StatsD client, can subclass it the same way.
+    """
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Time the enclosed block as one call of a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Record one call of a stage that took the given number of seconds."""
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        """Add to a counter."""
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge, such as a queue depth, to its current value."""
+
+
+class InMemoryMetrics(MetricsRecorder):
+    """
+    Thread-safe metrics of one run, kept in memory until they are exported.
+
+    Stage durations go into fixed histogram buckets, so memory use does not
+    grow with the length of the run; percentiles are interpolated within
+    buckets, as Prometheus' histogram_quantile does. Gauges also keep the
+    largest value they were set to.
+    """
+
+    def __init__(self, buckets: Sequence[float] = METRICS_LATENCY_BUCKETS):
+        """
+        Initialize metrics.
+
+        Args:
+            buckets: Increasing upper bounds in seconds of the latency buckets
+        """
+        self.buckets = tuple(buckets)
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], Tuple[float, float]] = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = {
+                    'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(self.buckets) + 1)
+                }
+            stats['count'] += 1
+            stats['sum'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['buckets'][index] += 1
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            peak = self._gauges.get(key, (value, value))[1]
+            self._gauges[key] = (value, max(peak, value))
+
+    def stages(self) -> Dict[str, Dict[str, Any]]:
+        """Per stage call count, total and maximum seconds and bucket counts, pipeline stages first."""
+        with self._lock:
+            stages = {stage: {**stats, 'buckets': list(stats['buckets'])} for stage, stats in self._stages.items()}
+        order = {stage: index for index, stage in enumerate(STAGES)}
+        return dict(sorted(stages.items(), key=lambda item: (order.get(item[0], len(order)), item[0])))
+
+    def counters(self) -> Dict[Tuple[str, Labels], float]:
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+    def gauges(self) -> Dict[Tuple[str, Labels], Tuple[float, float]]:
+        """Current and maximum value of each gauge."""
+        with self._lock:
+            return dict(sorted(self._gauges.items()))
+
+    def quantile(self, stats: Dict[str, Any], q: float) -> float:
+        """
+        Estimate a quantile of a stage's durations from its histogram.
+
+        Args:
+            stats: Stage statistics as returned by stages()
+            q: Quantile between 0 and 1
+
+        Returns:
+            Estimated duration in seconds
+        """
+        rank = q * stats['count']
+        cumulative = 0
+        for index, count in enumerate(stats['buckets']):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else stats['max']
+                return min(lower + (upper - lower) * (rank - cumulative) / count, stats['max'])
+            cumulative += count
+        return stats['max']
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        JSON-serializable summary of the run so far.
+
+        Counters and gauges with labels are nested by their label values.
+        """
+        def put(tree: Dict[str, Any], name: str, labels: Labels, value: Any) -> None:
+            if labels:
+                tree.setdefault(name, {})[','.join(value for _, value in labels)] = value
+            else:
+                tree[name] = value
+
+        counters, gauges = {}, {}
+        for (name, labels), value in self.counters().items():
+            put(counters, name, labels, value)
+        for (name, labels), (value, peak) in self.gauges().items():
+            put(gauges, name, labels, {'last': value, 'max': peak})
+        return {
+            'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec='seconds'),
+            'duration_seconds': round(time.time() - self.started, 3),
+            'stages': {
+                stage: {
+                    'calls': stats['count'],
+                    'total_seconds': round(stats['sum'], 3),
+                    'mean_ms': round(stats['sum'] / stats['count'] * 1000, 3),
+                    'p50_ms': round(self.quantile(stats, 0.5) * 1000, 3),
+                    'p99_ms': round(self.quantile(stats, 0.99) * 1000, 3),
+                    'max_ms': round(stats['max'] * 1000, 3),
+                }
+                for stage, stats in self.stages().items()
+            },
+            'counters': counters,
+            'gauges': gauges,
+        }
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    """Replace a file in one step, so readers never see it half written."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (key, value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+class MetricsExporter:
+    """Writes the metrics of a run to a file at its end."""
+
+    def __init__(self, path: Path):
+        """
+        Initialize exporter.
+
+        Args:
+            path: File to write
+        """
+        self.path = path
+
+    def export(self, metrics: InMemoryMetrics) -> Path:
+        """
+        Write the metrics.
+
+        Args:
+            metrics: Metrics of the run
+
+        Returns:
+            Path of the written file
+        """
+        raise NotImplementedError
+
+
+class JsonExporter(MetricsExporter):
+    """Writes InMemoryMetrics.summary() as a JSON document."""
+
+    def export(self, metrics: InMemoryMetrics) -> Path:
+        _write_atomic(self.path, json.dumps(metrics.summary(), indent=2))
+        return self.path
+
+
+class PrometheusExporter(MetricsExporter):
+    """
+    Writes the Prometheus text exposition format.
+
+    Meant for node_exporter's textfile collector: point the path into its
+    --collector.textfile.directory, with a .prom suffix.
+    """
+
+    def export(self, metrics: InMemoryMetrics) -> Path:
+        lines = []
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+
+        header('stage_seconds', 'histogram', METRIC_HELP['stage_seconds'])
+        for stage, stats in metrics.stages().items():
+            cumulative = 0
+            bounds = [f"{bound:g}" for bound in metrics.buckets] + ['+Inf']
+            for bound, count in zip(bounds, stats['buckets']):
+                cumulative += count
+                labels = _format_labels((('stage', stage), ('le', bound)))
+                lines.append(f"{METRICS_PREFIX}_stage_seconds_bucket{labels} {cumulative}")
+            labels = _format_labels((('stage', stage),))
+            lines.append(f"{METRICS_PREFIX}_stage_seconds_sum{labels} {stats['sum']:.6f}")
+            lines.append(f"{METRICS_PREFIX}_stage_seconds_count{labels} {stats['count']}")
+
+        previous = None
+        for (name, labels), value in metrics.counters().items():
+            if name != previous:
+                header(f"{name}_total", 'counter', METRIC_HELP.get(name, name.replace('_', ' ')))
+                previous = name
+            lines.append(f"{METRICS_PREFIX}_{name}_total{_format_labels(labels)} {value:.15g}")
+
+        gauges = metrics.gauges()
+        for suffix, position in (('', 0), ('_max', 1)):
+            previous = None
+            for (name, labels), values in gauges.items():
+                if name != previous:
+                    help_text = METRIC_HELP.get(name, name.replace('_', ' '))
+                    header(f"{name}{suffix}", 'gauge', help_text + (', highest value during the run' if suffix else ''))
+                    previous = name
+                lines.append(f"{METRICS_PREFIX}_{name}{suffix}{_format_labels(labels)} {values[position]:.15g}")
+
+        header('run_start_timestamp_seconds', 'gauge', 'Unix time the run started')
+        lines.append(f"{METRICS_PREFIX}_run_start_timestamp_seconds {metrics.started:.3f}")
+        header('run_duration_seconds', 'gauge', 'Duration of the run')
+        lines.append(f"{METRICS_PREFIX}_run_duration_seconds {time.time() - metrics.started:.3f}")
+
+        _write_atomic(self.path, '\n'.join(lines) + '\n')
+        return self.path
+
+
+EXPORTERS = {
+    'json': JsonExporter,
+    'prometheus': PrometheusExporter,
+}
+
+
+def create_exporter(name: str, path: Path) -> MetricsExporter:
+    """
+    Create a metrics exporter by name.
+
+    Args:
+        name: One of EXPORTERS
+        path: File to write
+
+    Returns:
+        MetricsExporter instance
+    """
+    if name not in EXPORTERS:
+        raise ValueError(f"Unknown metrics exporter: {name}")
+    return EXPORTERS[name](path)
@@ -0,0 +1,275 @@
+import re
+import json
+import sqlite3
+import zlib
+import logging
+from pathlib import Path
+from typing import List, Dict, Optional
+import numpy as np
+from config.settings import (
+    MINHASH_PERMUTATIONS, LSH_BANDS, SHINGLE_SIZE, NEAR_DUPLICATE_THRESHOLD
+)
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r'\w+')
+_LOW_32_BITS = np.uint64(0xFFFFFFFF)
+_SHIFT_32 = np.uint64(32)
+_COMBINE_PRIME = np.uint64(1000003)
+# Upper bound on shingles hashed at once, bounds the (permutations x shingles) matrix
+_MAX_SHINGLES_PER_CHUNK = 1 << 16
+_UINT64 = 1 << 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS clusters (
+    cluster INTEGER PRIMARY KEY,
+    cluster_id TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    band INTEGER NOT NULL,
+    key INTEGER NOT NULL,
+    cluster INTEGER NOT NULL,
+    PRIMARY KEY (band, key)
+) WITHOUT ROWID;
+"""
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """
+    Hash the word shingles of a text.
+
+    Args:
+        text: Cleaned message body
+        size: Words per shingle (texts shorter than this form one shingle)
+
+    Returns:
+        Distinct 32-bit shingle hashes as uint64, empty for texts without words.
+        Tokens are hashed with CRC-32, so hashes are the same in every process
+        and run (unlike the built-in str hash, see PYTHONHASHSEED).
+    """
+    tokens = _TOKEN_RE.findall(text.lower())
+    if not tokens:
+        return np.empty(0, dtype=np.uint64)
+    # \w never matches a lone surrogate, so every token encodes as UTF-8
+    token_hashes = np.fromiter(map(zlib.crc32, map(str.encode, tokens)), dtype=np.uint64, count=len(tokens))
+    size = min(size, len(tokens))
+    count = len(tokens) - size + 1
+    # Combine each run of size token hashes; uint64 arithmetic wraps, which is fine for hashing
+    shingles = np.zeros(count, dtype=np.uint64)
+    for offset in range(size):
+        shingles = shingles * _COMBINE_PRIME + token_hashes[offset:offset + count]
+    return np.unique((shingles ^ (shingles >> _SHIFT_32)) & _LOW_32_BITS)
+
+
+class MinHasher:
+    """
+    MinHash signatures with multiply-shift hash permutations.
+
+    Two signatures agree in each position with probability equal to the
+    Jaccard similarity of the underlying shingle sets.
+    """
+
+    def __init__(self, num_perm: int = MINHASH_PERMUTATIONS, seed: int = 1):
+        """
+        Initialize hasher.
+
+        Args:
+            num_perm: Signature length
+            seed: Seed of the hash permutations; signatures are only
+                comparable between hashers with the same seed
+        """
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(0, 2**64, num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**64, num_perm, dtype=np.uint64)
+
+    def signatures(self, shingles: List[np.ndarray]) -> np.ndarray:
+        """
+        Compute MinHash signatures.
+
+        Args:
+            shingles: Shingle hashes per text, see shingle_hashes
+
+        Returns:
+            (len(shingles), num_perm) uint32 array; rows of empty texts are all 0xFFFFFFFF
+        """
+        signatures = np.full((len(shingles), self.num_perm), 0xFFFFFFFF, dtype=np.uint32)
+        start = 0
+        while start < len(shingles):
+            # Group texts so one chunk hashes a bounded number of shingles
+            end, total = start, 0
+            while end < len(shingles) and (end == start or total + len(shingles[end]) <= _MAX_SHINGLES_PER_CHUNK):
+                total += len(shingles[end])
+                end += 1
+            rows = [index for index in range(start, end) if len(shingles[index])]
+            if rows:
+                flat = np.concatenate([shingles[index] for index in rows])
+                offsets = np.cumsum([0] + [len(shingles[index]) for index in rows[:-1]])
+                # One row per permutation: (a * x + b) mod 2^64, top 32 bits
+                hashed = ((self._a[:, None] * flat[None, :] + self._b[:, None]) >> _SHIFT_32).astype(np.uint32)
+                signatures[rows] = np.minimum.reduceat(hashed, offsets, axis=1).T
+            start = end
+        return signatures
+
+
+class NearDuplicateIndex:
+    """
+    Streaming near-duplicate clustering of message bodies with MinHash/LSH.
+
+    Signatures are split into bands; messages sharing any band hash become
+    candidates, so each message is compared against a handful of clusters
+    instead of every earlier message. A message joins the candidate cluster
+    whose first message it matches best if their estimated Jaccard
+    similarity reaches the threshold, and otherwise starts a new cluster.
+    Cluster IDs are the message ID of the cluster's first message and never
+    change once assigned, so they can be written out as messages stream by.
+
+    The index is held in memory (about num_perm * 4 bytes per cluster plus
+    one dict entry per distinct band hash). With a db_file, new clusters and
+    band buckets are also stored in SQLite and loaded again on the next run,
+    so later and resumed sessions keep joining the same clusters.
+    """
+
+    def __init__(self, num_perm: int = MINHASH_PERMUTATIONS, bands: int = LSH_BANDS,
+                 threshold: float = NEAR_DUPLICATE_THRESHOLD,
+                 shingle_size: int = SHINGLE_SIZE, seed: int = 1,
+                 db_file: Optional[Path] = None):
+        """
+        Initialize index.
+
+        Args:
+            num_perm: MinHash signature length, a multiple of bands
+            bands: Number of LSH bands; more bands find less similar candidates
+            threshold: Minimum estimated Jaccard similarity to join a cluster
+            shingle_size: Words per shingle
+            seed: Seed of the MinHash permutations
+            db_file: Optional SQLite file to load the index from and keep it in
+
+        Raises:
+            ValueError: If db_file holds an index built with a different
+                num_perm, bands, shingle_size or seed
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.hasher = MinHasher(num_perm, seed)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self._buckets: List[Dict[int, int]] = [{} for _ in range(bands)]
+        self._leaders = np.empty((1024, num_perm), dtype=np.uint32)
+        self._cluster_ids: List[str] = []
+        self._conn: Optional[sqlite3.Connection] = None
+        if db_file is not None:
+            self._load(db_file, {'num_perm': num_perm, 'bands': bands,
+                                 'shingle_size': shingle_size, 'seed': seed})
+
+    def _load(self, db_file: Path, settings: Dict[str, int]) -> None:
+        """Open the index database and load its clusters and band buckets."""
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        # Signatures and band keys depend on these; mixing them would silently
+        # stop messages from matching their clusters
+        stored = dict(self._conn.execute("SELECT key, value FROM settings"))
+        if not stored:
+            with self._conn:
+                self._conn.executemany("INSERT INTO settings (key, value) VALUES (?, ?)",
+                                       [(key, json.dumps(value)) for key, value in settings.items()])
+        elif {key: json.loads(value) for key, value in stored.items()} != settings:
+            raise ValueError(f"Near-duplicate index {db_file} was built with different settings: {stored}")
+
+        rows = self._conn.execute("SELECT cluster_id, signature FROM clusters ORDER BY cluster").fetchall()
+        if rows:
+            signatures = np.frombuffer(b''.join(signature for _, signature in rows), dtype=np.uint32)
+            self._leaders = np.concatenate([
+                signatures.reshape(len(rows), self.hasher.num_perm), self._leaders
+            ])
+            self._cluster_ids = [cluster_id for cluster_id, _ in rows]
+        for band, key, cluster in self._conn.execute("SELECT band, key, cluster FROM buckets"):
+            self._buckets[band][key % _UINT64] = cluster
+        logger.info(f"Loaded {len(self._cluster_ids)} near-duplicate clusters from {db_file}")
+
+    def __len__(self) -> int:
+        """Number of clusters with at least one non-empty message."""
+        return len(self._cluster_ids)
+
+    def _band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """Hash each band of each signature to one 64-bit bucket key."""
+        bands = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        keys = np.zeros((len(signatures), self.bands), dtype=np.uint64)
+        for row in range(self.rows):
+            keys = keys * _COMBINE_PRIME + bands[:, :, row]
+        return keys
+
+    def _new_cluster(self, message_id: str, signature: np.ndarray) -> int:
+        cluster = len(self._cluster_ids)
+        if cluster == len(self._leaders):
+            self._leaders = np.concatenate([self._leaders, np.empty_like(self._leaders)])
+        self._leaders[cluster] = signature
+        self._cluster_ids.append(message_id)
+        return cluster
+
+    def _best_candidate(self, candidates: set, signature: np.ndarray) -> Optional[int]:
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarity = (self._leaders[candidates] == signature).mean(axis=1)
+        best = int(similarity.argmax())
+        return int(candidates[best]) if similarity[best] >= self.threshold else None
+
+    def assign(self, message_ids: List[str], texts: List[str]) -> List[str]:
+        """
+        Assign messages to near-duplicate clusters.
+
+        Args:
+            message_ids: Message IDs
+            texts: Cleaned body of each message
+
+        Returns:
+            Cluster ID per message; messages without any words are their
+            own cluster and are not indexed
+        """
+        shingles = [shingle_hashes(text, self.shingle_size) for text in texts]
+        signatures = self.hasher.signatures(shingles)
+        keys = self._band_keys(signatures).tolist()
+
+        first_new_cluster = len(self._cluster_ids)
+        new_buckets = []
+        cluster_ids = []
+        for message_id, message_shingles, signature, message_keys in zip(
+            message_ids, shingles, signatures, keys
+        ):
+            if not len(message_shingles):
+                cluster_ids.append(message_id)
+                continue
+            candidates = {
+                self._buckets[band].get(key) for band, key in enumerate(message_keys)
+            }
+            candidates.discard(None)
+            cluster = self._best_candidate(candidates, signature) if candidates else None
+            if cluster is None:
+                cluster = self._new_cluster(message_id, signature)
+            for band, key in enumerate(message_keys):
+                if key not in self._buckets[band]:
+                    self._buckets[band][key] = cluster
+                    new_buckets.append((band, key, cluster))
+            cluster_ids.append(self._cluster_ids[cluster])
+        if self._conn is not None:
+            self._save(first_new_cluster, new_buckets)
+        return cluster_ids
+
+    def _save(self, first_new_cluster: int, new_buckets: List[tuple]) -> None:
+        """Store the clusters and band buckets added since first_new_cluster."""
+        clusters = range(first_new_cluster, len(self._cluster_ids))
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO clusters (cluster, cluster_id, signature) VALUES (?, ?, ?)",
+                [(cluster, self._cluster_ids[cluster], self._leaders[cluster].tobytes()) for cluster in clusters]
+            )
+            # SQLite integers are signed
+            self._conn.executemany(
+                "INSERT INTO buckets (band, key, cluster) VALUES (?, ?, ?)",
+                [(band, key - _UINT64 if key >= _UINT64 // 2 else key, cluster) for band, key, cluster in new_buckets]
+            )
@@ -0,0 +1,79 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Any, Callable
+from config.settings import PARSE_CHUNK_SIZE
+from .email_parser import EmailParser
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_chunk(items: List[Any], raw: bool) -> List[str]:
+    """Worker entry point: turn payloads (or raw messages) into cleaned bodies."""
+    parse = EmailParser.parse_raw_with_error_handling if raw else EmailParser.parse_with_error_handling
+    return [parse(item) for item in items]
+
+
+class ParsePool:
+    """
+    Process pool for CPU-bound body extraction.
+
+    Workers receive only message payloads, in chunks of at most PARSE_CHUNK_SIZE
+    (smaller when needed to give every worker a share of a batch), and send back
+    only the cleaned bodies, keeping pickling overhead low. Results are returned
+    in submission order. Safe to call from several threads.
+    """
+
+    def __init__(self, num_workers: int, chunk_size: int = PARSE_CHUNK_SIZE):
+        """
+        Initialize parse pool.
+
+        Args:
+            num_workers: Number of worker processes
+            chunk_size: Most payloads sent to a worker per task
+        """
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self._executor = ProcessPoolExecutor(max_workers=num_workers)
+        logger.info(f"Started parse pool with {num_workers} workers")
+
+    def submit_bodies(self, items: List[Any], raw: bool = False) -> Callable[[], List[str]]:
+        """
+        Start parsing message bodies in the pool without waiting for them.
+
+        Args:
+            items: Message payloads, or raw messages if raw is set
+            raw: Whether items are base64url RFC 822 sources (format=raw)
+
+        Returns:
+            Function that waits for the cleaned bodies and returns them in the
+            same order as items
+        """
+        chunk_size = max(1, min(self.chunk_size, -(-len(items) // self.num_workers)))
+        futures = [
+            self._executor.submit(_parse_chunk, items[start:start + chunk_size], raw)
+            for start in range(0, len(items), chunk_size)
+        ]
+        return lambda: [body for future in futures for body in future.result()]
+
+    def parse_bodies(self, items: List[Any], raw: bool = False) -> List[str]:
+        """
+        Parse message bodies in the pool.
+
+        Args:
+            items: Message payloads, or raw messages if raw is set
+            raw: Whether items are base64url RFC 822 sources (format=raw)
+
+        Returns:
+            Cleaned bodies in the same order as items
+        """
+        return self.submit_bodies(items, raw)()
+
+    def close(self) -> None:
+        """Shut down the worker processes."""
+        self._executor.shutdown()
+
+    def __enter__(self) -> 'ParsePool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,197 @@
+import queue
+import threading
+import logging
+from typing import List, Dict, Any, Callable, Iterable, Optional
+from config.settings import BATCH_SIZE, DUMP_FREQUENCY, FETCH_WORKERS, PIPELINE_QUEUE_SIZE
+from utils.helpers import batched
+from .metrics import MetricsRecorder
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class PipelineStopped(Exception):
+    """Raised inside a stage when another stage has failed."""
+
+
+class FetchPipeline:
+    """
+    Three-stage ingestion pipeline connected by bounded queues.
+
+    A pool of fetch workers downloads message batches, one or more parse
+    threads turn them into processed rows and a single writer stage
+    (running in the calling thread) persists them. Batches may reach the writer out of
+    order; the writer only reports IDs once their rows have been written,
+    so checkpoints never contain messages that are missing from the output.
+    """
+
+    def __init__(self, client_factory: Callable[[], Any],
+                 process_batch: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]],
+                 write_batch: Callable[[List[Dict[str, Any]]], None],
+                 num_workers: int = FETCH_WORKERS,
+                 num_parsers: int = 1,
+                 fetch_method: str = 'get_message_details_batch',
+                 fetch_options: Optional[Dict[str, Any]] = None,
+                 queue_size: int = PIPELINE_QUEUE_SIZE,
+                 on_progress: Optional[Callable[[int], None]] = None,
+                 metrics: Optional[MetricsRecorder] = None):
+        """
+        Initialize pipeline.
+
+        Args:
+            client_factory: Returns a new GmailClient; called once per fetch worker
+            process_batch: Turns a batch of raw message details into output rows
+            write_batch: Persists a list of rows and checkpoints their IDs
+            num_workers: Number of fetch worker threads
+            num_parsers: Number of parse threads (more than one only pays off
+                when process_batch hands work to a process pool)
+            fetch_method: GmailClient method fetching a batch of IDs
+                (get_thread_messages_batch to feed thread IDs)
+            fetch_options: Keyword arguments for the fetch method
+            queue_size: Maximum number of batches buffered between stages
+            on_progress: Called with the number of rows written after each write
+            metrics: Optional recorder of fetch times and queue depths
+        """
+        self.client_factory = client_factory
+        self.process_batch = process_batch
+        self.write_batch = write_batch
+        self.num_workers = num_workers
+        self.num_parsers = num_parsers
+        self.fetch_method = fetch_method
+        self.fetch_options = fetch_options or {}
+        self.on_progress = on_progress
+        self.metrics = metrics or MetricsRecorder()
+        self._fetch_queue = queue.Queue(maxsize=queue_size)
+        self._parse_queue = queue.Queue(maxsize=queue_size)
+        self._write_queue = queue.Queue(maxsize=queue_size)
+        self._queue_names = {self._fetch_queue: 'fetch', self._parse_queue: 'parse', self._write_queue: 'write'}
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._running = {'fetch': num_workers, 'parse': num_parsers}
+        self._errors: List[BaseException] = []
+
+    def _put(self, q: queue.Queue, item: Any) -> None:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                self.metrics.set_gauge('queue_depth', q.qsize(), queue=self._queue_names[q])
+                return
+            except queue.Full:
+                continue
+        raise PipelineStopped()
+
+    def _get(self, q: queue.Queue) -> Any:
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise PipelineStopped()
+
+    def _run_stage(self, target: Callable, *args) -> None:
+        try:
+            target(*args)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            logger.error(f"Pipeline stage failed: {e}")
+            self._errors.append(e)
+            self._stop.set()
+
+    def _feed(self, message_ids: Iterable[str]) -> None:
+        for batch in batched(message_ids, BATCH_SIZE):
+            self._put(self._fetch_queue, batch)
+        for _ in range(self.num_workers):
+            self._put(self._fetch_queue, _DONE)
+
+    def _stage_done(self, stage: str, next_queue: queue.Queue, consumers: int) -> None:
+        """Signal the next stage once the last thread of a stage has finished."""
+        with self._lock:
+            self._running[stage] -= 1
+            last = self._running[stage] == 0
+        if last:
+            for _ in range(consumers):
+                self._put(next_queue, _DONE)
+
+    def _fetch(self) -> None:
+        client = self.client_factory()
+        fetch = getattr(client, self.fetch_method)
+        while True:
+            batch = self._get(self._fetch_queue)
+            if batch is _DONE:
+                break
+            with self.metrics.timer('fetch'):
+                batch_details = fetch(batch, **self.fetch_options)
+            self.metrics.increment('messages_fetched', len(batch_details))
+            self._put(self._parse_queue, batch_details)
+        self._stage_done('fetch', self._parse_queue, self.num_parsers)
+
+    def _parse(self) -> None:
+        while True:
+            batch_details = self._get(self._parse_queue)
+            if batch_details is _DONE:
+                break
+            self._put(self._write_queue, self.process_batch(batch_details))
+        self._stage_done('parse', self._write_queue, 1)
+
+    def _write(self) -> int:
+        written = 0
+        pending = []
+        while True:
+            rows = self._get(self._write_queue)
+            if rows is _DONE:
+                break
+            pending.extend(rows)
+            if len(pending) >= DUMP_FREQUENCY:
+                self.write_batch(pending)
+                written += len(pending)
+                if self.on_progress:
+                    self.on_progress(len(pending))
+                pending = []
+        if pending:
+            self.write_batch(pending)
+            written += len(pending)
+            if self.on_progress:
+                self.on_progress(len(pending))
+        return written
+
+    def run(self, message_ids: Iterable[str]) -> int:
+        """
+        Fetch, parse and write the given messages.
+
+        Args:
+            message_ids: IDs of the messages (or threads) to process
+
+        Returns:
+            Number of rows written
+        """
+        threads = [threading.Thread(target=self._run_stage, args=(self._feed, message_ids),
+                                    name="pipeline-feed", daemon=True)]
+        threads += [
+            threading.Thread(target=self._run_stage, args=(self._fetch,),
+                             name=f"pipeline-fetch-{n}", daemon=True)
+            for n in range(self.num_workers)
+        ]
+        threads += [
+            threading.Thread(target=self._run_stage, args=(self._parse,),
+                             name=f"pipeline-parse-{n}", daemon=True)
+            for n in range(self.num_parsers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            written = self._write()
+        except PipelineStopped:
+            written = 0
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join(timeout=1)
+
+        if self._errors:
+            raise self._errors[0]
+        return written
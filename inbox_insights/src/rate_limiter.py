@@ -0,0 +1,79 @@
+import threading
+import time
+import logging
+from typing import Optional
+from config.settings import REQUESTS_PER_SECOND, BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by all fetch workers of an account.
+
+    The refill rate adapts to the API: it is halved whenever a rate-limit
+    error is reported and creeps back towards the configured rate after
+    successful requests.
+    """
+
+    BACKOFF_FACTOR = 0.5
+    RECOVERY_FACTOR = 1.05
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND,
+                 capacity: Optional[float] = None,
+                 min_rate: float = 1.0):
+        """
+        Initialize token bucket.
+
+        Args:
+            rate: Maximum number of requests per second
+            capacity: Maximum burst size (defaults to one full batch)
+            min_rate: Lower bound for the rate after repeated backoffs
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity or max(rate, BATCH_SIZE)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1) -> None:
+        """
+        Block until the requested number of tokens is available.
+
+        Args:
+            tokens: Number of requests about to be made
+        """
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._blocked_until and self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = max(self._blocked_until - now, (tokens - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def backoff(self, delay: float) -> None:
+        """
+        Slow down after a rate-limit error.
+
+        Args:
+            delay: Seconds during which no tokens are handed out
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.BACKOFF_FACTOR)
+            self.tokens = 0
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        logger.warning(f"Rate limited, backing off to {self.rate:.1f} requests/s")
+
+    def recover(self) -> None:
+        """Increase the rate again after a successful request."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate * self.RECOVERY_FACTOR)
@@ -0,0 +1,538 @@
+import os
+import re
+import json
+import shutil
+import logging
+from itertools import chain
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterator
+import numpy as np
+import pandas as pd
+from config.settings import (
+    SEARCH_SEGMENT_DOCS, SEARCH_MAX_TERM_LENGTH, BM25_K1, BM25_B, SEARCH_EMBEDDING_MODEL,
+    SEARCH_EMBEDDING_CHARS, SEARCH_IVF_MIN_VECTORS, SEARCH_IVF_PROBES
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = ds = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r'\w+')
+MANIFEST_FILE = 'manifest.json'
+# Live mask of a segment as written; superseding documents writes a new one
+LIVE_FILE = 'live.npy'
+# Columns of a saved output that are indexed
+SEARCH_COLUMNS = ['id', 'subject', 'body']
+# Vectors scored at once in a brute-force scan, bounds the float32 copy of a float16 block
+_VECTOR_CHUNK = 1 << 16
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens of a text, without tokens longer than SEARCH_MAX_TERM_LENGTH."""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if len(token) <= SEARCH_MAX_TERM_LENGTH]
+
+
+def iter_documents(path: Path, chunk_size: int = SEARCH_SEGMENT_DOCS) -> Iterator[pd.DataFrame]:
+    """
+    Stream the indexed columns of a saved output.
+
+    Args:
+        path: Parquet dataset directory or CSV file written by an output sink
+        chunk_size: Messages per chunk (Parquet chunks may be somewhat larger)
+
+    Yields:
+        DataFrames with the SEARCH_COLUMNS as strings
+    """
+    if path.suffix == '.parquet' or path.is_dir():
+        if ds is None:
+            raise ImportError("pyarrow is required to read Parquet output: pip install pyarrow")
+        batches, rows = [], 0
+        for batch in ds.dataset(path, format='parquet', partitioning='hive').to_batches(columns=SEARCH_COLUMNS):
+            batches.append(batch)
+            rows += batch.num_rows
+            if rows >= chunk_size:
+                yield pa.Table.from_batches(batches).to_pandas().fillna('')
+                batches, rows = [], 0
+        if rows:
+            yield pa.Table.from_batches(batches).to_pandas().fillna('')
+        return
+    available = set(pd.read_csv(path, nrows=0).columns)
+    for chunk in pd.read_csv(path, usecols=[column for column in SEARCH_COLUMNS if column in available],
+                             dtype=str, keep_default_na=False, chunksize=chunk_size):
+        yield chunk.reindex(columns=SEARCH_COLUMNS, fill_value='')
+
+
+class SentenceEmbedder:
+    """Embeds texts on the CPU with a sentence-transformers model."""
+
+    def __init__(self, model_name: str = SEARCH_EMBEDDING_MODEL):
+        """
+        Initialize embedder.
+
+        Args:
+            model_name: sentence-transformers model name or path
+        """
+        if SentenceTransformer is None:
+            raise ImportError("sentence-transformers is required for semantic search: "
+                              "pip install sentence-transformers")
+        self.name = model_name
+        self._model = SentenceTransformer(model_name, device='cpu')
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        """Unit-length float32 embeddings of the leading SEARCH_EMBEDDING_CHARS of each text."""
+        return self._model.encode(
+            [text[:SEARCH_EMBEDDING_CHARS] for text in texts],
+            batch_size=64,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        ).astype(np.float32)
+
+
+def _build_postings(ids: List[str], texts: List[str]) -> Dict[str, np.ndarray]:
+    """Inverted index arrays of one batch of documents."""
+    tokens = [tokenize(text) for text in texts]
+    lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+    flat = np.fromiter(chain.from_iterable(tokens), dtype=object, count=int(lengths.sum()))
+    # Code point order of str is byte order of UTF-8, so terms stay sorted as bytes
+    term_ids, vocabulary = pd.factorize(flat, sort=True)
+    docs = np.repeat(np.arange(len(ids), dtype=np.int64), lengths)
+    pairs, frequencies = np.unique(term_ids * len(ids) + docs, return_counts=True)
+    pair_terms, postings = np.divmod(pairs, len(ids))
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pair_terms, minlength=len(vocabulary)), out=offsets[1:])
+    return {
+        'terms': np.array([term.encode('utf-8') for term in vocabulary], dtype=bytes).reshape(-1),
+        'offsets': offsets,
+        'postings': postings.astype(np.uint32),
+        'frequencies': np.minimum(frequencies, 0xFFFF).astype(np.uint16),
+        'doc_lengths': lengths.astype(np.uint32),
+        'ids': np.array(ids, dtype=bytes).reshape(-1),
+        # A message saved twice in one output is indexed once, as its last copy
+        'live': ~pd.Series(ids).duplicated(keep='last').to_numpy(),
+    }
+
+
+def _train_ivf(vectors: np.ndarray, lists: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means centroids of unit-length vectors, trained on a sample."""
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), min(len(vectors), lists * 64), replace=False))],
+                        dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), lists, replace=False)]
+    for _ in range(iterations):
+        assignment = (sample @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Lists that lost all their vectors keep their previous centroid
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+    return centroids
+
+
+def _vector_arrays(vectors: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Storage arrays of the document vectors of a segment.
+
+    Vectors of large segments are grouped by their nearest IVF centroid so
+    each inverted list is one contiguous slice; vector_docs maps rows back
+    to documents.
+    """
+    vectors = vectors.astype(np.float16)
+    if len(vectors) < SEARCH_IVF_MIN_VECTORS:
+        return {'vectors': vectors}
+    centroids = _train_ivf(vectors, int(np.sqrt(len(vectors))))
+    assignment = np.concatenate([
+        (np.asarray(vectors[start:start + _VECTOR_CHUNK], dtype=np.float32) @ centroids.T).argmax(axis=1)
+        for start in range(0, len(vectors), _VECTOR_CHUNK)
+    ])
+    order = np.argsort(assignment, kind='stable')
+    list_offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignment, minlength=len(centroids)), out=list_offsets[1:])
+    return {
+        'vectors': vectors[order],
+        'vector_docs': order.astype(np.uint32),
+        'ivf_centroids': centroids,
+        'ivf_offsets': list_offsets,
+    }
+
+
+class _Segment:
+    """One immutable part of the index, opened memory-mapped."""
+
+    def __init__(self, path: Path, live_file: str = LIVE_FILE):
+        self.path = path
+        self.terms = self._load('terms')
+        self.offsets = self._load('offsets')
+        self.postings = self._load('postings')
+        self.frequencies = self._load('frequencies')
+        self.doc_lengths = self._load('doc_lengths')
+        self.ids = self._load('ids')
+        # Replaced when newer segments supersede documents, so read in full
+        self.live_file = live_file
+        self.live = np.load(path / live_file)
+        self.vectors = self._load('vectors')
+        self.vector_docs = self._load('vector_docs')
+        self.ivf_centroids = self._load('ivf_centroids')
+        self.ivf_offsets = self._load('ivf_offsets')
+        self.norms: Optional[np.ndarray] = None
+
+    def _load(self, name: str) -> Optional[np.ndarray]:
+        file_path = self.path / f"{name}.npy"
+        return np.load(file_path, mmap_mode='r') if file_path.exists() else None
+
+    @property
+    def live_count(self) -> int:
+        return int(self.live.sum())
+
+    def doc_vectors(self) -> np.ndarray:
+        """Document vectors in document order."""
+        if self.vector_docs is None:
+            return np.asarray(self.vectors)
+        vectors = np.empty(self.vectors.shape, dtype=self.vectors.dtype)
+        vectors[self.vector_docs] = self.vectors
+        return vectors
+
+    def supersede(self, ids: np.ndarray, live_file: str) -> Optional[str]:
+        """
+        Mark the documents with the given IDs as deleted.
+
+        The new live mask is written to live_file rather than over the
+        current one, which the manifest keeps pointing to until it is saved.
+
+        Returns:
+            The replaced live mask file, or None if no document was superseded
+        """
+        superseded = self.live & np.isin(self.ids, ids)
+        if not superseded.any():
+            return None
+        self.live = self.live & ~superseded
+        np.save(self.path / live_file, self.live)
+        replaced, self.live_file = self.live_file, live_file
+        return replaced
+
+
+def _merge_segments(segments: List[_Segment]) -> Dict[str, np.ndarray]:
+    """Arrays of one segment holding the live documents of segments, in order."""
+    vocabulary = np.unique(np.concatenate([np.asarray(segment.terms) for segment in segments]))
+    terms, docs, frequencies, lengths, ids, vectors = [], [], [], [], [], []
+    base = 0
+    for segment in segments:
+        live = np.flatnonzero(segment.live)
+        doc_map = np.full(len(segment.ids), -1, dtype=np.int64)
+        doc_map[live] = base + np.arange(len(live))
+        base += len(live)
+        posting_terms = np.repeat(np.searchsorted(vocabulary, segment.terms), np.diff(segment.offsets))
+        posting_docs = doc_map[segment.postings]
+        keep = posting_docs >= 0
+        terms.append(posting_terms[keep])
+        docs.append(posting_docs[keep])
+        frequencies.append(np.asarray(segment.frequencies)[keep])
+        lengths.append(np.asarray(segment.doc_lengths)[live])
+        ids.append(np.asarray(segment.ids)[live])
+        if segment.vectors is not None:
+            vectors.append(segment.doc_vectors()[live])
+
+    terms = np.concatenate(terms)
+    # Segments are in document order, so a stable sort by term keeps each posting list sorted
+    order = np.argsort(terms, kind='stable')
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(terms, minlength=len(vocabulary)), out=offsets[1:])
+    arrays = {
+        'terms': vocabulary,
+        'offsets': offsets,
+        'postings': np.concatenate(docs)[order].astype(np.uint32),
+        'frequencies': np.concatenate(frequencies)[order],
+        'doc_lengths': np.concatenate(lengths),
+        'ids': np.concatenate(ids),
+        'live': np.ones(base, dtype=bool),
+    }
+    if vectors:
+        arrays.update(_vector_arrays(np.concatenate(vectors)))
+    return arrays
+
+
+def _top_k(positions: np.ndarray, scores: np.ndarray, k: int) -> np.ndarray:
+    """The k positions with the highest scores, best first."""
+    if len(positions) > k:
+        positions = positions[np.argpartition(-scores[positions], k - 1)[:k]]
+    return positions[np.argsort(-scores[positions], kind='stable')]
+
+
+def stored_embedding_model(index_dir: Path) -> Optional[str]:
+    """Name of the embedding model an existing index stores vectors of, if any."""
+    manifest_file = index_dir / MANIFEST_FILE
+    if not manifest_file.exists():
+        return None
+    with open(manifest_file) as f:
+        embedding = json.load(f)['embedding']
+    return embedding['model'] if embedding else None
+
+
+class SearchIndex:
+    """
+    Offline BM25 and optional embedding search over saved message bodies.
+
+    The index is a directory of immutable segments of up to
+    SEARCH_SEGMENT_DOCS messages each (before merging): a sorted term
+    dictionary, posting lists of document numbers and term frequencies,
+    document lengths and message IDs, and optionally one unit-length
+    float16 vector per message. Every array is a .npy file opened
+    memory-mapped, so opening the index reads only its manifest and live
+    masks and a query touches just the posting lists of its terms.
+
+    Adding a saved output appends segments and marks older copies of the
+    same messages as deleted, so re-indexing a newer session updates the
+    index in place. Like the runs of merge.HashedIdSet, a segment is merged
+    into its predecessor whenever it holds at least half as many live
+    messages, keeping O(log n) segments. Large segments get an IVF coarse
+    quantizer so semantic queries scan SEARCH_IVF_PROBES inverted lists
+    instead of every vector.
+
+    Only one process may add to an index at a time; searches see the
+    segments listed in the manifest when the index was opened.
+    """
+
+    def __init__(self, index_dir: Path, embedder=None):
+        """
+        Initialize index.
+
+        Args:
+            index_dir: Index directory, created on first add
+            embedder: Callable turning a list of texts into unit-length
+                float32 vectors, with the model's name and dim as
+                attributes (see SentenceEmbedder); enables semantic search.
+                Once an index stores vectors, adding to it needs an embedder
+                of the same model.
+        """
+        self.index_dir = index_dir
+        self.embedder = embedder
+        manifest_file = index_dir / MANIFEST_FILE
+        if manifest_file.exists():
+            with open(manifest_file) as f:
+                self._manifest = json.load(f)
+        else:
+            self._manifest = {'segments': [], 'next_segment': 0, 'live': {}, 'sources': {}, 'embedding': None}
+        stored = self._manifest['embedding']
+        if embedder is not None and stored is not None and stored['model'] != embedder.name:
+            raise ValueError(f"Index stores embeddings of {stored['model']}, not {embedder.name}")
+        self._load()
+
+    def __len__(self) -> int:
+        """Number of indexed messages."""
+        return self.doc_count
+
+    def _load(self) -> None:
+        live_files = self._manifest.get('live', {})
+        self._segments = [
+            _Segment(self.index_dir / name, live_files.get(name, LIVE_FILE)) for name in self._manifest['segments']
+        ]
+        self.doc_count = sum(segment.live_count for segment in self._segments)
+        total_length = sum(int(np.asarray(segment.doc_lengths)[segment.live].sum()) for segment in self._segments)
+        average_length = total_length / self.doc_count if self.doc_count else 1.0
+        for segment in self._segments:
+            segment.norms = (
+                BM25_K1 * (1 - BM25_B + BM25_B * np.asarray(segment.doc_lengths, dtype=np.float32) / average_length)
+            )
+
+    def _save_manifest(self) -> None:
+        tmp_file = self.index_dir / f"{MANIFEST_FILE}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp_file, self.index_dir / MANIFEST_FILE)
+
+    def _write_segment(self, arrays: Dict[str, np.ndarray]) -> _Segment:
+        name = f"seg-{self._manifest['next_segment']:06d}"
+        self._manifest['next_segment'] += 1
+        # Dot-prefixed until complete, so a crash never leaves a partial segment behind a real name
+        tmp_dir = self.index_dir / f".{name}.tmp"
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+        for key, array in arrays.items():
+            np.save(tmp_dir / f"{key}.npy", array)
+        # Left behind by an add that crashed before saving the manifest
+        if (self.index_dir / name).exists():
+            shutil.rmtree(self.index_dir / name)
+        os.replace(tmp_dir, self.index_dir / name)
+        return _Segment(self.index_dir / name)
+
+    def add_documents(self, message_ids: List[str], texts: List[str]) -> None:
+        """
+        Index messages as one new segment, replacing earlier copies of them.
+
+        Args:
+            message_ids: Message IDs
+            texts: Text of each message (subject and cleaned body)
+        """
+        if not message_ids:
+            return
+        arrays = _build_postings(message_ids, texts)
+        if self.embedder is not None:
+            if self._manifest['embedding'] is None:
+                if self._segments:
+                    raise ValueError("Index was built without embeddings; rebuild it to enable semantic search")
+                self._manifest['embedding'] = {'model': self.embedder.name, 'dim': self.embedder.dim}
+            arrays.update(_vector_arrays(self.embedder(texts)))
+        elif self._manifest['embedding'] is not None:
+            raise ValueError(f"Index stores embeddings of {self._manifest['embedding']['model']}; "
+                             f"adding to it needs an embedder")
+
+        segment = self._write_segment(arrays)
+        # Until the manifest is saved it still lists the old segments and live
+        # masks, so a crash before then leaves the index as it was
+        replaced = []
+        for older in self._segments:
+            replaced_file = older.supersede(segment.ids, f"live-{segment.path.name}.npy")
+            if replaced_file is not None:
+                replaced.append(older.path / replaced_file)
+        self._segments.append(segment)
+        merged = []
+        while len(self._segments) > 1 and self._segments[-2].live_count <= 2 * self._segments[-1].live_count:
+            pair = self._segments[-2:]
+            merged += pair
+            self._segments[-2:] = [self._write_segment(_merge_segments(pair))]
+        self._manifest['segments'] = [segment.path.name for segment in self._segments]
+        self._manifest['live'] = {
+            segment.path.name: segment.live_file for segment in self._segments if segment.live_file != LIVE_FILE
+        }
+        self._save_manifest()
+        for segment in merged:
+            if segment.path.name not in self._manifest['segments']:
+                shutil.rmtree(segment.path)
+        for file_path in replaced:
+            if file_path.parent.name in self._manifest['segments']:
+                file_path.unlink()
+        self._load()
+
+    @staticmethod
+    def _source_stamp(path: Path) -> List[int]:
+        files = [path] if path.is_file() else sorted(
+            file_path for file_path in path.rglob('*.parquet') if not file_path.name.startswith('.')
+        )
+        stats = [file_path.stat() for file_path in files]
+        return [len(stats), sum(stat.st_size for stat in stats), max((stat.st_mtime_ns for stat in stats), default=0)]
+
+    def add(self, path: Path, force: bool = False) -> int:
+        """
+        Index a saved output.
+
+        Outputs already indexed and unchanged since are skipped, so adding
+        every session after each run only indexes the new ones.
+
+        Args:
+            path: Parquet dataset directory or CSV file written by an output sink
+            force: Index the output even if it is unchanged
+
+        Returns:
+            Number of messages indexed
+        """
+        key = str(path.resolve())
+        stamp = self._source_stamp(path)
+        if not force and self._manifest['sources'].get(key) == stamp:
+            logger.info(f"Already indexed: {path}")
+            return 0
+        count = 0
+        for chunk in iter_documents(path):
+            self.add_documents(chunk['id'].tolist(), (chunk['subject'] + '\n' + chunk['body']).tolist())
+            count += len(chunk)
+        self._manifest['sources'][key] = stamp
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self._save_manifest()
+        logger.info(f"Indexed {count} messages from {path} ({self.doc_count} in {len(self._segments)} segments)")
+        return count
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Rank messages by BM25 relevance to a keyword query.
+
+        Args:
+            query: Words to search for; a message matches if it contains any
+            limit: Maximum number of results
+
+        Returns:
+            Results, best first, each with the message 'id' and its 'score'
+        """
+        terms = np.array([term.encode('utf-8') for term in dict.fromkeys(tokenize(query))], dtype=bytes)
+        if not len(terms) or not self.doc_count:
+            return []
+        ranges = []
+        document_frequency = np.zeros(len(terms))
+        for segment in self._segments:
+            if not len(segment.terms):
+                ranges.append(None)
+                continue
+            positions = np.minimum(np.searchsorted(segment.terms, terms), len(segment.terms) - 1)
+            found = segment.terms[positions] == terms
+            starts = np.where(found, segment.offsets[positions], 0)
+            ends = np.where(found, segment.offsets[positions + 1], 0)
+            # Deleted documents still count, until their segment is merged
+            document_frequency += ends - starts
+            ranges.append((starts, ends))
+        document_frequency = np.minimum(document_frequency, self.doc_count)
+        idf = np.log1p((self.doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        results = []
+        for segment, term_ranges in zip(self._segments, ranges):
+            if term_ranges is None:
+                continue
+            slices = [(term, start, end) for term, (start, end) in enumerate(zip(*term_ranges)) if end > start]
+            if not slices:
+                continue
+            docs = np.concatenate([segment.postings[start:end] for _, start, end in slices])
+            frequencies = np.concatenate([segment.frequencies[start:end] for _, start, end in slices]).astype(np.float32)
+            weights = np.repeat(idf[[term for term, _, _ in slices]], [end - start for _, start, end in slices])
+            scores = weights * frequencies * (BM25_K1 + 1) / (frequencies + segment.norms[docs])
+            totals = np.bincount(docs, weights=scores, minlength=len(segment.ids))
+            top = _top_k(np.flatnonzero((totals > 0) & segment.live), totals, limit)
+            results += [(segment.ids[doc].decode('utf-8'), float(totals[doc])) for doc in top]
+        results.sort(key=lambda result: -result[1])
+        return [{'id': message_id, 'score': score} for message_id, score in results[:limit]]
+
+    def semantic_search(self, query: str, limit: int = 10,
+                        probes: int = SEARCH_IVF_PROBES) -> List[Dict[str, Any]]:
+        """
+        Rank messages by cosine similarity of their embedding to the query's.
+
+        Args:
+            query: Natural language query
+            limit: Maximum number of results
+            probes: IVF lists scanned in segments that have them; more lists
+                find more of the true nearest messages
+
+        Returns:
+            Results, best first, each with the message 'id' and its 'score'
+        """
+        if self.embedder is None or self._manifest['embedding'] is None:
+            raise ValueError("Semantic search needs an index built with an embedder, opened with the same one")
+        vector = np.asarray(self.embedder([query])[0], dtype=np.float32)
+        results = []
+        for segment in self._segments:
+            if segment.ivf_centroids is None:
+                rows = [(start, min(start + _VECTOR_CHUNK, len(segment.vectors)))
+                        for start in range(0, len(segment.vectors), _VECTOR_CHUNK)]
+            else:
+                lists = np.argsort(-(segment.ivf_centroids @ vector))[:probes]
+                rows = [(segment.ivf_offsets[index], segment.ivf_offsets[index + 1]) for index in lists]
+            rows = [(start, end) for start, end in rows if end > start]
+            if not rows:
+                continue
+            scores = np.concatenate([
+                np.asarray(segment.vectors[start:end], dtype=np.float32) @ vector for start, end in rows
+            ])
+            docs = np.concatenate([
+                np.arange(start, end) if segment.vector_docs is None else segment.vector_docs[start:end]
+                for start, end in rows
+            ])
+            top = _top_k(np.flatnonzero(segment.live[docs]), scores, limit)
+            results += [(segment.ids[docs[row]].decode('utf-8'), float(scores[row])) for row in top]
+        results.sort(key=lambda result: -result[1])
+        return [{'id': message_id, 'score': score} for message_id, score in results[:limit]]
@@ -0,0 +1,382 @@
+import os
+import shutil
+import uuid
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Set
+import pandas as pd
+from config.settings import PARQUET_ROW_GROUP_BYTES, PARQUET_MAX_BUFFER_BYTES, MESSAGE_DB_FILE
+from .email_parser import EmailParser
+from .message_store import MessageStore
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+logger = logging.getLogger(__name__)
+
+
+class OutputSink:
+    """
+    Destination for processed messages.
+
+    write() may buffer rows; it returns the IDs of the rows that are durably
+    on disk, which are the only ones the caller may checkpoint.
+    """
+
+    suffix = ''
+
+    def __init__(self, path: Path):
+        """
+        Initialize sink.
+
+        Args:
+            path: Location of the in-progress output (without suffix)
+        """
+        self.path = path.with_name(path.name + self.suffix)
+
+    def write(self, rows: List[Dict[str, Any]]) -> List[str]:
+        """
+        Write processed messages.
+
+        Args:
+            rows: Processed messages
+
+        Returns:
+            IDs of the messages now durably written
+        """
+        raise NotImplementedError
+
+    def flush(self) -> List[str]:
+        """
+        Write out any buffered rows.
+
+        Returns:
+            IDs of the messages written by this call
+        """
+        return []
+
+    def exists(self) -> bool:
+        """Whether anything has been written to the output yet."""
+        return self.path.exists()
+
+    def close(self) -> None:
+        """Release any resources held open by the sink."""
+
+    def remove(self) -> None:
+        """Delete the in-progress output."""
+        if self.path.exists():
+            self.path.unlink()
+
+    def finalize(self, final_path: Path) -> Path:
+        """
+        Flush buffered rows and move the output to its final location.
+
+        Args:
+            final_path: Final location (without suffix)
+
+        Returns:
+            Path of the finished output
+        """
+        self.flush()
+        final_path = final_path.with_name(final_path.name + self.suffix)
+        os.rename(self.path, final_path)
+        return final_path
+
+
+class CsvSink(OutputSink):
+    """Appends each batch of processed messages to a single CSV file."""
+
+    suffix = '.csv'
+
+    def write(self, rows: List[Dict[str, Any]]) -> List[str]:
+        return self.write_frame(pd.DataFrame(rows))
+
+    def write_frame(self, frame: pd.DataFrame) -> List[str]:
+        """Append rows that are already in a DataFrame."""
+        frame.to_csv(
+            self.path,
+            header=not self.path.exists(),
+            index=False,
+            mode='a'
+        )
+        return frame['id'].tolist()
+
+
+class ParquetSink(OutputSink):
+    """
+    Writes processed messages as a Parquet dataset partitioned by month.
+
+    Rows are buffered per month=YYYY-MM partition and written once a
+    partition holds PARQUET_ROW_GROUP_BYTES of data, one complete file (and
+    row group) per flush, so every file on disk is readable even after a crash.
+    """
+
+    suffix = '.parquet'
+
+    def __init__(self, path: Path, row_group_bytes: int = PARQUET_ROW_GROUP_BYTES,
+                 max_buffer_bytes: int = PARQUET_MAX_BUFFER_BYTES):
+        """
+        Initialize Parquet sink.
+
+        Args:
+            path: Dataset directory (without suffix)
+            row_group_bytes: Approximate uncompressed size of each row group
+            max_buffer_bytes: Flush the largest partition once all buffers exceed this
+        """
+        if pa is None:
+            raise ImportError("pyarrow is required for Parquet output: pip install pyarrow")
+        super().__init__(path)
+        self.row_group_bytes = row_group_bytes
+        self.max_buffer_bytes = max_buffer_bytes
+        self._buffers: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._buffer_bytes: Dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def schema() -> 'pa.Schema':
+        """Arrow schema of the Parquet output."""
+        return pa.schema([
+            ('id', pa.string()),
+            ('threadId', pa.string()),
+            ('internalDate', pa.timestamp('ms', tz='UTC')),
+            ('from_name', pa.string()),
+            ('from_address', pa.string()),
+            ('to_addresses', pa.list_(pa.string())),
+            ('cc_addresses', pa.list_(pa.string())),
+            ('subject', pa.string()),
+            ('date', pa.timestamp('ms', tz='UTC')),
+            ('list_id', pa.string()),
+            ('rfc822_message_id', pa.string()),
+            ('in_reply_to', pa.string()),
+            ('labels', pa.list_(pa.string())),
+            ('body', pa.string()),
+            ('size', pa.int64()),
+            ('cluster_id', pa.string()),
+            ('matched_rules', pa.list_(pa.string())),
+            ('account', pa.string()),
+        ])
+
+    @staticmethod
+    def _to_record(row: Dict[str, Any]) -> Dict[str, Any]:
+        fields = EmailParser.message_header_fields(row)
+        internal_date = int(row.get('internalDate') or 0)
+        date = fields['date']
+        if isinstance(date, str):
+            # Read back from CSV
+            date = pd.Timestamp(date).to_pydatetime() if date else None
+        return {
+            'id': row['id'],
+            'threadId': row.get('threadId'),
+            'internalDate': datetime.fromtimestamp(internal_date / 1000, tz=timezone.utc),
+            'from_name': fields['from_name'],
+            'from_address': fields['from_address'],
+            'to_addresses': list(fields['to_addresses']),
+            'cc_addresses': list(fields['cc_addresses']),
+            'subject': fields['subject'],
+            'date': date,
+            'list_id': fields['list_id'],
+            'rfc822_message_id': fields['rfc822_message_id'],
+            'in_reply_to': fields['in_reply_to'],
+            'labels': list(row.get('labels', [])),
+            'body': row.get('body', ''),
+            'size': int(row.get('sizeEstimate') or 0),
+            'cluster_id': row.get('cluster_id') or None,
+            'matched_rules': list(row.get('matched_rules', [])),
+            'account': row.get('account') or None,
+        }
+
+    @staticmethod
+    def _record_bytes(record: Dict[str, Any]) -> int:
+        return 64 + sum(
+            len(value) for key, value in record.items()
+            if isinstance(value, str)
+        ) + sum(
+            len(value) for key in ('labels', 'to_addresses', 'cc_addresses', 'matched_rules')
+            for value in record[key]
+        )
+
+    def write(self, rows: List[Dict[str, Any]]) -> List[str]:
+        written = []
+        for row in rows:
+            record = self._to_record(row)
+            partition = record['internalDate'].strftime('%Y-%m')
+            self._buffers[partition].append(record)
+            self._buffer_bytes[partition] += self._record_bytes(record)
+            if self._buffer_bytes[partition] >= self.row_group_bytes:
+                written += self._write_partition(partition)
+
+        while self._buffer_bytes and sum(self._buffer_bytes.values()) > self.max_buffer_bytes:
+            written += self._write_partition(max(self._buffer_bytes, key=self._buffer_bytes.get))
+        return written
+
+    def flush(self) -> List[str]:
+        written = []
+        for partition in list(self._buffers):
+            written += self._write_partition(partition)
+        return written
+
+    def _write_partition(self, partition: str) -> List[str]:
+        records = self._buffers.pop(partition)
+        self._buffer_bytes.pop(partition)
+        partition_dir = self.path / f"month={partition}"
+        partition_dir.mkdir(parents=True, exist_ok=True)
+
+        table = pa.Table.from_pylist(records, schema=self.schema())
+        file_path = partition_dir / f"part-{uuid.uuid4().hex[:12]}.parquet"
+        # Dot-prefixed files are ignored by Parquet dataset readers
+        tmp_path = partition_dir / f".{file_path.name}.tmp"
+        pq.write_table(table, tmp_path, row_group_size=len(records), compression='zstd')
+        os.replace(tmp_path, file_path)
+        logger.info(f"Wrote {len(records)} messages to {file_path}")
+        return [record['id'] for record in records]
+
+    def remove(self) -> None:
+        if self.path.exists():
+            shutil.rmtree(self.path)
+
+
+def saved_parquet_ids(dataset_paths: List[Path], message_ids: Iterable[str]) -> Set[str]:
+    """
+    Find which messages are already stored in Parquet datasets.
+
+    Args:
+        dataset_paths: Dataset directories written by ParquetSink
+        message_ids: IDs to look for
+
+    Returns:
+        The IDs found in any of the datasets
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required for Parquet output: pip install pyarrow")
+    wanted = pa.array(sorted(set(message_ids)), type=pa.string())
+    found = set()
+    for dataset_path in dataset_paths:
+        for file_path in sorted(dataset_path.glob('month=*/*.parquet')):
+            ids = pq.read_table(file_path, columns=['id'])['id']
+            found.update(ids.filter(pc.is_in(ids, value_set=wanted)).to_pylist())
+    return found
+
+
+def apply_parquet_changes(dataset_paths: List[Path], deleted_ids: Set[str],
+                          label_updates: Dict[str, List[str]],
+                          label_mappings: Dict[str, str]) -> int:
+    """
+    Apply deletions and label changes to stored Parquet datasets in place.
+
+    Only the id column of each file is read first; files containing an
+    affected message are rewritten whole and replaced atomically, or
+    deleted if no rows remain.
+
+    Args:
+        dataset_paths: Dataset directories written by ParquetSink
+        deleted_ids: IDs of messages to drop
+        label_updates: Message ID to its current list of label IDs
+        label_mappings: Dictionary mapping label IDs to label names
+
+    Returns:
+        Number of rows removed or updated
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required for Parquet output: pip install pyarrow")
+    affected = pa.array(sorted(deleted_ids | set(label_updates)), type=pa.string())
+    deleted = pa.array(sorted(deleted_ids), type=pa.string())
+    changed_rows = 0
+
+    for dataset_path in dataset_paths:
+        for file_path in sorted(dataset_path.glob('month=*/*.parquet')):
+            hits = pc.is_in(pq.read_table(file_path, columns=['id'])['id'], value_set=affected)
+            if not pc.any(hits).as_py():
+                continue
+            table = pq.read_table(file_path)
+            changed_rows += pc.sum(hits).as_py()
+
+            message_ids = table['id'].to_pylist()
+            labels = table['labels'].to_pylist()
+            for index, message_id in enumerate(message_ids):
+                if message_id in label_updates:
+                    labels[index] = [label_mappings.get(label_id, label_id) for label_id in label_updates[message_id]]
+            position = table.schema.get_field_index('labels')
+            field = table.schema.field(position)
+            table = table.set_column(position, field, pa.array(labels, type=field.type))
+            table = table.filter(pc.invert(pc.is_in(table['id'], value_set=deleted)))
+
+            if table.num_rows:
+                tmp_path = file_path.with_name(f".{file_path.name}.tmp")
+                pq.write_table(table, tmp_path, row_group_size=table.num_rows, compression='zstd')
+                os.replace(tmp_path, file_path)
+            else:
+                file_path.unlink()
+            logger.info(f"Applied changes to {file_path}")
+    return changed_rows
+
+
+class SqliteSink(OutputSink):
+    """
+    Upserts processed messages into the persistent MessageStore database.
+
+    Unlike the file sinks there is one database for all sessions: the
+    session path is ignored, finalize() leaves the database in place and
+    remove() keeps earlier sessions' messages (upserts make re-runs safe).
+    """
+
+    suffix = '.sqlite3'
+
+    def __init__(self, path: Path, db_file: Path = MESSAGE_DB_FILE):
+        """
+        Initialize SQLite sink.
+
+        Args:
+            path: Session output location (unused)
+            db_file: Message database file
+        """
+        self.path = db_file
+        self.store = MessageStore(db_file)
+        self._written = 0
+
+    def write(self, rows: List[Dict[str, Any]]) -> List[str]:
+        # Each upsert commits, so the rows are durable once it returns
+        written = self.store.upsert(rows)
+        self._written += len(written)
+        return written
+
+    def exists(self) -> bool:
+        return self._written > 0
+
+    def close(self) -> None:
+        self.store.close()
+
+    def remove(self) -> None:
+        pass
+
+    def finalize(self, final_path: Path) -> Path:
+        self.close()
+        logger.info(f"Upserted {self._written} messages into {self.path}")
+        return self.path
+
+
+SINKS = {
+    'csv': CsvSink,
+    'parquet': ParquetSink,
+    'sqlite': SqliteSink,
+}
+
+
+def create_sink(output_format: str, path: Path) -> OutputSink:
+    """
+    Create an output sink by format name.
+
+    Args:
+        output_format: One of SINKS
+        path: Output location without suffix
+
+    Returns:
+        OutputSink instance
+    """
+    if output_format not in SINKS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    return SINKS[output_format](path)
@@ -0,0 +1,61 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SyncStateManager:
+    def __init__(self, state_file: Path):
+        """
+        Initialize sync state manager.
+        
+        Args:
+            state_file: JSON file holding the last synced history ID per account and label set
+        """
+        self.state_file = state_file
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+    
+    @staticmethod
+    def _label_key(label_ids: List[str]) -> str:
+        return ','.join(sorted(label_ids))
+    
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        if self.state_file.exists():
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        return {}
+    
+    def get_history_id(self, account: str, label_ids: List[str]) -> Optional[str]:
+        """
+        Get the history ID recorded by the last successful sync.
+        
+        Args:
+            account: Email address of the account
+            label_ids: Label set that was synced
+            
+        Returns:
+            History ID if the account and label set were synced before, None otherwise
+        """
+        return self._load().get(account, {}).get(self._label_key(label_ids))
+    
+    def save_history_id(self, account: str, label_ids: List[str], history_id: str) -> None:
+        """
+        Record the history ID reached by a successful sync.
+        
+        Args:
+            account: Email address of the account
+            label_ids: Label set that was synced
+            history_id: History ID to resume from next time
+        """
+        state = self._load()
+        state.setdefault(account, {})[self._label_key(label_ids)] = str(history_id)
+        
+        # Write atomically so a crash never leaves a truncated state file
+        tmp_file = self.state_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_file, self.state_file)
+        logger.info(f"Sync state saved: {account} at history ID {history_id}")
+
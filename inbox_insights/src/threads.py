@@ -0,0 +1,150 @@
+import ast
+import logging
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+import pandas as pd
+from .email_parser import EmailParser
+from .message_store import MessageStore
+
+logger = logging.getLogger(__name__)
+
+THREAD_COLUMNS = ['threadId', 'subject', 'message_count', 'participants',
+                  'first_date', 'last_date', 'labels']
+
+
+def summarize_threads(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Aggregate processed messages per thread.
+
+    Args:
+        rows: Processed messages, as produced by DataProcessor
+
+    Returns:
+        One row per thread with its subject (of the earliest message),
+        message count, participant addresses, first/last internalDate
+        (ms since epoch) and the union of its labels
+    """
+    threads: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        fields = EmailParser.message_header_fields(row)
+        date = int(row.get('internalDate') or 0)
+        thread = threads.get(row['threadId'])
+        if thread is None:
+            thread = threads[row['threadId']] = {
+                'threadId': row['threadId'], 'subject': fields['subject'], 'message_count': 0,
+                'participants': set(), 'first_date': date, 'last_date': date, 'labels': set()
+            }
+        if date < thread['first_date']:
+            thread['first_date'], thread['subject'] = date, fields['subject']
+        thread['last_date'] = max(thread['last_date'], date)
+        thread['message_count'] += 1
+        thread['participants'].update(
+            address for address in [fields['from_address'], *fields['to_addresses'], *fields['cc_addresses']]
+            if address
+        )
+        thread['labels'].update(row.get('labels', []))
+    return list(threads.values())
+
+
+def _merge_summaries(summaries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Combine partial summaries of the same thread written by separate batches."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for summary in summaries:
+        thread = merged.get(summary['threadId'])
+        if thread is None:
+            merged[summary['threadId']] = {
+                **summary, 'participants': set(summary['participants']), 'labels': set(summary['labels'])
+            }
+            continue
+        if summary['first_date'] < thread['first_date']:
+            thread['first_date'], thread['subject'] = summary['first_date'], summary['subject']
+        thread['last_date'] = max(thread['last_date'], summary['last_date'])
+        thread['message_count'] += summary['message_count']
+        thread['participants'].update(summary['participants'])
+        thread['labels'].update(summary['labels'])
+    return [
+        {**thread, 'participants': sorted(thread['participants']), 'labels': sorted(thread['labels'])}
+        for thread in merged.values()
+    ]
+
+
+class ThreadTable:
+    """
+    Per-thread summary written alongside the per-message output.
+
+    Partial summaries are appended to an in-progress CSV as batches are
+    written, so the table survives a resume just like the message output.
+    finalize() merges the partial rows per thread and writes the table in
+    the session's output format.
+    """
+
+    def __init__(self, path: Path, output_format: str):
+        """
+        Initialize thread table.
+
+        Args:
+            path: Location of the in-progress table (without suffix)
+            output_format: Output format of the session, see sinks.SINKS
+        """
+        self.output_format = output_format
+        self.path = path.with_name(path.name + '.csv')
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        """Add processed messages to the thread summaries."""
+        summaries = summarize_threads(rows)
+        if summaries:
+            pd.DataFrame(summaries, columns=THREAD_COLUMNS).to_csv(
+                self.path,
+                header=not self.path.exists(),
+                index=False,
+                mode='a'
+            )
+
+    def exists(self) -> bool:
+        """Whether any thread has been recorded yet."""
+        return self.path.exists()
+
+    def remove(self) -> None:
+        """Delete the in-progress table."""
+        if self.path.exists():
+            self.path.unlink()
+
+    def finalize(self, final_path: Path) -> Optional[Path]:
+        """
+        Merge partial summaries and write the finished table.
+
+        Args:
+            final_path: Final location (without suffix)
+
+        Returns:
+            Path of the thread table, or None if no thread was recorded
+        """
+        if not self.exists():
+            return None
+        partial = pd.read_csv(self.path, dtype=str, keep_default_na=False)
+        records = partial.to_dict('records')
+        for record in records:
+            for column in ('participants', 'labels'):
+                record[column] = ast.literal_eval(record[column])
+            for column in ('message_count', 'first_date', 'last_date'):
+                record[column] = int(record[column])
+        threads = _merge_summaries(records)
+
+        if self.output_format == 'sqlite':
+            store = MessageStore()
+            store.upsert_threads(threads)
+            store.close()
+            final_path = store.db_file
+        elif self.output_format == 'parquet':
+            df = pd.DataFrame(threads, columns=THREAD_COLUMNS)
+            for column in ('first_date', 'last_date'):
+                df[column] = pd.to_datetime(df[column], unit='ms', utc=True)
+            final_path = final_path.with_name(final_path.name + '.parquet')
+            df.to_parquet(final_path, index=False, compression='zstd')
+        else:
+            final_path = final_path.with_name(final_path.name + '.csv')
+            pd.DataFrame(threads, columns=THREAD_COLUMNS).to_csv(final_path, index=False)
+
+        self.remove()
+        logger.info(f"Saved {len(threads)} threads to {final_path}")
+        return final_path
@@ -0,0 +1,28 @@
+import pandas as pd
+from src import analytics
+from src.label_rules import RULE_COLUMNS, LabelRule, plan_label_changes
+
+
+def test_csv_labels_with_commas_and_quotes(tmp_path):
+    # Written before from_address existed; lists are stored as Python literals
+    path = tmp_path / 'email_old.csv'
+    pd.DataFrame({
+        'id': ['m1', 'm2', 'm3'],
+        'threadId': ['t1', 't2', 't3'],
+        'internalDate': ['1700000000000', '1700000060000', '1700000120000'],
+        'subject': ['a', 'b', 'c'],
+        'list_id': ['', '', ''],
+        'labels': [str(["Bob's", 'INBOX']), str(['Work, Personal']), str([])],
+    }).to_csv(path, index=False)
+
+    df = analytics.load_dataset(path)
+    assert df['labels'].tolist() == [["Bob's", 'INBOX'], ['Work, Personal'], []]
+    assert df['from_address'].tolist() == ['', '', '']
+    assert analytics.flatten_labels(df)[1].tolist() == ["Bob's", 'INBOX', 'Work, Personal']
+
+    rules = [LabelRule('work', add_labels=['Done'], labels=['Work, Personal']),
+             LabelRule('bob', remove_labels=['INBOX'], labels=["Bob's"])]
+    changes = plan_label_changes(analytics.load_dataset(path, RULE_COLUMNS), rules)
+    assert sorted((change['rules'], change['ids']) for change in changes) == [
+        (['bob'], ['m1']), (['work'], ['m2'])
+    ]
@@ -0,0 +1,113 @@
+import asyncio
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from googleapiclient.errors import HttpError
+from benchmarks.synthetic import make_messages
+from src import async_gmail_client
+from src.async_gmail_client import AsyncGmailClient
+from src.fake_gmail import FakeGmailService
+from src.gmail_client import GmailClient
+
+
+class Credentials:
+    """Stand-in for google.oauth2 credentials whose refresh issues a new token."""
+
+    def __init__(self, token):
+        self.token = token
+        self.valid = True
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = f"token-{self.refreshes}"
+
+
+class FakeApi:
+    """aiohttp app answering the REST calls of AsyncGmailClient from a FakeGmailService."""
+
+    def __init__(self, service, token):
+        self.service = service
+        self.token = token
+        self.in_flight = self.max_in_flight = 0
+        self.app = web.Application()
+        self.app.router.add_get('/gmail/v1/users/me/{path:.+}', self.handle)
+
+    async def handle(self, request):
+        if request.headers['Authorization'] != f"Bearer {self.token}":
+            return web.json_response({'error': {'code': 401}}, status=401)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # Let other requests arrive, so the concurrency limit is observable
+            await asyncio.sleep(0.001)
+            return web.json_response(self.call(request.match_info['path'], request.query))
+        except HttpError as error:
+            return web.Response(status=error.resp.status, body=error.content)
+        finally:
+            self.in_flight -= 1
+
+    def call(self, path, query):
+        if path == 'labels':
+            return {'labels': self.service.labels}
+        if path == 'messages':
+            return self.service._list_messages(maxResults=int(query['maxResults']),
+                                               labelIds=query.getall('labelIds', None),
+                                               pageToken=query.get('pageToken'))
+        params = {'format': query.get('format', 'full'), 'metadataHeaders': query.getall('metadataHeaders', None)}
+        return self.service._get_message(path.split('/')[1], **params)
+
+
+def run(api, credentials, calls, **kwargs):
+    async def main():
+        async with TestServer(api.app) as server:
+            async with AsyncGmailClient(credentials, **kwargs) as client:
+                client.api_url = str(server.make_url('/gmail/v1/users/me'))
+                return await calls(client)
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def mailbox(monkeypatch):
+    monkeypatch.setattr(async_gmail_client, 'MAX_RESULTS_PER_PAGE', 10)
+    monkeypatch.setattr(async_gmail_client, 'RETRY_BACKOFF_SECONDS', 0)
+    messages = make_messages(45)
+    for index, message in enumerate(messages):
+        message['labelIds'] = ['SENT'] if index % 3 == 0 else ['INBOX', 'UNREAD']
+    return messages
+
+
+def test_async_client_matches_the_sync_client(mailbox):
+    labels = [{'id': 'INBOX', 'name': 'INBOX', 'type': 'system'}]
+    api = FakeApi(FakeGmailService(mailbox, labels=labels), 'token')
+
+    async def calls(client):
+        messages = await client.get_messages()
+        details = await client.get_message_details_batch([message['id'] for message in messages],
+                                                         fetch_profile='metadata')
+        return messages, details, await client.get_labels()
+
+    messages, details, async_labels = run(api, Credentials('token'), calls, concurrency=4)
+    client = GmailClient(None, service=FakeGmailService(mailbox, labels=labels))
+    assert messages == client.get_messages()
+    assert len(messages) == 30
+    assert details == client.get_message_details_batch([message['id'] for message in messages],
+                                                       fetch_profile='metadata')
+    assert async_labels == labels
+    assert api.max_in_flight == 4
+
+
+def test_async_client_retries_and_refreshes_the_token_once(mailbox):
+    message_ids = [message['id'] for message in mailbox]
+    api = FakeApi(FakeGmailService(mailbox, failures={message_ids[1]: [429, 503]}), 'token-1')
+    credentials = Credentials('expired')
+
+    details = run(api, credentials, lambda client: client.get_message_details_batch(message_ids))
+    assert [message['id'] for message in details] == message_ids
+    assert credentials.refreshes == 1
+
+    api = FakeApi(FakeGmailService(mailbox, failures={message_ids[2]: [400]}), 'token')
+    with pytest.raises(aiohttp.ClientResponseError) as raised:
+        run(api, Credentials('token'), lambda client: client.get_message_details(message_ids[2]))
+    assert raised.value.status == 400
@@ -0,0 +1,52 @@
+import json
+import pytest
+from src import auth
+
+
+class ExpiredCredentials:
+    valid = False
+    expired = True
+
+    def __init__(self, refresh_token):
+        self.refresh_token = refresh_token
+        self.refreshed = False
+
+    def refresh(self, request):
+        self.refreshed = True
+        self.valid = True
+
+    def to_json(self):
+        return json.dumps({'refresh_token': self.refresh_token, 'refreshed': self.refreshed})
+
+
+class NoBrowserFlow:
+    @classmethod
+    def from_client_secrets_file(cls, *args, **kwargs):
+        raise AssertionError("consent flow started")
+
+
+def use_stored(monkeypatch, creds):
+    monkeypatch.setattr(auth.Credentials, 'from_authorized_user_file', lambda *args: creds)
+    monkeypatch.setattr(auth, 'InstalledAppFlow', NoBrowserFlow)
+
+
+def test_expired_token_is_refreshed_and_saved(tmp_path, monkeypatch):
+    token_file = tmp_path / 'tokens' / 'alice.json'
+    token_file.parent.mkdir()
+    token_file.write_text('{}')
+    creds = ExpiredCredentials('refresh-me')
+    use_stored(monkeypatch, creds)
+
+    assert auth.get_credentials(token_file) is creds
+    assert creds.refreshed
+    assert json.loads(token_file.read_text()) == {'refresh_token': 'refresh-me', 'refreshed': True}
+    assert [path.name for path in token_file.parent.iterdir()] == ['alice.json']
+
+
+def test_consent_flow_only_without_refresh_token(tmp_path, monkeypatch):
+    token_file = tmp_path / 'token.json'
+    token_file.write_text('{}')
+    use_stored(monkeypatch, ExpiredCredentials(None))
+
+    with pytest.raises(AssertionError, match="consent flow"):
+        auth.get_credentials(token_file)
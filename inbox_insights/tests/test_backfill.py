@@ -0,0 +1,63 @@
+import time
+from datetime import datetime, timezone
+import pandas as pd
+import pytest
+from benchmarks.synthetic import make_messages
+from src.backfill import LEASE_DB_FILE, BackfillWorker, LeaseTable, merge_backfill, plan_shards
+from src.fake_gmail import FakeGmailService
+from src.gmail_client import GmailClient
+
+
+def mailbox_bounds(messages):
+    dates = [int(message['internalDate']) for message in messages]
+    since = datetime.fromtimestamp(min(dates) // 86400000 * 86400, tz=timezone.utc)
+    until = datetime.fromtimestamp(max(dates) // 1000 + 86400, tz=timezone.utc)
+    return since, until
+
+
+def make_leases(tmp_path, **kwargs) -> LeaseTable:
+    leases = LeaseTable(tmp_path / LEASE_DB_FILE, **kwargs)
+    leases.set_config({'labels': ['INBOX'], 'fetch_profile': 'metadata', 'metadata_headers': None})
+    return leases
+
+
+def test_worker_stops_writing_when_its_lease_is_taken_over(tmp_path):
+    messages = make_messages(300)
+    leases = make_leases(tmp_path, lease_seconds=0.3)
+    since, until = mailbox_bounds(messages)
+    leases.add_shards(plan_shards(['alice'], since, until, shard_days=10_000))
+
+    class StolenLeaseClient(GmailClient):
+        def get_message_details_batch(self, *args, **kwargs):
+            # Another worker takes the shard over while the first batch is in flight
+            with leases._transaction() as conn:
+                conn.execute("UPDATE shards SET owner = 'thief', lease_expires = ?", [time.time() + 3600])
+            time.sleep(leases.lease_seconds)
+            return super().get_message_details_batch(*args, **kwargs)
+
+    worker = BackfillWorker(leases, tmp_path, lambda account: StolenLeaseClient(
+        None, service=FakeGmailService(messages)), owner='worker')
+
+    assert worker.run() == 0
+    assert leases.progress() == {'leased': 1}
+    # Nothing was written or checkpointed for the shard after the lease was lost
+    assert not list((tmp_path / 'shards').glob('email_*'))
+    assert not list((tmp_path / 'checkpoints').glob('*'))
+
+
+def test_merged_backfill_keeps_the_account_of_each_message(tmp_path):
+    pytest.importorskip('pyarrow')
+    mailboxes = {'alice': make_messages(200, seed=1), 'bob': make_messages(150, seed=2)}
+    for message in mailboxes['bob']:
+        message['id'] = 'b' + message['id'][1:]
+    leases = make_leases(tmp_path)
+    since, until = mailbox_bounds(mailboxes['alice'] + mailboxes['bob'])
+    leases.add_shards(plan_shards(list(mailboxes), since, until, shard_days=30))
+
+    BackfillWorker(leases, tmp_path, lambda account: GmailClient(
+        None, service=FakeGmailService(mailboxes[account])), owner='worker').run()
+    merged = pd.read_parquet(merge_backfill(leases, tmp_path / 'merged', 'parquet'))
+
+    for account, messages in mailboxes.items():
+        inbox = {message['id'] for message in messages if 'INBOX' in message['labelIds']}
+        assert set(merged.loc[merged['account'] == account, 'id']) == inbox
@@ -0,0 +1,72 @@
+import json
+from src import checkpoint_manager
+from src.checkpoint_manager import CheckpointManager, _RECORD_HEADER
+
+BATCHES = [[f"a{index}" for index in range(5)], [f"b{index}" for index in range(5)], ['c0', 'c1']]
+
+
+def record_size(batch):
+    return _RECORD_HEADER.size + len('\n'.join(batch).encode('utf-8'))
+
+
+def write_log(tmp_path):
+    manager = CheckpointManager(tmp_path)
+    for batch in BATCHES:
+        manager.append_checkpoint('s', batch)
+    return manager, tmp_path / 'checkpoint_s.log'
+
+
+def test_torn_final_record_is_discarded_and_truncated(tmp_path):
+    manager, log_path = write_log(tmp_path)
+    intact = record_size(BATCHES[0]) + record_size(BATCHES[1])
+    with open(log_path, 'r+b') as f:
+        f.truncate(intact + _RECORD_HEADER.size + 3)
+
+    assert manager.load_checkpoint('s') == set(BATCHES[0] + BATCHES[1])
+    assert log_path.stat().st_size == intact
+    # Appends continue after the recovered prefix
+    manager.append_checkpoint('s', ['d0'])
+    assert manager.load_checkpoint('s') == set(BATCHES[0] + BATCHES[1] + ['d0'])
+
+
+def test_corrupt_record_drops_it_and_everything_after(tmp_path):
+    manager, log_path = write_log(tmp_path)
+    data = bytearray(log_path.read_bytes())
+    data[record_size(BATCHES[0]) + _RECORD_HEADER.size] ^= 0xFF
+    log_path.write_bytes(bytes(data))
+
+    assert manager.load_checkpoint('s') == set(BATCHES[0])
+    assert log_path.stat().st_size == record_size(BATCHES[0])
+
+
+def test_compaction_keeps_the_same_ids(tmp_path, monkeypatch):
+    manager, log_path = write_log(tmp_path)
+    expected = manager.load_checkpoint('s')
+
+    manager.compact('s')
+    assert not log_path.exists()
+    assert manager.load_checkpoint('s') == expected
+
+    # Appends trigger compaction once the log outgrows the compact file
+    monkeypatch.setattr(checkpoint_manager, 'CHECKPOINT_COMPACT_MIN_BYTES', 0)
+    batches = [[f"e{batch}-{index}" for index in range(50)] for batch in range(3)]
+    for batch in batches:
+        manager.append_checkpoint('s', batch)
+        expected.update(batch)
+    assert not log_path.exists()
+    assert manager.load_checkpoint('s') == expected
+
+
+def test_legacy_json_checkpoint_still_loads(tmp_path):
+    legacy_path = tmp_path / 'checkpoint_s.json'
+    legacy_path.write_text(json.dumps(['old1', 'old2']))
+    manager = CheckpointManager(tmp_path)
+
+    assert manager.load_checkpoint('s') == {'old1', 'old2'}
+    manager.append_checkpoint('s', ['new1'])
+    assert manager.load_checkpoint('s') == {'old1', 'old2', 'new1'}
+    manager.compact('s')
+    assert not legacy_path.exists()
+    assert manager.load_checkpoint('s') == {'old1', 'old2', 'new1'}
+    manager.clear_checkpoint('s')
+    assert manager.load_checkpoint('s') is None
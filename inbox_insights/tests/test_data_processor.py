@@ -0,0 +1,163 @@
+import asyncio
+import sqlite3
+import pandas as pd
+import pytest
+from benchmarks.synthetic import make_messages
+from src import data_processor, gmail_client
+from src.data_processor import DataProcessor
+from src.fake_gmail import FakeGmailService
+from src.gmail_client import GmailClient
+from src.sinks import SINKS, CsvSink, SqliteSink
+
+
+class AsyncClient:
+    """Awaitable facade over a GmailClient, as save_messages_async uses an AsyncGmailClient."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def get_message_details_batch(self, message_ids, **kwargs):
+        return self.client.get_message_details_batch(message_ids, **kwargs)
+
+
+@pytest.fixture
+def emails_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_processor, 'EMAILS_DIR', tmp_path)
+    return tmp_path
+
+
+def make_processor(tmp_path, client):
+    return DataProcessor(client, checkpoint_dir=tmp_path / 'checkpoints', output_format='csv',
+                         fetch_profile='full')
+
+
+def read_output(path):
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+
+def make_message(message_id):
+    return {'id': message_id, 'threadId': message_id, 'labelIds': ['INBOX'],
+            'internalDate': '1727776800000',
+            'payload': {'mimeType': 'text/plain', 'body': {},
+                        'headers': [{'name': 'Subject', 'value': f"subject {message_id}"}]}}
+
+
+def test_fetching_starts_with_the_first_listing_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(gmail_client, 'MAX_RESULTS_PER_PAGE', 50)
+    monkeypatch.setattr(data_processor, 'EMAILS_DIR', tmp_path)
+    messages = [make_message(f"m{index}") for index in range(300)]
+    events = []
+
+    class RecordingService(FakeGmailService):
+        def _list_messages(self, **kwargs):
+            events.append('list')
+            return super()._list_messages(**kwargs)
+
+        def _get_message(self, message_id, **kwargs):
+            events.append('get')
+            return super()._get_message(message_id, **kwargs)
+
+    client = GmailClient(None, service=RecordingService(messages))
+    processor = DataProcessor(client, checkpoint_dir=tmp_path / 'checkpoints')
+    saved_file = processor.save_messages(client.iter_messages(), {}, session_id='s')
+    assert len(pd.read_csv(saved_file)) == 300
+    assert events.count('list') == 6
+    # A batch of BATCH_SIZE messages is fetched as soon as two pages are listed
+    assert events.index('get') == 2
+
+
+def test_sink_is_closed_before_checking_whether_anything_was_written(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_processor, 'EMAILS_DIR', tmp_path)
+    events = []
+
+    class RecordingSink(CsvSink):
+        def close(self):
+            events.append('close')
+
+        def exists(self):
+            events.append('exists')
+            return super().exists()
+
+    monkeypatch.setitem(SINKS, 'csv', RecordingSink)
+    processor = DataProcessor(GmailClient(None, service=FakeGmailService([])),
+                              checkpoint_dir=tmp_path / 'checkpoints', output_format='csv')
+    assert processor.save_messages([], {}, session_id='s') is None
+    assert events[:2] == ['close', 'exists']
+
+
+def test_empty_sqlite_session_closes_the_message_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_processor, 'EMAILS_DIR', tmp_path)
+    sinks = []
+
+    def create(path):
+        sinks.append(SqliteSink(path, db_file=tmp_path / 'messages.sqlite3'))
+        return sinks[-1]
+
+    monkeypatch.setitem(SINKS, 'sqlite', create)
+    processor = DataProcessor(GmailClient(None, service=FakeGmailService([])),
+                              checkpoint_dir=tmp_path / 'checkpoints', output_format='sqlite')
+    assert processor.save_messages([], {}, session_id='s') is None
+    with pytest.raises(sqlite3.ProgrammingError):
+        sinks[0].store._conn.execute('SELECT 1')
+
+
+def test_parse_pool_output_matches_inline_parsing(emails_dir):
+    messages = make_messages(250)
+    client = GmailClient(None, service=FakeGmailService(messages))
+    processor = make_processor(emails_dir, client)
+
+    inline = processor.save_messages(messages, {}, session_id='inline')
+    pooled = processor.save_messages(messages, {}, session_id='pooled', parse_workers=2)
+    async_pooled = asyncio.run(make_processor(emails_dir, AsyncClient(client)).save_messages_async(
+        messages, {}, session_id='async', parse_workers=2
+    ))
+
+    expected = read_output(inline)
+    assert expected['id'].tolist() == [message['id'] for message in messages]
+    assert expected['body'].str.len().gt(0).all()
+    pd.testing.assert_frame_equal(read_output(pooled), expected)
+    pd.testing.assert_frame_equal(read_output(async_pooled), expected)
+
+
+def test_next_batch_is_fetched_while_the_previous_one_is_parsed(emails_dir):
+    messages = make_messages(250)
+    events = []
+
+    class RecordingClient(GmailClient):
+        def get_message_details_batch(self, message_ids, **kwargs):
+            events.append('fetch')
+            return super().get_message_details_batch(message_ids, **kwargs)
+
+    processor = make_processor(emails_dir, RecordingClient(None, service=FakeGmailService(messages)))
+    submit_batch = processor._submit_batch
+
+    def recording_submit(batch_details, label_mappings):
+        events.append('submit')
+        finish = submit_batch(batch_details, label_mappings)
+        return lambda: events.append('collect') or finish()
+
+    processor._submit_batch = recording_submit
+    processor.save_messages(messages, {}, session_id='s', parse_workers=2)
+    assert events == ['fetch', 'submit', 'fetch', 'submit', 'collect',
+                      'fetch', 'submit', 'collect', 'collect']
+
+
+def test_fetch_profiles_store_only_what_they_download(emails_dir):
+    messages = make_messages(120)
+    client = GmailClient(None, service=FakeGmailService(messages))
+    outputs = {}
+    for profile in ('minimal', 'metadata', 'full', 'raw'):
+        processor = DataProcessor(client, checkpoint_dir=emails_dir / 'checkpoints', output_format='csv',
+                                  fetch_profile=profile)
+        outputs[profile] = read_output(processor.save_messages(messages, {}, session_id=profile))
+
+    assert (outputs['minimal']['subject'] == '').all()
+    assert (outputs['minimal']['body'] == '').all()
+    assert 'payload' not in outputs['minimal']
+    assert (outputs['metadata']['body'] == '').all()
+    assert outputs['metadata']['from_address'].str.contains('@').all()
+    assert outputs['full']['body'].str.len().gt(0).all()
+    assert 'raw' not in outputs['raw']
+    columns = ['id', 'subject', 'from_address', 'date', 'body']
+    pd.testing.assert_frame_equal(outputs['raw'][columns], outputs['full'][columns])
+    pd.testing.assert_frame_equal(outputs['metadata'][columns[:-1]], outputs['full'][columns[:-1]])
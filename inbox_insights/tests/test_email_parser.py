@@ -0,0 +1,55 @@
+import pytest
+from src import email_parser
+from src.email_parser import EmailParser
+
+try:
+    import lxml  # noqa: F401
+except ImportError:
+    lxml = None
+
+BACKENDS = [
+    pytest.param('selectolax', marks=pytest.mark.skipif(email_parser.HTMLParser is None, reason='selectolax not installed')),
+    pytest.param('lxml', marks=pytest.mark.skipif(lxml is None, reason='lxml not installed')),
+    'html.parser',
+]
+
+HTML_SAMPLES = [
+    '<html><head><style>p{margin:0}</style></head>'
+    '<body><script>var x=1;</script><noscript>Enable JavaScript</noscript><p>Hello &amp; world</p></body></html>',
+    '<div>Line one<br>line <b>two</b></div><table><tr><td>cell</td></tr></table>',
+    'a &lt; b',
+]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    monkeypatch.setattr(EmailParser, 'backend', request.param)
+    return request.param
+
+
+def visible_text(html: str, **kwargs) -> str:
+    return ' '.join(EmailParser.html_to_text(html, **kwargs).split())
+
+
+@pytest.mark.parametrize('html, expected', list(zip(HTML_SAMPLES, [
+    'Hello & world',
+    'Line one line two cell',
+    'a < b',
+])))
+def test_backends_extract_the_same_visible_text(backend, html, expected):
+    assert visible_text(html) == expected
+
+
+@pytest.mark.parametrize('text', ['Price <5 now', 'I <3 this', 'no markup at all'])
+def test_plain_text_without_tags_is_returned_unchanged(backend, text):
+    assert EmailParser.html_to_text(text, plain_fallback=True) == text
+
+
+def test_plain_text_with_tags_is_converted(backend):
+    assert visible_text('<p>Hello</p> <b>there</b>', plain_fallback=True) == 'Hello there'
+
+
+def test_is_html_text():
+    assert EmailParser.is_html_text('<p>Hello</p>')
+    assert not EmailParser.is_html_text('Price <5 now')
+    assert not EmailParser.is_html_text('no markup at all')
@@ -0,0 +1,89 @@
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.errors import HttpError
+from benchmarks.fake_gmail_server import FakeGmailServer, SyntheticMailbox, apply_fields, parse_fields
+from benchmarks.synthetic import BASE_MS, INTERVAL_MS, make_message
+from src import gmail_client
+from src.email_parser import EmailParser
+from src.gmail_client import GmailClient
+
+
+def test_field_masks_keep_only_selected_fields():
+    tree = parse_fields('id,payload(headers,body/data),labelIds')
+    assert tree == {'id': None, 'payload': {'headers': None, 'body': {'data': None}}, 'labelIds': None}
+    resource = {
+        'id': 'm1', 'snippet': 'dropped', 'labelIds': ['INBOX'],
+        'payload': {'mimeType': 'text/plain', 'headers': [{'name': 'From', 'value': 'a'}],
+                    'body': {'size': 3, 'data': 'YWJj'}},
+    }
+    assert apply_fields(resource, tree) == {
+        'id': 'm1', 'labelIds': ['INBOX'],
+        'payload': {'headers': [{'name': 'From', 'value': 'a'}], 'body': {'data': 'YWJj'}},
+    }
+    assert apply_fields([{'id': 'a', 'x': 1}], parse_fields('id')) == [{'id': 'a'}]
+    with pytest.raises(ValueError):
+        parse_fields('id,(payload)')
+
+
+def test_listing_is_newest_first_and_filtered():
+    mailbox = SyntheticMailbox(25)
+    listed, page_token = [], None
+    while True:
+        page = mailbox.list_messages(maxResults='10', labelIds=['INBOX'], pageToken=page_token)
+        listed += [message['id'] for message in page['messages']]
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            break
+    assert listed == [f"{n:016x}" for n in reversed(range(25))]
+
+    starred = mailbox.list_messages(maxResults='100', labelIds=['INBOX', 'STARRED'])
+    assert [message['id'] for message in starred.get('messages', [])] == [
+        f"{n:016x}" for n in reversed(range(25)) if 'STARRED' in mailbox.label_ids(n)
+    ]
+    after, before = (BASE_MS + 5 * INTERVAL_MS) // 1000, (BASE_MS + 8 * INTERVAL_MS) // 1000
+    window = mailbox.list_messages(q=f"after:{after} before:{before}")
+    assert [message['id'] for message in window['messages']] == [f"{n:016x}" for n in (7, 6, 5)]
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(gmail_client, 'RETRY_BACKOFF_SECONDS', 0)
+
+
+def test_client_ingests_the_mailbox_over_http(no_backoff):
+    with FakeGmailServer(SyntheticMailbox(60), error_rate=0.2, seed=1) as server:
+        client = GmailClient(AnonymousCredentials(), api_endpoint=server.url)
+        message_ids = [message['id'] for message in client.iter_messages()]
+        details = client.get_message_details_batch(message_ids, fetch_profile='full')
+        labels = client.get_labels()
+
+    assert len(message_ids) == 60
+    assert [message['id'] for message in details] == message_ids
+    assert server.calls['429'] > 0
+    assert server.calls['messages.get'] == 60 + server.calls['429']
+    assert {label['id'] for label in labels} >= {'INBOX', 'STARRED'}
+    for message in details[:5]:
+        expected = make_message(int(message['id'], 16), label_ids=message['labelIds'])
+        assert EmailParser.parse_email_body(message['payload']) == EmailParser.parse_email_body(expected['payload'])
+        # The full profile's field mask drops the top-level bookkeeping fields
+        assert set(message['payload']) <= {'mimeType', 'headers', 'body', 'parts'}
+        assert set(message['payload'].get('body', {})) <= {'data'}
+
+
+def test_history_expires_and_replays_label_changes():
+    mailbox = SyntheticMailbox(30, history=12)
+    with FakeGmailServer(mailbox) as server:
+        client = GmailClient(AnonymousCredentials(), api_endpoint=server.url)
+        profile = client.get_profile()
+        history = client.get_history('1')
+        with pytest.raises(HttpError) as raised:
+            client.get_history('0')
+
+    assert profile['historyId'] == '13'
+    assert [record['id'] for record in history] == [str(n) for n in range(2, 14)]
+    assert raised.value.resp.status == 404
+    for record in history:
+        (change, (entry,)), = [(key, value) for key, value in record.items() if key != 'id']
+        label, = entry['labelIds']
+        # Each record agrees with the message's current labels
+        assert (label in mailbox.label_ids(int(entry['message']['id'], 16))) == (change == 'labelsAdded')
@@ -0,0 +1,42 @@
+import itertools
+import re
+from src.filters import FilterRule, RuleMatcher, _fusable
+
+RULES = [
+    FilterRule('invoice', subject='Invoice'),
+    FilterRule('receipt', subject='(?i)receipt'),
+    FilterRule('vendor', sender='@shop.example', subject='(?i)order #\\d+'),
+    FilterRule('repeat', subject='(\\w+) \\1'),
+    FilterRule('named', body='(?P<word>ab)c(?P=word)'),
+    FilterRule('amount', body='(?x) \\d+ \\s* (?:USD|EUR)  # amount and currency'),
+    FilterRule('code', body='(foo|bar)\\d'),
+    FilterRule('bracketed', body='(a)?b(?(1)c|d)'),
+    FilterRule('digest', list_id='<digest.lists.example>', labels=['INBOX']),
+    FilterRule('boss', sender='boss@corp.example', body='(?i)urgent'),
+    FilterRule('starred', labels=['STARRED'], subject='(?i)^re:'),
+]
+
+SUBJECTS = ['Invoice 42', 'your RECEIPT', 'Order #123', 'hello hello', 'Re: plans', 'abc']
+BODIES = ['', 'abcab', '12 EUR due', 'foo7', 'abc', 'bd', 'URGENT: call me', 'xbcx']
+SENDERS = ['Boss@corp.example', 'sales@shop.example', 'someone@elsewhere.example']
+LABELS = [['INBOX'], ['INBOX', 'STARRED'], []]
+
+
+def make_message(subject, body, sender, labels):
+    return {'subject': subject, 'body': body, 'from_address': sender,
+            'list_id': 'digest.lists.example' if 'INBOX' in labels else '', 'labels': labels}
+
+
+def test_matcher_agrees_with_rule_by_rule_matching():
+    matcher = RuleMatcher(RULES)
+    for subject, body, sender, labels in itertools.product(SUBJECTS, BODIES, SENDERS, LABELS):
+        message = make_message(subject, body, sender, labels)
+        assert matcher.match(message) == [rule.name for rule in RULES if rule.matches(message)], message
+
+
+def test_group_references_and_trailing_comments_are_not_fused():
+    for pattern in ['(\\w+) \\1', '(?P<word>ab)c(?P=word)', '(a)?b(?(1)c|d)',
+                    '(?x) \\d+ \\s* (?:USD|EUR)  # amount']:
+        assert _fusable(re.compile(pattern)) is None
+    # A comment ended by a newline is harmless
+    assert _fusable(re.compile('(?x) \\d+  # amount\n EUR')) == '(?x: \\d+  # amount\n EUR)'
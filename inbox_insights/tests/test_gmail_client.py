@@ -0,0 +1,160 @@
+import pytest
+from googleapiclient.errors import HttpError
+from benchmarks.synthetic import make_messages
+from config.settings import MAX_RETRIES, METADATA_HEADERS
+from src import gmail_client
+from src.fake_gmail import FakeGmailService
+from src.gmail_client import GmailClient
+from src.message_cache import MessageCache
+from src.metrics import InMemoryMetrics
+from src.rate_limiter import TokenBucket
+
+
+def make_message(message_id, label_ids):
+    return {'id': message_id, 'threadId': message_id, 'labelIds': label_ids,
+            'payload': {'mimeType': 'text/plain', 'headers': []}}
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(gmail_client, 'RETRY_BACKOFF_SECONDS', 0)
+
+
+def fetch(service, message_ids):
+    client = GmailClient(None, service=service, metrics=InMemoryMetrics())
+    return client, client.get_message_details_batch(message_ids)
+
+
+def test_batch_results_follow_input_order(no_backoff):
+    messages = [make_message(f"m{index}", ['INBOX']) for index in range(250)]
+    service = FakeGmailService(messages, failures={'m5': [503], 'm120': [429, 500]})
+    message_ids = [message['id'] for message in reversed(messages)]
+
+    _, details = fetch(service, message_ids)
+    assert [message['id'] for message in details] == message_ids
+
+
+def test_batch_retries_only_failed_sub_requests(no_backoff):
+    messages = [make_message(f"m{index}", ['INBOX']) for index in range(10)]
+    service = FakeGmailService(messages, failures={'m3': [503], 'm7': [429]})
+
+    client, details = fetch(service, [message['id'] for message in messages])
+    assert len(details) == 10
+    assert service.calls['batch'] == 2
+    assert service.calls['messages.get'] == 12
+    counters = client.metrics.counters()
+    assert counters[('api_retries', (('status', '503'),))] == 1
+    assert counters[('api_retries', (('status', '429'),))] == 1
+
+
+def test_batch_gives_up_after_max_retries(no_backoff):
+    messages = [make_message(f"m{index}", ['INBOX']) for index in range(3)]
+    service = FakeGmailService(messages, failures={'m1': [503] * (MAX_RETRIES + 1)})
+
+    with pytest.raises(HttpError) as raised:
+        fetch(service, [message['id'] for message in messages])
+    assert raised.value.resp.status == 503
+    assert service.calls['batch'] == MAX_RETRIES + 1
+
+
+def test_failed_batch_request_is_retried(no_backoff):
+    messages = [make_message(f"m{index}", ['INBOX']) for index in range(3)]
+    service = FakeGmailService(messages, batch_failures=[503, 429])
+
+    _, details = fetch(service, [message['id'] for message in messages])
+    assert [message['id'] for message in details] == ['m0', 'm1', 'm2']
+    assert service.calls['batch'] == 3
+
+    service = FakeGmailService(messages, batch_failures=[400])
+    with pytest.raises(HttpError):
+        fetch(service, ['m0'])
+    assert service.calls['batch'] == 1
+
+
+@pytest.mark.parametrize('status, throttled', [(429, True), (403, True), (500, False), (503, False)])
+def test_only_rate_limit_errors_slow_the_token_bucket(no_backoff, status, throttled):
+    messages = [make_message(f"m{index}", ['INBOX']) for index in range(3)]
+    # 403s carry a rateLimitExceeded reason, see fake_gmail.make_http_error
+    service = FakeGmailService(messages, failures={'m1': [status], 'm2': [status]})
+    bucket = TokenBucket(rate=1000)
+    client = GmailClient(None, service=service, rate_limiter=bucket)
+
+    client.get_message_details_batch(['m0', 'm1'])
+    assert (bucket.rate < bucket.max_rate) == throttled
+    bucket.rate = bucket.max_rate
+    client.batch_modify(['m2'], add_label_ids=['STARRED'])
+    assert (bucket.rate < bucket.max_rate) == throttled
+
+
+class ListingRecorder(FakeGmailService):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.list_params = []
+
+    def _list_messages(self, **kwargs):
+        self.list_params.append(kwargs)
+        return super()._list_messages(**kwargs)
+
+
+def test_listing_streams_pages_with_the_labels_on_every_page(monkeypatch):
+    monkeypatch.setattr(gmail_client, 'MAX_RESULTS_PER_PAGE', 10)
+    messages = [make_message(f"m{index}", ['SENT'] if index % 4 == 0 else ['INBOX']) for index in range(40)]
+    service = ListingRecorder(messages)
+    listing = GmailClient(None, service=service).iter_messages(['INBOX'], query='after:0')
+
+    assert next(listing)['id'] == 'm1'
+    assert len(service.list_params) == 1
+    assert [message['id'] for message in listing] == [
+        message['id'] for message in messages[2:] if message['labelIds'] == ['INBOX']
+    ]
+    assert [params['pageToken'] for params in service.list_params] == [None, '10', '20']
+    assert all(params['labelIds'] == ['INBOX'] and params['q'] == 'after:0' for params in service.list_params)
+
+
+@pytest.mark.parametrize('profile, kept', [
+    ('minimal', set()),
+    ('metadata', {'From', 'Subject'}),
+    ('full', {'From', 'To', 'Subject', 'Date', 'Message-ID'}),
+])
+def test_fetch_profiles_send_their_format_and_field_mask(profile, kept):
+    requests = []
+
+    class RecordingService(FakeGmailService):
+        def _get_message(self, message_id, **kwargs):
+            requests.append(kwargs)
+            return super()._get_message(message_id, **kwargs)
+
+    messages = make_messages(3)
+    client = GmailClient(None, service=RecordingService(messages))
+    details = client.get_message_details_batch(['0' * 16, '0' * 15 + '1'], fetch_profile=profile,
+                                               metadata_headers=['From', 'Subject'])
+
+    expected = dict(gmail_client.FETCH_PROFILES[profile])
+    if profile == 'metadata':
+        expected['metadataHeaders'] = ['From', 'Subject']
+    assert requests == [expected, expected]
+    headers = {header['name'] for header in details[0].get('payload', {}).get('headers', [])}
+    assert headers == kept
+    assert ('parts' in details[0].get('payload', {})) == (profile == 'full')
+
+
+def test_metadata_profile_defaults_to_the_configured_headers():
+    params = GmailClient.message_get_params('metadata')
+    assert params['metadataHeaders'] == METADATA_HEADERS
+    assert 'payload/headers' in params['fields'].split(',')
+    with pytest.raises(ValueError):
+        GmailClient.message_get_params('everything')
+
+
+def test_offline_listing_matches_profile_and_labels(tmp_path):
+    cache = MessageCache(tmp_path / 'cache.sqlite3')
+    cache.put_many([make_message('a1', ['INBOX']), make_message('a2', ['SENT'])], 'full')
+    cache.put_many([make_message('b1', ['INBOX'])], 'raw')
+    client = GmailClient(None, cache=cache, offline=True)
+
+    listed = [message['id'] for message in client.iter_messages(fetch_profile='full')]
+    assert listed == ['a1']
+    assert client.get_message_details_batch(listed, fetch_profile='full') == [make_message('a1', ['INBOX'])]
+    assert [message['id'] for message in client.iter_messages(['INBOX'], fetch_profile='raw')] == ['b1']
+    with pytest.raises(ValueError):
+        list(client.iter_messages(query='after:0', fetch_profile='full'))
@@ -0,0 +1,104 @@
+import pandas as pd
+import pytest
+from src.data_processor import DataProcessor
+from src.fake_gmail import FakeGmailService
+from src.gmail_client import GmailClient
+from src.incremental_sync import IncrementalSync
+from src.sync_state import SyncStateManager
+
+
+def make_message(message_id, label_ids=('INBOX',)):
+    return {'id': message_id, 'threadId': message_id, 'labelIds': list(label_ids),
+            'internalDate': '1727776800000',
+            'payload': {'mimeType': 'text/plain', 'body': {},
+                        'headers': [{'name': 'Subject', 'value': f"subject {message_id}"}]}}
+
+
+def entry(message_id, label_ids, changed=None):
+    result = {'message': {'id': message_id, 'threadId': message_id, 'labelIds': label_ids}}
+    if changed is not None:
+        result['labelIds'] = changed
+    return result
+
+
+def test_collect_changes_nets_out_history():
+    history = [
+        {'id': '2', 'messagesAdded': [entry('new', ['INBOX']), entry('sent', ['SENT'])]},
+        {'id': '3', 'labelsRemoved': [entry('old', ['UNREAD'], ['INBOX'])]},
+        {'id': '4', 'labelsAdded': [entry('old', ['UNREAD', 'INBOX'], ['INBOX']),
+                                    entry('starred', ['INBOX', 'STARRED'], ['STARRED'])]},
+        {'id': '5', 'messagesAdded': [entry('gone', ['INBOX'])]},
+        {'id': '6', 'messagesDeleted': [entry('gone', ['INBOX']), entry('stored', [])]},
+    ]
+
+    added, deleted, label_updates = IncrementalSync.collect_changes(history, ['INBOX'])
+    assert added == ['new', 'old']
+    assert deleted == {'gone', 'stored'}
+    assert label_updates == {'old': ['UNREAD', 'INBOX'], 'starred': ['INBOX', 'STARRED']}
+
+
+@pytest.fixture
+def mailbox(tmp_path):
+    service = FakeGmailService([make_message(f"m{index}") for index in range(5)])
+    client = GmailClient(None, service=service)
+    processor = DataProcessor(client, output_format='csv', fetch_profile='full',
+                              output_dir=tmp_path / 'emails', interactive=False)
+    sync = IncrementalSync(client, processor, SyncStateManager(tmp_path / 'sync_state.json'))
+    return service, client, sync
+
+
+def saved_rows(sync):
+    return pd.concat(
+        [pd.read_csv(path, dtype=str, keep_default_na=False)
+         for path in sorted(sync.data_processor.output_dir.glob('email_*.csv'))],
+        ignore_index=True
+    )
+
+
+def add_message(service, message):
+    service.messages[message['id']] = message
+    service.history_id += 1
+    service.history.append({'id': str(service.history_id), 'messagesAdded': [{'message': message}]})
+
+
+def test_incremental_run_downloads_only_new_messages(mailbox):
+    service, client, sync = mailbox
+    assert sync.run(['INBOX'], {}, session_id='first') is not None
+    assert sorted(saved_rows(sync)['id']) == ['m0', 'm1', 'm2', 'm3', 'm4']
+
+    # m1 leaves the inbox and comes back, m2 is starred, m3 is deleted, m5 arrives
+    client.batch_modify(['m1'], remove_label_ids=['INBOX'])
+    client.batch_modify(['m1'], add_label_ids=['INBOX'])
+    client.batch_modify(['m2'], add_label_ids=['STARRED'])
+    del service.messages['m3']
+    service.history_id += 1
+    service.history.append({'id': str(service.history_id), 'messagesDeleted': [entry('m3', [])]})
+    add_message(service, make_message('m5'))
+    service.calls.clear()
+
+    assert sync.run(['INBOX'], {'STARRED': 'Starred'}, session_id='second') is not None
+    assert service.calls['messages.get'] == 1
+    rows = saved_rows(sync).set_index('id')
+    assert sorted(rows.index) == ['m0', 'm1', 'm2', 'm4', 'm5']
+    assert rows.loc['m2', 'labels'] == "['INBOX', 'Starred']"
+    assert rows.loc['m1', 'labels'] == "['INBOX']"
+
+    # Nothing changed since
+    service.calls.clear()
+    assert sync.run(['INBOX'], {}, session_id='third') is None
+    assert service.calls['messages.get'] == 0
+
+
+def test_expired_history_falls_back_to_a_full_sync(mailbox):
+    service, client, sync = mailbox
+    sync.run(['INBOX'], {}, session_id='first')
+    for index in range(5, 8):
+        add_message(service, make_message(f"m{index}"))
+    # History older than the first retained record is gone (404)
+    service.history = service.history[1:]
+    service.calls.clear()
+
+    sync.run(['INBOX'], {}, session_id='second')
+    assert service.calls['messages.list'] == 1
+    assert service.calls['messages.get'] == 8
+    assert sync.state_manager.get_history_id('me@example.com', ['INBOX']) == str(service.history_id)
@@ -0,0 +1,85 @@
+import pandas as pd
+from config.settings import BATCH_MODIFY_SIZE
+from src.fake_gmail import FakeGmailService
+from src.gmail_client import GmailClient
+from src.label_rules import LabelRule, apply_label_changes, plan_label_changes
+
+SYSTEM_LABELS = [{'id': 'INBOX', 'name': 'INBOX', 'type': 'system'},
+                 {'id': 'STARRED', 'name': 'STARRED', 'type': 'system'}]
+
+RULES = [
+    LabelRule('news', add_labels=['Newsletters'], remove_labels=['INBOX'], list_id='news.example.com'),
+    LabelRule('boss', add_labels=['STARRED'], sender='boss@corp.example'),
+]
+
+
+class RecordingService(FakeGmailService):
+    """Fake service that also keeps the body of every batchModify call."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.modify_bodies = []
+
+    def _batch_modify(self, **body):
+        self.modify_bodies.append(body)
+        return super()._batch_modify(**body)
+
+
+def make_mailbox():
+    messages = []
+    for index in range(2600):
+        if index < 2300:
+            sender, list_id = f"list{index % 7}@news.example.com", 'news.example.com'
+        elif index < 2400:
+            sender, list_id = 'boss@corp.example', ''
+        else:
+            sender, list_id = 'friend@example.org', ''
+        labels = ['INBOX', 'STARRED'] if index % 10 == 0 else ['INBOX']
+        messages.append({'id': f"m{index:04d}", 'threadId': f"t{index:04d}", 'labelIds': labels,
+                         'from_address': sender, 'list_id': list_id, 'subject': ''})
+    return messages
+
+
+def to_frame(messages, label_names):
+    return pd.DataFrame({
+        'id': [message['id'] for message in messages],
+        'from_address': [message['from_address'] for message in messages],
+        'subject': [message['subject'] for message in messages],
+        'list_id': [message['list_id'] for message in messages],
+        'labels': [[label_names.get(label, label) for label in message['labelIds']] for message in messages],
+    })
+
+
+def test_changes_are_sent_in_chunks_with_their_own_label_sets():
+    messages = make_mailbox()
+    service = RecordingService(messages, labels=list(SYSTEM_LABELS))
+    changes = plan_label_changes(to_frame(messages, {}), RULES)
+    assert [(change['add'], change['remove'], len(change['ids'])) for change in changes] == [
+        (['Newsletters'], ['INBOX'], 2300),
+        (['STARRED'], [], 90),
+    ]
+
+    calls = apply_label_changes(GmailClient(None, service=service), changes)
+    assert calls == len(service.modify_bodies) == 4
+    newsletters = [label['id'] for label in service.labels if label['name'] == 'Newsletters']
+    assert len(newsletters) == 1
+    assert [len(body['ids']) for body in service.modify_bodies] == [BATCH_MODIFY_SIZE, BATCH_MODIFY_SIZE, 300, 90]
+    for body in service.modify_bodies[:3]:
+        assert (body['addLabelIds'], body['removeLabelIds']) == (newsletters, ['INBOX'])
+        assert all(service.messages[message_id]['list_id'] for message_id in body['ids'])
+    assert service.modify_bodies[3] == {'ids': changes[1]['ids'], 'addLabelIds': ['STARRED']}
+
+    # Once applied, the same rules plan nothing
+    label_names = {label['id']: label['name'] for label in service.labels}
+    assert plan_label_changes(to_frame(list(service.messages.values()), label_names), RULES) == []
+
+
+def test_dry_run_counts_calls_without_touching_the_mailbox():
+    messages = make_mailbox()
+    changes = plan_label_changes(to_frame(messages, {}), RULES)
+
+    service = RecordingService(messages, labels=list(SYSTEM_LABELS))
+    assert apply_label_changes(GmailClient(None, service=service), changes, dry_run=True) == 4
+    assert not service.calls
+    assert service.labels == SYSTEM_LABELS
+    assert list(service.messages.values()) == make_mailbox()
@@ -0,0 +1,53 @@
+import os
+import sys
+import pytest
+import main
+
+
+def parse(monkeypatch, *argv):
+    monkeypatch.setattr(sys, 'argv', ['main.py', *argv])
+    return main.parse_args()
+
+
+@pytest.mark.parametrize('argv', [
+    ['--async', '--workers', '4'],
+    ['--async', '--by-thread'],
+    ['--async', '--incremental'],
+    ['--async', '--cache'],
+    ['--offline', '--async'],
+])
+def test_unsupported_async_combinations_are_rejected(monkeypatch, capsys, argv):
+    with pytest.raises(SystemExit):
+        parse(monkeypatch, *argv)
+    assert 'cannot be combined' in capsys.readouterr().err
+
+
+def test_async_accepts_the_options_it_supports(monkeypatch):
+    args = parse(monkeypatch, '--async', '--parse-workers', '2', '--fetch-profile', 'metadata')
+    assert args.use_async and args.parse_workers == 2
+
+
+@pytest.mark.parametrize('argv', [
+    ['--by-thread', '--offline'],
+    ['--by-thread', '--fetch-profile', 'raw'],
+])
+def test_by_thread_rejects_cache_only_and_raw_runs(monkeypatch, argv):
+    with pytest.raises(SystemExit):
+        parse(monkeypatch, *argv)
+
+
+def test_saved_outputs_are_ordered_by_session_end_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'EMAILS_DIR', tmp_path)
+    names = [
+        'email_01-10-2026-08-00-00_01-10-2026-09-00-00.csv',
+        'email_nightly_05-10-2026-23-59-59.csv',
+        'email_20-09-2026-10-00-00_12-10-2026-07-30-00.parquet',
+        'email_13-10-2026-06-00-00.csv',
+    ]
+    for mtime, name in enumerate(reversed(names)):
+        path = tmp_path / name
+        path.mkdir() if path.suffix == '.parquet' else path.write_text('id\n')
+        # An incremental sync rewrote the oldest outputs last
+        os.utime(path, (mtime, mtime))
+
+    assert [path.name for path in main.saved_outputs()] == names
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.merge import HashedIdSet, hash_ids, merge_sessions
+from src.sinks import CsvSink
+
+OLD_HEADERS = [
+    {'name': 'From', 'value': 'Old Sender <Old@Example.com>'},
+    {'name': 'To', 'value': 'me@example.com'},
+    {'name': 'Subject', 'value': 'Before typed columns'},
+    {'name': 'Date', 'value': 'Tue, 01 Oct 2024 10:00:00 +0000'},
+    {'name': 'List-Id', 'value': 'News <news.example.com>'},
+]
+
+
+def write_old_session(path):
+    """Session CSV as written before the typed header columns existed."""
+    pd.DataFrame([{
+        'id': '00000000000000a1',
+        'threadId': '00000000000000a1',
+        'labelIds': "['INBOX']",
+        'snippet': 'old',
+        'payload': repr({'mimeType': 'text/plain', 'headers': OLD_HEADERS}),
+        'sizeEstimate': '100',
+        'internalDate': '1727776800000',
+        'body': 'old body',
+        'labels': "['INBOX']",
+    }]).to_csv(path, index=False)
+
+
+def write_new_session(path):
+    CsvSink(path.with_suffix('')).write([{
+        'id': '00000000000000b2',
+        'threadId': '00000000000000b2',
+        'labelIds': ['INBOX'],
+        'snippet': 'new',
+        'payload': {'mimeType': 'text/plain', 'headers': [{'name': 'From', 'value': 'new@example.com'}]},
+        'sizeEstimate': 200,
+        'internalDate': '1727863200000',
+        'from_name': '',
+        'from_address': 'new@example.com',
+        'to_addresses': ['me@example.com'],
+        'cc_addresses': [],
+        'subject': 'After typed columns',
+        'date': '2024-10-02 10:00:00+00:00',
+        'list_id': '',
+        'rfc822_message_id': '',
+        'in_reply_to': '',
+        'body': 'new body',
+        'labels': ['INBOX'],
+    }])
+
+
+def write_session(path, rows):
+    pd.DataFrame(
+        [(message_id, message_id, repr(labels), repr(labels), f"body of {message_id}")
+         for message_id, labels in rows],
+        columns=['id', 'threadId', 'labelIds', 'labels', 'body']
+    ).to_csv(path, index=False)
+    return path
+
+
+def test_hashed_id_set_finds_ids_across_runs():
+    seen = HashedIdSet()
+    for start in range(0, 100, 7):
+        seen.add(hash_ids([f"{index:016x}" for index in range(start, start + 7)]))
+
+    assert len(seen) == 105
+    lookup = hash_ids([f"{index:016x}" for index in (0, 104, 105)] + ['not-hex'])
+    assert seen.contains(lookup).tolist() == [True, True, False, False]
+    assert hash_ids(['00000000000000ff'])[0] == np.uint64(255)
+
+
+def test_merge_keeps_the_newest_copy_of_each_message(tmp_path):
+    old = write_session(tmp_path / 'email_old.csv', [('a1', ['INBOX']), ('a2', ['INBOX']), ('a2', ['INBOX'])])
+    new = write_session(tmp_path / 'email_new.csv', [('a2', ['INBOX', 'STARRED']), ('b1', ['INBOX'])])
+
+    merged = merge_sessions([old, new], tmp_path / 'merged', chunk_size=2)
+
+    frame = pd.read_csv(merged, dtype=str, keep_default_na=False).set_index('id')
+    assert sorted(frame.index) == ['a1', 'a2', 'b1']
+    assert frame.loc['a2', 'labels'] == repr(['INBOX', 'STARRED'])
+    assert not (tmp_path / 'merged.partial.csv').exists()
+
+
+def test_merging_nothing_writes_nothing(tmp_path):
+    empty = write_session(tmp_path / 'email_empty.csv', [])
+    assert merge_sessions([empty], tmp_path / 'merged') is None
+
+
+def test_merge_parses_headers_of_old_schema_rows(tmp_path):
+    pytest.importorskip('pyarrow')
+    write_old_session(tmp_path / 'email_old.csv')
+    write_new_session(tmp_path / 'email_new.csv')
+
+    merged = merge_sessions([tmp_path / 'email_old.csv', tmp_path / 'email_new.csv'],
+                            tmp_path / 'merged', output_format='parquet')
+
+    frame = pd.read_parquet(merged).set_index('id')
+    old = frame.loc['00000000000000a1']
+    assert old['from_name'] == 'Old Sender'
+    assert old['from_address'] == 'old@example.com'
+    assert list(old['to_addresses']) == ['me@example.com']
+    assert old['subject'] == 'Before typed columns'
+    assert old['list_id'] == 'news.example.com'
+    assert old['date'] == pd.Timestamp('2024-10-01 10:00:00', tz='UTC')
+    new = frame.loc['00000000000000b2']
+    assert new['from_address'] == 'new@example.com'
+    assert new['subject'] == 'After typed columns'
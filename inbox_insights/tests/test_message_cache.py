@@ -0,0 +1,52 @@
+import json
+import sqlite3
+import zlib
+from src.message_cache import MessageCache
+
+
+def make_message(message_id, label_ids, body='x'):
+    return {'id': message_id, 'threadId': message_id, 'labelIds': label_ids,
+            'payload': {'mimeType': 'text/plain', 'headers': [], 'body': {'data': body}}}
+
+
+def listed(cache, **kwargs):
+    return [message['id'] for message in cache.iter_ids(**kwargs)]
+
+
+def test_label_filter_uses_the_latest_labels(tmp_path):
+    cache = MessageCache(tmp_path / 'cache.sqlite3')
+    cache.put_many([make_message('m1', ['INBOX', 'UNREAD']), make_message('m2', ['INBOX']),
+                    make_message('m3', ['SENT'])], 'full')
+    cache.put_many([make_message('m3', ['SENT'])], 'minimal')
+
+    assert listed(cache, label_ids=['INBOX']) == ['m2', 'm1']
+    assert listed(cache, label_ids=['UNREAD', 'INBOX', 'INBOX']) == ['m1']
+    assert listed(cache, profile='minimal', label_ids=['SENT']) == ['m3']
+    assert listed(cache, profile='minimal', label_ids=['INBOX']) == []
+
+    # A label refresh stores the message again with its new labels
+    cache.put_many([make_message('m1', ['ARCHIVE'])], 'full')
+    assert listed(cache, label_ids=['INBOX']) == ['m2']
+    assert listed(cache) == ['m3', 'm2', 'm1']
+
+
+def test_evicted_messages_lose_their_labels(tmp_path):
+    cache = MessageCache(tmp_path / 'cache.sqlite3', max_bytes=1)
+    cache.put_many([make_message('m1', ['INBOX'])], 'full')
+
+    assert listed(cache, label_ids=['INBOX']) == []
+    assert cache._conn.execute("SELECT COUNT(*) FROM message_labels").fetchone()[0] == 0
+
+
+def test_caches_without_a_label_table_are_indexed_on_open(tmp_path):
+    path = tmp_path / 'cache.sqlite3'
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE messages (id TEXT NOT NULL, profile TEXT NOT NULL, data BLOB NOT NULL, "
+                 "size INTEGER NOT NULL, last_access REAL NOT NULL, PRIMARY KEY (id, profile)) WITHOUT ROWID")
+    for message in (make_message('m1', ['INBOX']), make_message('m2', ['SENT'])):
+        data = zlib.compress(json.dumps(message).encode('utf-8'))
+        conn.execute("INSERT INTO messages VALUES (?, 'full', ?, ?, 0)", (message['id'], data, len(data)))
+    conn.commit()
+    conn.close()
+
+    assert listed(MessageCache(path), label_ids=['INBOX']) == ['m1']
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+from src.sinks import ParquetSink, apply_parquet_changes, saved_parquet_ids
+from utils.helpers import apply_message_changes, saved_message_ids
+
+LABEL_MAPPINGS = {'INBOX': 'Inbox', 'STARRED': 'Starred'}
+
+
+def write_csv(path, message_ids):
+    rows = [{'id': message_id, 'threadId': message_id, 'labelIds': "['INBOX']", 'labels': "['Inbox']",
+             'body': f"body of {message_id}"} for message_id in message_ids]
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return path
+
+
+def make_row(message_id, internal_date='1727776800000'):
+    return {'id': message_id, 'threadId': message_id, 'internalDate': internal_date,
+            'labelIds': ['INBOX'], 'labels': ['Inbox'], 'body': f"body of {message_id}"}
+
+
+def test_csv_changes_rewrite_only_files_with_affected_messages(tmp_path):
+    untouched = write_csv(tmp_path / 'email_old.csv', ['a1', 'a2'])
+    changed = write_csv(tmp_path / 'email_new.csv', ['b1', 'b2', 'b3'])
+    before = untouched.stat().st_mtime_ns, untouched.stat().st_ino
+
+    assert apply_message_changes([untouched, changed], {'b1'}, {'b2': ['INBOX', 'STARRED']}, LABEL_MAPPINGS) == 2
+
+    assert (untouched.stat().st_mtime_ns, untouched.stat().st_ino) == before
+    frame = pd.read_csv(changed, dtype=str).set_index('id')
+    assert list(frame.index) == ['b2', 'b3']
+    assert frame.loc['b2', 'labels'] == "['Inbox', 'Starred']"
+    assert frame.loc['b3', 'labels'] == "['Inbox']"
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_saved_ids_are_found_across_files(tmp_path):
+    paths = [write_csv(tmp_path / 'email_a.csv', ['a1', 'a2']), write_csv(tmp_path / 'email_b.csv', ['b1'])]
+    assert saved_message_ids(paths, ['a2', 'b1', 'x']) == {'a2', 'b1'}
+    assert saved_message_ids(paths, []) == set()
+
+
+def test_parquet_changes_update_labels_and_drop_deleted_messages(tmp_path):
+    pytest.importorskip('pyarrow')
+    sink = ParquetSink(tmp_path / 'email_s')
+    # Two monthly partitions; only October holds affected messages
+    sink.write([make_row('a1'), make_row('a2'), make_row('a3'), make_row('c1', internal_date='1733050800000')])
+    sink.flush()
+    december = next(sink.path.glob('month=2024-12/*.parquet'))
+    before = december.stat().st_mtime_ns
+
+    assert apply_parquet_changes([sink.path], {'a1'}, {'a2': ['INBOX', 'STARRED']}, LABEL_MAPPINGS) == 2
+
+    assert december.stat().st_mtime_ns == before
+    frame = pd.read_parquet(sink.path).set_index('id')
+    assert sorted(frame.index) == ['a2', 'a3', 'c1']
+    assert list(frame.loc['a2', 'labels']) == ['Inbox', 'Starred']
+    assert list(frame.loc['a3', 'labels']) == ['Inbox']
+
+    apply_parquet_changes([sink.path], {'c1'}, {}, LABEL_MAPPINGS)
+    assert not list(sink.path.glob('month=2024-12/*.parquet'))
+
+
+def test_saved_parquet_ids_are_found_across_partitions(tmp_path):
+    pytest.importorskip('pyarrow')
+    sink = ParquetSink(tmp_path / 'email_p')
+    sink.write([make_row('p1'), make_row('p2', internal_date='1733050800000')])
+    sink.flush()
+    assert saved_parquet_ids([sink.path], ['p2', 'x', 'p1']) == {'p1', 'p2'}
+    assert saved_parquet_ids([sink.path], []) == set()
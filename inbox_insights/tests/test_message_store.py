@@ -0,0 +1,75 @@
+from src.message_store import MessageStore
+
+
+def make_row(message_id, date, sender, subject, body, labels, thread_id=None):
+    headers = [
+        {'name': 'From', 'value': sender},
+        {'name': 'To', 'value': 'me@example.com'},
+        {'name': 'Subject', 'value': subject},
+    ]
+    return {'id': message_id, 'threadId': thread_id or message_id, 'internalDate': str(date),
+            'payload': {'headers': headers}, 'body': body, 'labels': labels}
+
+
+ROWS = [
+    make_row('m1', 100, 'Alice <alice@example.com>', 'Quarterly invoice', 'Please pay the invoice', ['INBOX'], 't1'),
+    make_row('m2', 200, 'Bob <bob@example.com>', 'Re: Quarterly invoice', 'Paid yesterday', ['INBOX', 'STARRED'], 't1'),
+    make_row('m3', 300, 'News <news@lists.test>', 'Weekly digest', 'Top stories this week', ['CATEGORY_UPDATES']),
+]
+
+
+def ids(messages):
+    return [message['id'] for message in messages]
+
+
+def test_query_filters_combine_newest_first(tmp_path):
+    store = MessageStore(tmp_path / 'messages.sqlite3')
+    assert store.upsert(ROWS) == ['m1', 'm2', 'm3']
+
+    assert ids(store.query()) == ['m3', 'm2', 'm1']
+    assert ids(store.query(sender='ALICE@example.com')) == ['m1']
+    assert ids(store.query(sender='@example.com')) == ['m2', 'm1']
+    assert ids(store.query(label='INBOX', after=150)) == ['m2']
+    assert ids(store.query(before=300, limit=1)) == ['m2']
+    assert ids(store.query(thread_id='t1')) == ['m2', 'm1']
+    assert ids(store.query(label='STARRED', sender='@lists.test')) == []
+    message, = store.query(label='STARRED')
+    assert (message['sender'], message['sender_name'], message['subject']) == ('bob@example.com', 'Bob', 'Re: Quarterly invoice')
+    assert message['labels'] == ['INBOX', 'STARRED']
+
+
+def test_full_text_search_covers_subject_and_body(tmp_path):
+    store = MessageStore(tmp_path / 'messages.sqlite3')
+    store.upsert(ROWS)
+    assert ids(store.query(text='invoice')) == ['m2', 'm1']
+    assert ids(store.query(text='stories')) == ['m3']
+    assert ids(store.query(text='pa*', sender='@example.com')) == ['m2', 'm1']
+
+
+def test_upsert_replaces_messages_and_labels(tmp_path):
+    store = MessageStore(tmp_path / 'messages.sqlite3')
+    store.upsert(ROWS)
+    store.upsert([make_row('m3', 300, 'News <news@lists.test>', 'Monthly digest', 'Archive', ['TRASH'])])
+
+    assert store.count() == 3
+    message, = store.query(thread_id='m3')
+    assert (message['subject'], message['labels']) == ('Monthly digest', ['TRASH'])
+    assert store.query(label='CATEGORY_UPDATES') == []
+    # The full-text index follows updates
+    assert store.query(text='stories') == []
+    assert ids(store.query(text='archive')) == ['m3']
+    store.close()
+
+    # Upserts commit, so a reopened store sees them
+    assert MessageStore(tmp_path / 'messages.sqlite3').count() == 3
+
+
+def test_deleted_messages_leave_no_labels_or_text_behind(tmp_path):
+    store = MessageStore(tmp_path / 'messages.sqlite3')
+    store.upsert(ROWS)
+    assert store.apply_changes({'m1'}, {'m2': ['INBOX'], 'gone': ['INBOX']}, {}) == 2
+
+    assert ids(store.query()) == ['m3', 'm2']
+    assert store.query(thread_id='t1')[0]['labels'] == ['INBOX']
+    assert ids(store.query(text='please')) == []
+    assert store.existing_ids(['m1', 'm2', 'gone']) == {'m2'}
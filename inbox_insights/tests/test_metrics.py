@@ -0,0 +1,106 @@
+import json
+import threading
+import pytest
+from benchmarks.synthetic import make_messages
+from config.settings import METRICS_PREFIX
+from src.data_processor import DataProcessor
+from src.fake_gmail import FakeGmailService
+from src.gmail_client import GmailClient
+from src.metrics import STAGES, InMemoryMetrics, create_exporter
+
+
+def test_quantiles_interpolate_within_buckets():
+    metrics = InMemoryMetrics(buckets=(0.01, 0.1, 1.0))
+    for seconds in [0.005] * 50 + [0.05] * 50:
+        metrics.observe('fetch', seconds)
+    stats = metrics.stages()['fetch']
+    assert stats['count'] == 100 and stats['buckets'] == [50, 50, 0, 0]
+    assert metrics.quantile(stats, 0.25) == pytest.approx(0.005)
+    assert metrics.quantile(stats, 0.5) == pytest.approx(0.01)
+    assert metrics.quantile(stats, 0.6) == pytest.approx(0.01 + 0.09 * 10 / 50)
+    # Never above the slowest call
+    assert metrics.quantile(stats, 0.99) == pytest.approx(0.05)
+
+    metrics.observe('parse', 5.0)
+    metrics.observe('parse', 3.0)
+    # The overflow bucket is bounded by the maximum
+    assert metrics.quantile(metrics.stages()['parse'], 0.5) == pytest.approx(1.0 + 4.0 * 1 / 2)
+
+
+def test_recording_is_thread_safe():
+    metrics = InMemoryMetrics()
+
+    def work():
+        for _ in range(1000):
+            metrics.increment('api_calls', method='messages.get')
+            metrics.observe('fetch', 0.001)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.counters() == {('api_calls', (('method', 'messages.get'),)): 8000}
+    assert metrics.stages()['fetch']['count'] == 8000
+
+
+def make_metrics():
+    metrics = InMemoryMetrics(buckets=(0.01, 0.1))
+    metrics.observe('write', 0.2)
+    metrics.observe('fetch', 0.05)
+    metrics.observe('fetch', 0.005)
+    metrics.increment('api_calls', 3, method='messages.get')
+    metrics.increment('api_calls', method='batch')
+    metrics.increment('bytes_downloaded', 1024)
+    metrics.set_gauge('queue_depth', 4, queue='fetched')
+    metrics.set_gauge('queue_depth', 1, queue='fetched')
+    metrics.increment('odd', label='say "hi"\n')
+    return metrics
+
+
+def test_json_summary(tmp_path):
+    path = create_exporter('json', tmp_path / 'run.metrics.json').export(make_metrics())
+    summary = json.loads(path.read_text())
+    assert list(summary['stages']) == ['fetch', 'write']
+    assert summary['stages']['fetch']['calls'] == 2
+    assert summary['stages']['fetch']['max_ms'] == 50.0
+    assert summary['counters']['api_calls'] == {'batch': 1, 'messages.get': 3}
+    assert summary['counters']['bytes_downloaded'] == 1024
+    assert summary['gauges']['queue_depth'] == {'fetched': {'last': 1, 'max': 4}}
+    with pytest.raises(ValueError):
+        create_exporter('statsd', tmp_path / 'x')
+
+
+def test_prometheus_text_format(tmp_path):
+    path = create_exporter('prometheus', tmp_path / 'run.prom').export(make_metrics())
+    lines = path.read_text().splitlines()
+    samples = dict(line.rsplit(' ', 1) for line in lines if not line.startswith('#'))
+    name = f"{METRICS_PREFIX}_stage_seconds"
+
+    assert [samples[f'{name}_bucket{{stage="fetch",le="{bound}"}}'] for bound in ('0.01', '0.1', '+Inf')] == ['1', '2', '2']
+    assert samples[f'{name}_count{{stage="fetch"}}'] == '2'
+    assert samples[f'{name}_bucket{{stage="write",le="+Inf"}}'] == '1'
+    assert samples[f'{METRICS_PREFIX}_api_calls_total{{method="messages.get"}}'] == '3'
+    assert samples[f'{METRICS_PREFIX}_queue_depth{{queue="fetched"}}'] == '1'
+    assert samples[f'{METRICS_PREFIX}_queue_depth_max{{queue="fetched"}}'] == '4'
+    assert samples[f'{METRICS_PREFIX}_odd_total{{label="say \\"hi\\"\\n"}}'] == '1'
+    types = [line.split()[2] for line in lines if line.startswith('# TYPE')]
+    assert len(types) == len(set(types))
+    assert f"# TYPE {METRICS_PREFIX}_api_calls_total counter" in lines
+
+
+def test_ingestion_records_every_stage(tmp_path):
+    messages = make_messages(150)
+    for message in messages:
+        message['labelIds'] = ['INBOX']
+    metrics = InMemoryMetrics()
+    client = GmailClient(None, service=FakeGmailService(messages), metrics=metrics)
+    processor = DataProcessor(client, output_format='csv', output_dir=tmp_path, interactive=False, metrics=metrics)
+    processor.save_messages(client.iter_messages(), {}, session_id='s')
+
+    assert list(metrics.stages()) == list(STAGES)
+    counters = metrics.counters()
+    assert counters[('messages_fetched', ())] == 150
+    assert counters[('messages_written', ())] == 150
+    assert counters[('api_calls', (('method', 'messages.get'),))] == 150
+    assert counters[('api_calls', (('method', 'batch'),))] == 2
@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+import pytest
+from src.near_duplicates import NearDuplicateIndex, shingle_hashes
+
+NEWSLETTER = (
+    "Your daily digest for {day}: the markets closed higher today as technology shares rallied, "
+    "oil prices slipped and the central bank left interest rates unchanged. Read the full story, "
+    "manage your subscription or unsubscribe from these emails at any time."
+)
+
+
+def test_shingle_hashes_do_not_depend_on_the_hash_seed():
+    script = "from src.near_duplicates import shingle_hashes; print(shingle_hashes('the quick brown fox jumps').tolist())"
+    outputs = {
+        subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                       env={**os.environ, 'PYTHONHASHSEED': seed}).stdout
+        for seed in ('1', '2')
+    }
+    assert len(outputs) == 1
+    assert outputs.pop().strip() == str(shingle_hashes('the quick brown fox jumps').tolist())
+
+
+def test_clusters_persist_across_runs(tmp_path):
+    db_file = tmp_path / 'near_duplicates.sqlite3'
+    first_run = NearDuplicateIndex(db_file=db_file)
+    assert first_run.assign(['monday', 'other'], [NEWSLETTER.format(day='Monday'), 'an unrelated personal note']) \
+        == ['monday', 'other']
+
+    second_run = NearDuplicateIndex(db_file=db_file)
+    assert len(second_run) == 2
+    assert second_run.assign(['tuesday'], [NEWSLETTER.format(day='Tuesday')]) == ['monday']
+
+    # Clusters started in the second run are stored too
+    second_run.assign(['receipt'], ['thanks for your order, your receipt is attached'])
+    assert NearDuplicateIndex(db_file=db_file).assign(
+        ['receipt-2'], ['thanks for your order, your receipt is attached']
+    ) == ['receipt']
+
+
+def test_index_built_with_other_settings_is_rejected(tmp_path):
+    db_file = tmp_path / 'near_duplicates.sqlite3'
+    NearDuplicateIndex(db_file=db_file).assign(['monday'], [NEWSLETTER.format(day='Monday')])
+    with pytest.raises(ValueError):
+        NearDuplicateIndex(seed=2, db_file=db_file)
@@ -0,0 +1,88 @@
+import pytest
+from benchmarks.bench_search import HashingEmbedder
+from src.search_index import SearchIndex
+
+
+def add(index, start, stop, word):
+    ids = [f"m{n}" for n in range(start, stop)]
+    index.add_documents(ids, [f"{word} message {n}" for n in range(start, stop)])
+
+
+def ids(results):
+    return sorted(result['id'] for result in results)
+
+
+def test_bm25_ranks_by_term_frequency_and_rarity(tmp_path):
+    index = SearchIndex(tmp_path / 'search')
+    index.add_documents(['a', 'b', 'c', 'd'], [
+        'invoice invoice due', 'invoice due today', 'meeting due today', 'weekly report',
+    ])
+    assert [result['id'] for result in index.search('invoice')] == ['a', 'b']
+    # The rarer term outweighs the common one
+    assert index.search('due meeting')[0]['id'] == 'c'
+    assert index.search('unknown') == []
+
+
+def test_newer_copies_supersede_older_ones(tmp_path):
+    index = SearchIndex(tmp_path / 'search')
+    add(index, 0, 30, 'alpha')
+    add(index, 0, 5, 'beta')
+    assert len(index._segments) == 2
+    for index in (index, SearchIndex(tmp_path / 'search')):
+        assert len(index) == 30
+        assert ids(index.search('alpha', limit=100)) == sorted(f"m{n}" for n in range(5, 30))
+        assert ids(index.search('beta', limit=100)) == sorted(f"m{n}" for n in range(5))
+        assert len(index.search('message', limit=100)) == 30
+
+
+def test_segments_merge_into_their_predecessor(tmp_path):
+    index = SearchIndex(tmp_path / 'search')
+    add(index, 0, 8, 'alpha')
+    add(index, 8, 16, 'alpha')
+    assert len(index._segments) == 1
+    add(index, 16, 18, 'beta')
+    assert len(index._segments) == 2
+    # Replacing most of the first segment leaves it small enough to merge
+    add(index, 0, 12, 'gamma')
+    assert len(index._segments) == 1
+    assert sorted(path.name for path in (tmp_path / 'search').glob('seg-*')) == [index._segments[0].path.name]
+    assert len(index) == 18
+    assert ids(index.search('alpha', limit=100)) == sorted(f"m{n}" for n in range(12, 16))
+    assert ids(index.search('gamma', limit=100)) == sorted(f"m{n}" for n in range(12))
+
+
+def test_crash_before_the_manifest_is_saved_keeps_the_old_index(tmp_path, monkeypatch):
+    index = SearchIndex(tmp_path / 'search')
+    add(index, 0, 30, 'alpha')
+
+    def crash(self):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(SearchIndex, '_save_manifest', crash)
+        with pytest.raises(OSError):
+            add(SearchIndex(tmp_path / 'search'), 0, 5, 'beta')
+
+    index = SearchIndex(tmp_path / 'search')
+    assert len(index) == 30
+    assert len(index.search('alpha', limit=100)) == 30
+    assert index.search('beta') == []
+
+    add(index, 0, 5, 'beta')
+    index = SearchIndex(tmp_path / 'search')
+    assert ids(index.search('beta', limit=100)) == sorted(f"m{n}" for n in range(5))
+    assert len(index.search('alpha', limit=100)) == 25
+    # Only the live masks the manifest points to are kept
+    live_files = sorted(path.name for path in (tmp_path / 'search').glob('seg-*/live*.npy'))
+    assert live_files == sorted(segment.live_file for segment in index._segments)
+
+
+def test_semantic_search_skips_superseded_messages(tmp_path):
+    index = SearchIndex(tmp_path / 'search', HashingEmbedder(dim=32))
+    add(index, 0, 30, 'alpha')
+    add(index, 0, 5, 'beta')
+    results = index.semantic_search('beta message', limit=100)
+    assert ids(results) == sorted(f"m{n}" for n in range(30))
+    assert index.semantic_search('beta message 3', limit=1)[0]['id'] == 'm3'
+    with pytest.raises(ValueError):
+        SearchIndex(tmp_path / 'search').add_documents(['x'], ['no embedder'])
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+from benchmarks.synthetic import make_messages
+from src.data_processor import DataProcessor
+from src.fake_gmail import FakeGmailService
+from src.gmail_client import GmailClient
+from src.threads import ThreadTable, summarize_threads
+
+
+def make_row(message_id, thread_id, date, subject, sender, labels):
+    headers = [
+        {'name': 'From', 'value': sender},
+        {'name': 'To', 'value': 'me@example.com'},
+        {'name': 'Subject', 'value': subject},
+    ]
+    return {'id': message_id, 'threadId': thread_id, 'internalDate': str(date),
+            'payload': {'headers': headers}, 'labels': labels}
+
+
+def test_thread_summaries_merge_across_batches(tmp_path):
+    table = ThreadTable(tmp_path / 'threads_s', 'csv')
+    table.write([
+        make_row('m2', 't1', 200, 'Re: Plans', 'Bob <bob@example.com>', ['INBOX']),
+        make_row('m3', 't2', 300, 'Other', 'Carol <carol@example.com>', ['INBOX']),
+    ])
+    table.write([make_row('m1', 't1', 100, 'Plans', 'Alice <alice@example.com>', ['INBOX', 'STARRED'])])
+
+    final_path = table.finalize(tmp_path / 'threads_s_end')
+    assert not table.exists()
+    threads = pd.read_csv(final_path, dtype=str, keep_default_na=False).set_index('threadId')
+    assert threads.loc['t1', 'subject'] == 'Plans'
+    assert threads.loc['t1', 'message_count'] == '2'
+    assert (threads.loc['t1', 'first_date'], threads.loc['t1', 'last_date']) == ('100', '200')
+    assert threads.loc['t1', 'participants'] == str(['alice@example.com', 'bob@example.com', 'me@example.com'])
+    assert threads.loc['t1', 'labels'] == str(['INBOX', 'STARRED'])
+    assert threads.loc['t2', 'message_count'] == '1'
+
+
+def test_summaries_take_the_subject_of_the_earliest_message():
+    summary, = summarize_threads([
+        make_row('m2', 't1', 200, 'Re: Plans', 'bob@example.com', []),
+        make_row('m1', 't1', 100, 'Plans', 'alice@example.com', []),
+    ])
+    assert (summary['subject'], summary['first_date'], summary['last_date']) == ('Plans', 100, 200)
+
+
+def test_empty_table_is_not_written(tmp_path):
+    table = ThreadTable(tmp_path / 'threads_s', 'csv')
+    table.write([])
+    assert table.finalize(tmp_path / 'threads_s_end') is None
+
+
+@pytest.mark.parametrize('num_workers', [None, 2])
+def test_thread_fetch_saves_only_listed_messages(tmp_path, num_workers):
+    client = GmailClient(None, service=FakeGmailService(make_messages(60)))
+    listed = list(client.iter_messages(['INBOX'], fetch_profile='metadata'))
+    assert 0 < len(listed) < 60
+
+    processor = DataProcessor(client, output_format='csv', fetch_profile='metadata',
+                              output_dir=tmp_path, interactive=False)
+    saved_file = processor.save_messages(listed, {}, session_id='s', by_thread=True,
+                                         num_workers=num_workers)
+
+    saved = pd.read_csv(saved_file, dtype=str, keep_default_na=False)
+    assert sorted(saved['id']) == sorted(message['id'] for message in listed)
+    assert client.service.calls['threads.get'] == len({message['threadId'] for message in listed})
+    threads, = tmp_path.glob('threads_s_*.csv')
+    counts = pd.read_csv(threads, dtype={'threadId': str}).set_index('threadId')['message_count']
+    assert counts.to_dict() == saved.groupby('threadId').size().to_dict()
@@ -1,8 +1,16 @@
 import logging
-from typing import Optional, List
+import os
+from itertools import islice
+from typing import Optional, List, Dict, Set, Iterable, Iterator, TypeVar
 import pandas as pd
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+CSV_CHUNK_SIZE = 10000
+
+T = TypeVar('T')
+
 def setup_logging(log_level: int = logging.INFO) -> None:
     """
     Set up logging configuration.
@@ -15,10 +23,31 @@ def setup_logging(log_level: int = logging.INFO) -> None:
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
 
+def batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    Split an iterable into lists of at most size items without materializing it.
+    
+    Args:
+        iterable: Items to split
+        size: Maximum number of items per batch
+        
+    Yields:
+        Consecutive batches of items
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
 def combine_csv_files(file_paths: List[Path], output_path: Optional[Path] = None) -> pd.DataFrame:
     """
     Combine multiple CSV files into one.
     
+    Loads every file into memory; use src.merge.merge_sessions to merge
+    large exports with bounded memory and deduplication.
+    
     Args:
         file_paths: List of paths to CSV files
         output_path: Optional path to save combined file
@@ -32,4 +61,77 @@ def combine_csv_files(file_paths: List[Path], output_path: Optional[Path] = None
     if output_path:
         combined_df.to_csv(output_path, index=False)
     
-    return combined_df 
\ No newline at end of file
+    return combined_df
+
+def saved_message_ids(file_paths: List[Path], message_ids: Iterable[str]) -> Set[str]:
+    """
+    Find which messages are already stored in CSV files.
+    
+    Args:
+        file_paths: List of paths to CSV files
+        message_ids: IDs to look for
+        
+    Returns:
+        The IDs found in any of the files
+    """
+    wanted = set(message_ids)
+    found = set()
+    for file_path in file_paths:
+        if not wanted - found:
+            break
+        for chunk in pd.read_csv(file_path, usecols=['id'], dtype=str, keep_default_na=False,
+                                 chunksize=CSV_CHUNK_SIZE):
+            found.update(chunk['id'][chunk['id'].isin(wanted)])
+    return found
+
+def apply_message_changes(file_paths: List[Path], deleted_ids: Set[str],
+                          label_updates: Dict[str, List[str]],
+                          label_mappings: Dict[str, str]) -> int:
+    """
+    Apply deletions and label changes to stored CSV files in place.
+    
+    Only the id column of each file is scanned first; files containing an
+    affected message are then streamed in chunks and rewritten.
+    
+    Args:
+        file_paths: List of paths to CSV files
+        deleted_ids: IDs of messages to drop
+        label_updates: Message ID to its current list of label IDs
+        label_mappings: Dictionary mapping label IDs to label names
+        
+    Returns:
+        Number of rows removed or updated
+    """
+    affected = deleted_ids | set(label_updates)
+    changed_rows = 0
+    
+    for file_path in file_paths:
+        if not any(
+            chunk['id'].isin(affected).any()
+            for chunk in pd.read_csv(file_path, usecols=['id'], dtype=str, keep_default_na=False,
+                                     chunksize=CSV_CHUNK_SIZE)
+        ):
+            continue
+        
+        tmp_path = file_path.with_suffix('.tmp')
+        header = True
+        for chunk in pd.read_csv(file_path, dtype=str, keep_default_na=False,
+                                 chunksize=CSV_CHUNK_SIZE):
+            hits = chunk['id'].isin(affected)
+            if hits.any():
+                deleted = chunk['id'].isin(deleted_ids)
+                changed_rows += int(hits.sum())
+                chunk = chunk[~deleted]
+                for row_index in chunk.index[chunk['id'].isin(label_updates)]:
+                    label_ids = label_updates[chunk.at[row_index, 'id']]
+                    chunk.at[row_index, 'labelIds'] = str(label_ids)
+                    chunk.at[row_index, 'labels'] = str(
+                        [label_mappings.get(label_id, label_id) for label_id in label_ids]
+                    )
+            chunk.to_csv(tmp_path, header=header, index=False, mode='w' if header else 'a')
+            header = False
+        
+        os.replace(tmp_path, file_path)
+        logger.info(f"Applied changes to {file_path}")
+    
+    return changed_rows